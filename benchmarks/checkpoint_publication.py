@@ -0,0 +1,114 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures how fast simulated OplogThreads can publish their checkpoints
+while the Connector takes snapshots of them.
+
+Each shard thread publishes checkpoints the way OplogThread.update_checkpoint
+does, as fast as it can, while another thread takes a snapshot the way
+Connector.write_oplog_progress does. ProgressSlots is compared with a dict
+guarded by a single lock, which is how the checkpoints used to be shared.
+
+Usage: python benchmarks/checkpoint_publication.py [--shards N] [--seconds S]
+"""
+
+import optparse
+import sys
+import threading
+import time
+
+sys.path[0:0] = [""]
+
+from mongo_connector.progress_slots import ProgressSlots
+
+
+class LockedProgress(object):
+    """A dict shared under a single lock, for comparison."""
+
+    def __init__(self):
+        self.dict = {}
+        self.lock = threading.Lock()
+
+    def publish(self, name, value):
+        with self.lock:
+            if value is None:
+                self.dict.pop(name, None)
+            else:
+                self.dict[name] = value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.dict)
+
+
+def run(progress, shards, seconds, snapshot_interval):
+    """Return the number of checkpoints published per second."""
+    # The threads wait for each other to start, so that the busy ones
+    # don't slow down starting the rest.
+    go = threading.Event()
+    stop = threading.Event()
+    counts = [0] * shards
+
+    def tail(shard):
+        name = 'shard%d' % shard
+        old_name = 'Collection(local.oplog.rs, %d)' % shard
+        checkpoint = 0
+        go.wait()
+        while not stop.is_set():
+            checkpoint += 1
+            progress.publish(name, checkpoint)
+            progress.publish(old_name, None)
+        counts[shard] = checkpoint
+
+    def snapshot():
+        go.wait()
+        while not stop.is_set():
+            progress.snapshot()
+            time.sleep(snapshot_interval)
+
+    threads = [threading.Thread(target=tail, args=(shard,))
+               for shard in range(shards)]
+    threads.append(threading.Thread(target=snapshot))
+    for thread in threads:
+        thread.start()
+    started = time.time()
+    go.set()
+    time.sleep(seconds)
+    stop.set()
+    elapsed = time.time() - started
+    for thread in threads:
+        thread.join()
+    return sum(counts) / elapsed
+
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__.rsplit('\n', 2)[-2])
+    parser.add_option('--shards', type='int', default=64,
+                      help='Number of simulated shards (default 64).')
+    parser.add_option('--seconds', type='float', default=5,
+                      help='Duration of each run (default 5).')
+    parser.add_option('--snapshot-interval', type='float', default=0.001,
+                      help='Seconds between snapshots (default 0.001).')
+    options, _ = parser.parse_args()
+
+    for label, progress in (('locked dict', LockedProgress()),
+                            ('ProgressSlots', ProgressSlots())):
+        rate = run(progress, options.shards, options.seconds,
+                   options.snapshot_interval)
+        print('%-14s %d shards: %12.0f checkpoints/sec'
+              % (label, options.shards, rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An in-process stand-in for the parts of a replica set that an OplogThread
+reads from, so that the OplogThread can be benchmarked without MongoDB.
+
+Only what OplogThread uses is implemented. Queries are mostly ignored: the
+oplog only honors {'ts': {'$gte': ...}} and collections return all of their
+documents in _id order. In particular the namespace filter that the server
+would apply to the oplog is not, so every entry reaches
+OplogThread._should_skip_entry.
+"""
+
+import bisect
+import threading
+
+import pymongo
+
+from bson.codec_options import DEFAULT_CODEC_OPTIONS
+
+
+class FakeCursor(object):
+    """A cursor over a list of documents that may keep growing.
+
+    A tailable cursor stays alive once it has returned every document, and
+    waits up to ``await_secs`` for more, like a TAILABLE_AWAIT cursor.
+    """
+
+    def __init__(self, collection, start, tailable=False, limit=0,
+                 descending=False):
+        self._collection = collection
+        self._start = start
+        self._index = start
+        self._tailable = tailable
+        self._limit = abs(limit)
+        self._descending = descending
+        self._returned = 0
+        self.alive = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.alive or (self._limit and
+                              self._returned >= self._limit):
+            self.alive = False
+            raise StopIteration
+        docs = self._collection.docs
+        if self._descending:
+            index = len(docs) - 1 - (self._index - self._start)
+            if index < 0:
+                self.alive = False
+                raise StopIteration
+        else:
+            index = self._index
+            if index >= len(docs):
+                if not self._tailable or self._collection.closed:
+                    self.alive = False
+                    raise StopIteration
+                self._collection.wait_for(index)
+                docs = self._collection.docs
+                if index >= len(docs):
+                    # Caught up, the cursor stays alive.
+                    raise StopIteration
+        self._index += 1
+        self._returned += 1
+        return docs[index]
+
+    next = __next__
+
+    def clone(self):
+        return FakeCursor(self._collection, self._start, self._tailable,
+                          self._limit, self._descending)
+
+    def remove_option(self, option):
+        if option == pymongo.CursorType.TAILABLE_AWAIT:
+            self._tailable = False
+        return self
+
+    def limit(self, limit):
+        self._limit = abs(limit)
+        return self
+
+    def sort(self, key, direction=pymongo.ASCENDING):
+        self._descending = direction == pymongo.DESCENDING
+        return self
+
+    def hint(self, index):
+        return self
+
+    def count(self):
+        return len(self._collection.docs) - self._start
+
+
+class FakeCollection(object):
+    """A collection whose documents are kept in a list, in _id order."""
+
+    # Cursors on collections other than the oplog are never tailable.
+    closed = True
+
+    def __init__(self, database, name, docs=()):
+        self.database = database
+        self.name = name
+        self.full_name = '%s.%s' % (database.name, name)
+        self.codec_options = DEFAULT_CODEC_OPTIONS
+        self.docs = sorted(docs, key=lambda doc: doc['_id'])
+
+    def __getattr__(self, name):
+        # collection.sub is the collection named "collection.sub".
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.database['%s.%s' % (self.name, name)]
+
+    def with_options(self, **kwargs):
+        return self
+
+    def find(self, filter=None, projection=None, sort=None, **kwargs):
+        return FakeCursor(self, 0)
+
+    def find_one(self, *args, **kwargs):
+        return self.docs[0] if self.docs else None
+
+    def count(self):
+        return len(self.docs)
+
+
+class FakeOplog(FakeCollection):
+    """The oplog of a replica set.
+
+    Entries are kept in timestamp order and may be appended while
+    OplogThreads tail the oplog.
+    """
+
+    def __init__(self, database, entries=(), await_secs=1):
+        self.database = database
+        self.name = 'oplog.rs'
+        self.full_name = 'local.oplog.rs'
+        self.codec_options = DEFAULT_CODEC_OPTIONS
+        self.docs = list(entries)
+        self._timestamps = [entry['ts'] for entry in self.docs]
+        self._appended = threading.Condition()
+        self.await_secs = await_secs
+        # Set to end the tailable cursors once every entry is read.
+        self.closed = False
+
+    def append(self, entries):
+        """Add entries, newer than the existing ones, to the oplog."""
+        with self._appended:
+            for entry in entries:
+                self.docs.append(entry)
+                self._timestamps.append(entry['ts'])
+            self._appended.notify_all()
+
+    def close(self):
+        """Stop tailable cursors once they have read every entry."""
+        with self._appended:
+            self.closed = True
+            self._appended.notify_all()
+
+    def wait_for(self, index):
+        """Wait up to await_secs for the entry at ``index`` to exist."""
+        with self._appended:
+            if len(self.docs) <= index and not self.closed:
+                self._appended.wait(self.await_secs)
+
+    def find(self, filter=None, cursor_type=pymongo.CursorType.NON_TAILABLE,
+             **kwargs):
+        start = 0
+        ts_query = (filter or {}).get('ts')
+        if isinstance(ts_query, dict) and '$gte' in ts_query:
+            start = bisect.bisect_left(self._timestamps, ts_query['$gte'])
+        return FakeCursor(
+            self, start,
+            tailable=cursor_type == pymongo.CursorType.TAILABLE_AWAIT)
+
+
+class FakeDatabase(object):
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._collections = {}
+
+    def __getitem__(self, name):
+        collection = self._collections.get(name)
+        if collection is None:
+            # Like MongoDB, a collection only exists once it has documents.
+            collection = FakeCollection(self, name)
+        return collection
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def add_collection(self, collection):
+        self._collections[collection.name] = collection
+
+    def collection_names(self):
+        return list(self._collections)
+
+    def command(self, name, *args, **kwargs):
+        if name.lower() == 'ismaster':
+            return {'ismaster': True, 'setName': self.client.set_name}
+        raise pymongo.errors.OperationFailure(
+            'no such command: %s' % name)
+
+
+class FakeClient(object):
+    """A client connected to the primary of a replica set.
+
+    ``collections`` maps namespaces to the documents of the collections
+    that the collection dump reads.
+    """
+
+    def __init__(self, oplog_entries=(), collections=None,
+                 set_name='benchmark', await_secs=1):
+        self.set_name = set_name
+        self._databases = {}
+        local = self['local']
+        self.oplog = FakeOplog(local, oplog_entries, await_secs)
+        local.add_collection(self.oplog)
+        for namespace, docs in (collections or {}).items():
+            db_name, coll_name = namespace.split('.', 1)
+            database = self[db_name]
+            database.add_collection(
+                FakeCollection(database, coll_name, docs))
+
+    def __getitem__(self, name):
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases[name] = FakeDatabase(self, name)
+        return database
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def database_names(self):
+        return list(self._databases)
+
+    def close(self):
+        pass
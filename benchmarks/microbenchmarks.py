@@ -0,0 +1,329 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures the functions that an OplogThread calls for every oplog entry.
+
+The groups of cases are:
+
+  lookup    NamespaceConfig.lookup of included plain namespaces, namespaces
+            included by wildcards and namespaces excluded by wildcards, the
+            first time a namespace is seen (the cache is disabled) and once
+            it is cached.
+  regexset  RegexSet.__contains__ of namespaces that match one of the
+            wildcards and namespaces that don't, with and without the cache.
+  filter    OplogThread.filter_oplog_entry of inserts, $set updates and
+            replacements with include and exclude field sets.
+  update    DocManagerBase.apply_update of $set at the top level and deep in
+            the document, $set with $unset, and replacements.
+
+Namespace cases vary the number of rules with --rules and document cases
+vary the shape of the documents with --shapes. Each case reports the best
+time per call over --repeat rounds.
+
+Save the results with --save and compare another run with them using
+--compare. To follow the cases over time, --history appends each run to a
+file and compares it with the run before.
+
+Usage: python benchmarks/microbenchmarks.py [options]
+"""
+
+import copy
+import optparse
+import sys
+
+sys.path[0:0] = [""]
+
+from bson.timestamp import Timestamp
+
+from benchmarks import results as bench_results
+from benchmarks.fake_mongo import FakeClient
+from mongo_connector.doc_managers.doc_manager_simulator import DocManager
+from mongo_connector.namespace_config import NamespaceConfig, RegexSet
+from mongo_connector.oplog_manager import OplogThread
+from mongo_connector.progress_slots import ProgressSlots
+from mongo_connector.stage_timer import now
+
+# The number of fields and the depth of the nested documents of each shape.
+SHAPES = {
+    'small': (5, 1),
+    'wide': (100, 1),
+    'deep': (10, 6),
+}
+
+GROUPS = ('lookup', 'regexset', 'filter', 'update')
+
+# The number of distinct namespaces looked up by the namespace cases.
+NAMESPACES = 1000
+
+
+def make_document(num_fields, depth):
+    """Return a document with ``num_fields`` fields at each level, nested
+    ``depth`` levels deep under the field "nested".
+    """
+    doc = {}
+    for i in range(num_fields):
+        doc['f%d' % i] = i if i % 2 else 'value %d' % i
+    if depth > 1:
+        doc['nested'] = make_document(num_fields, depth - 1)
+    return doc
+
+
+def deepest_path(depth, field='f0'):
+    return '.'.join(['nested'] * (depth - 1) + [field])
+
+
+def measure(run, setup=None, repeat=5):
+    """Return the best time per call in nanoseconds over ``repeat`` rounds.
+
+    ``run`` takes what ``setup`` returns, which is not timed, and returns
+    the number of calls it made.
+    """
+    best = None
+    for _ in range(repeat):
+        state = setup() if setup is not None else None
+        started = now()
+        calls = run(state)
+        per_call = (now() - started) / calls
+        if best is None or per_call < best:
+            best = per_call
+    return best * 1e9
+
+
+def lookup_cases(rules):
+    """Yield the name, setup and run of each NamespaceConfig.lookup case.
+    """
+    plain = ['db%d.coll%d' % (i, i) for i in range(rules)]
+    wildcards = ['db%d.coll*' % i for i in range(rules)]
+    matching = ['db%d.coll%d' % (i % rules, i) for i in range(NAMESPACES)]
+    kinds = (
+        ('plain', {'namespace_set': plain}, plain),
+        ('wildcard', {'namespace_set': wildcards}, matching),
+        ('excluded', {'ex_namespace_set': wildcards}, matching),
+    )
+    for kind, config, namespaces in kinds:
+        for cached in (False, True):
+            def setup(config=config, namespaces=namespaces, cached=cached):
+                namespace_config = NamespaceConfig(
+                    cache_size=NAMESPACES if cached else 0, **config)
+                if cached:
+                    for namespace in namespaces:
+                        namespace_config.lookup(namespace)
+                return namespace_config.lookup, namespaces
+
+            yield ('lookup %s %s rules=%d' % (
+                kind, 'cached' if cached else 'first-seen', rules),
+                setup, _call_each)
+
+
+def regexset_cases(rules):
+    """Yield the name, setup and run of each RegexSet.__contains__ case."""
+    wildcards = ['db%d.coll*' % i for i in range(rules)]
+    hits = ['db%d.coll%d' % (i % rules, i) for i in range(NAMESPACES)]
+    misses = ['other%d.coll%d' % (i % rules, i) for i in range(NAMESPACES)]
+    for kind, namespaces in (('hit', hits), ('miss', misses)):
+        for cached in (False, True):
+            def setup(namespaces=namespaces, cached=cached):
+                regex_set = RegexSet.from_namespaces(
+                    wildcards, cache_size=NAMESPACES if cached else 0)
+                if cached:
+                    for namespace in namespaces:
+                        namespace in regex_set
+                return regex_set.__contains__, namespaces
+
+            yield ('regexset %s %s rules=%d' % (
+                kind, 'cached' if cached else 'uncached', rules),
+                setup, _call_each)
+
+
+def _call_each(state):
+    func, args = state
+    for arg in args:
+        func(arg)
+    return len(args)
+
+
+def _oplog_thread():
+    client = FakeClient([{'ts': Timestamp(1, 0), 'op': 'n', 'ns': '',
+                          'o': {}}])
+    return OplogThread(client, (DocManager(),), ProgressSlots(),
+                       NamespaceConfig())
+
+
+def filter_cases(shape, count):
+    """Yield the name, setup and run of each filter_oplog_entry case."""
+    num_fields, depth = SHAPES[shape]
+    doc = make_document(num_fields, depth)
+    deep = deepest_path(depth)
+    entries = {
+        'insert': {'op': 'i', 'ns': 'db.coll', 'o': dict(doc, _id=1)},
+        'set': {'op': 'u', 'ns': 'db.coll', 'o2': {'_id': 1},
+                'o': {'$set': {'f0': 1, 'f1': 2, deep: 3}}},
+        'replace': {'op': 'u', 'ns': 'db.coll', 'o2': {'_id': 1},
+                    'o': dict(doc, _id=1)},
+    }
+    # Keep half of the top level fields and one field at each level below.
+    half = ['f%d' % i for i in range(0, num_fields, 2)]
+    nested = [deepest_path(level) for level in range(2, depth + 1)]
+    field_sets = (
+        ('include', {'include_fields': half + nested}),
+        ('exclude', {'exclude_fields': half + nested}),
+    )
+    opman = _oplog_thread()
+    for filter_name, fields in field_sets:
+        for op, entry in sorted(entries.items()):
+            # Filtering changes the entries, so each call gets a copy.
+            def setup(entry=entry):
+                return [copy.deepcopy(entry) for _ in range(count)]
+
+            def run(entries, fields=fields):
+                for entry in entries:
+                    opman.filter_oplog_entry(entry, **fields)
+                return len(entries)
+
+            yield ('filter %s %s shape=%s' % (filter_name, op, shape),
+                   setup, run)
+
+
+def update_cases(shape, count):
+    """Yield the name, setup and run of each apply_update case."""
+    num_fields, depth = SHAPES[shape]
+    doc = make_document(num_fields, depth)
+    deep = deepest_path(depth)
+    specs = (
+        ('set top', {'$set': {'f0': 1, 'f1': 2}}),
+        ('set deep', {'$set': {deep: 1, deepest_path(depth, 'new'): 2}}),
+        # $unset runs after $set, so the spec can be applied repeatedly.
+        ('set unset', {'$set': {'f0': 1, 'added.field': 2},
+                       '$unset': {'added.field': True}}),
+        ('replace', dict(doc, f0=1)),
+    )
+    docman = DocManager()
+    for spec_name, spec in specs:
+        def setup(spec=spec):
+            return copy.deepcopy(doc), spec
+
+        def run(state):
+            doc, spec = state
+            apply_update = docman.apply_update
+            for _ in range(count):
+                apply_update(doc, spec)
+            return count
+
+        yield 'update %s shape=%s' % (spec_name, shape), setup, run
+
+
+def cases(options):
+    groups = options.groups.split(',')
+    rule_counts = [int(rules) for rules in options.rules.split(',')]
+    shapes = options.shapes.split(',')
+    for group in groups:
+        if group not in GROUPS:
+            raise ValueError('Unknown group: %r' % group)
+    if 'lookup' in groups:
+        for rules in rule_counts:
+            for case in lookup_cases(rules):
+                yield case
+    if 'regexset' in groups:
+        for rules in rule_counts:
+            for case in regexset_cases(rules):
+                yield case
+    if 'filter' in groups:
+        for shape in shapes:
+            for case in filter_cases(shape, options.count):
+                yield case
+    if 'update' in groups:
+        for shape in shapes:
+            for case in update_cases(shape, options.count):
+                yield case
+
+
+def run_cases(options):
+    results = []
+    for name, setup, run in cases(options):
+        result = {'case': name,
+                  'ns_per_call': measure(run, setup, options.repeat)}
+        results.append(result)
+        print('%-50s %12.0f' % (name, result['ns_per_call']))
+        sys.stdout.flush()
+    return results
+
+
+def option_parser():
+    parser = optparse.OptionParser(usage=__doc__.rsplit('\n', 2)[-2])
+    parser.add_option('--groups', default=','.join(GROUPS),
+                      help='Comma separated groups of cases: %s (default '
+                           'all).' % ', '.join(GROUPS))
+    parser.add_option('--rules', default='1,10,100,1000',
+                      help='Comma separated numbers of namespace rules '
+                           '(default 1,10,100,1000).')
+    parser.add_option('--shapes', default='small,wide,deep',
+                      help='Comma separated document shapes: %s (default '
+                           'all).' % ', '.join(sorted(SHAPES)))
+    parser.add_option('--count', type='int', default=1000,
+                      help='Calls per round of the document cases '
+                           '(default 1000).')
+    parser.add_option('--repeat', type='int', default=5,
+                      help='Rounds per case, the best is reported '
+                           '(default 5).')
+    parser.add_option('--save', metavar='FILE',
+                      help='Save the results to FILE as JSON.')
+    parser.add_option('--compare', metavar='FILE',
+                      help='Compare the time per call with the results '
+                           'saved in FILE and exit with status 1 on a '
+                           'regression.')
+    parser.add_option('--history', metavar='FILE',
+                      help='Append the results to the history in FILE, '
+                           'and compare them with the previous run.')
+    parser.add_option('--label',
+                      help='Label of the run in the history, eg a commit.')
+    parser.add_option('--tolerance', type='float', default=0.1,
+                      help='Fraction by which a case may get slower than '
+                           'the results it is compared with (default 0.1).')
+    return parser
+
+
+def main():
+    options, _ = option_parser().parse_args()
+
+    print('%-50s %12s' % ('case', 'ns/call'))
+    results = run_cases(options)
+
+    baselines = []
+    if options.compare:
+        baselines.append((options.compare,
+                          bench_results.load(options.compare)))
+    if options.history:
+        history = bench_results.load_history(options.history)
+        if history:
+            previous = history[-1]
+            baselines.append(('the previous run in %s (%s)' % (
+                options.history, previous['label'] or 'unlabelled'),
+                previous['results']))
+        bench_results.append_history(options.history, results,
+                                     options.label)
+    if options.save:
+        bench_results.save(options.save, results)
+
+    regressions = []
+    for name, baseline in baselines:
+        print('\nChange in time per call since %s:' % name)
+        regressions.extend(bench_results.compare(
+            results, baseline, 'ns_per_call', options.tolerance,
+            higher_is_better=False))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,416 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Generates synthetic oplogs and replays them into an OplogThread.
+
+"generate" writes a BSON file of oplog entries that mix inserts, updates
+with $set at various depths and whole document replacements, deletes and
+commands. The documents that are updated and deleted, and the namespaces
+that are written to, follow skewed distributions, so that some documents
+and namespaces are much hotter than others. The entries are timestamped as
+if they were written at --source-rate entries per second.
+
+"replay" feeds a generated file to an OplogThread through the in-process
+oplog of fake_mongo, either at a fixed --rate or at a multiple of the rate
+the entries were written at (--speedup), and periodically reports how far
+the OplogThread is behind. The entries are applied to the DocManager
+simulator, or to any other DocManager with --doc-manager, so the capacity
+of a target system can be measured without a source cluster.
+
+Usage: python benchmarks/oplog_workload.py generate FILE [options]
+       python benchmarks/oplog_workload.py replay FILE [options]
+"""
+
+import optparse
+import random
+import sys
+import threading
+import time
+
+sys.path[0:0] = [""]
+
+import bson
+
+from bson.codec_options import CodecOptions
+from bson.timestamp import Timestamp
+
+from benchmarks.fake_mongo import FakeClient
+from mongo_connector import metrics, util
+from mongo_connector.doc_managers.doc_manager_simulator import DocManager
+from mongo_connector.namespace_config import NamespaceConfig
+from mongo_connector.oplog_manager import OplogThread
+from mongo_connector.progress_slots import ProgressSlots
+
+# The default share of each kind of operation, in percent.
+DEFAULT_MIX = 'insert=55,update=35,delete=8,command=2'
+
+# Updates that replace the whole document rather than use $set, in percent.
+REPLACE_PERCENT = 10
+
+
+def skewed_index(rng, count, skew):
+    """Return an index below ``count``. Low indexes are chosen more often
+    the higher ``skew`` is; a skew of 1 is uniform.
+    """
+    return min(int(count * rng.random() ** skew), count - 1)
+
+
+def parse_mix(mix):
+    """Parse "insert=55,update=35,..." into cumulative thresholds."""
+    shares = []
+    for item in mix.split(','):
+        op, share = item.split('=')
+        if op not in ('insert', 'update', 'delete', 'command'):
+            raise ValueError('Unknown operation in mix: %r' % op)
+        shares.append((op, float(share)))
+    total = sum(share for _, share in shares)
+    thresholds = []
+    cumulative = 0
+    for op, share in shares:
+        cumulative += share / total
+        thresholds.append((cumulative, op))
+    return thresholds
+
+
+class WorkloadGenerator(object):
+    """Generates oplog entries, one at a time."""
+
+    def __init__(self, options):
+        self.rng = random.Random(options.seed)
+        self.mix = parse_mix(options.mix)
+        self.namespaces = ['workload%d.coll%d' % (i % 20, i)
+                           for i in range(options.namespaces)]
+        self.doc_fields = options.doc_fields
+        self.max_set_depth = options.max_set_depth
+        self.id_skew = options.id_skew
+        self.ns_skew = options.ns_skew
+        self.source_rate = options.source_rate
+        self.start_time = options.start_time
+        # The (_id, namespace) of each document that exists. Documents near
+        # the front of the list are the hot ones.
+        self.live = []
+        self.next_id = 0
+        # The temporary collections created by commands, not yet dropped.
+        self.temp_collections = []
+        self.count = 0
+
+    def timestamp(self):
+        # Entries are spread evenly over each second.
+        seconds, inc = divmod(self.count, self.source_rate)
+        return Timestamp(self.start_time + seconds, inc + 1)
+
+    def document(self, _id):
+        rng = self.rng
+        doc = {'_id': _id}
+        for i in range(max(1, int(self.doc_fields * rng.uniform(0.5, 1.5)))):
+            kind = i % 4
+            if kind == 0:
+                doc['f%d' % i] = rng.randint(0, 1 << 30)
+            elif kind == 1:
+                doc['f%d' % i] = 'text %d' % rng.randint(0, 1 << 20)
+            elif kind == 2:
+                doc['f%d' % i] = [rng.random() for _ in range(3)]
+            else:
+                doc['f%d' % i] = rng.random() < 0.5
+        # Nested documents for the $set operations to reach into.
+        nested = doc
+        for depth in range(self.max_set_depth):
+            nested['l%d' % depth] = {'value': depth}
+            nested = nested['l%d' % depth]
+        return doc
+
+    def set_spec(self):
+        rng = self.rng
+        spec = {}
+        for _ in range(rng.randint(1, 3)):
+            depth = rng.randint(0, self.max_set_depth)
+            path = ['l%d' % level for level in range(depth)]
+            if rng.random() < 0.5:
+                path.append('f0')
+            else:
+                path.append('value')
+            spec['.'.join(path)] = rng.randint(0, 1 << 30)
+        return {'$set': spec}
+
+    def operation(self):
+        roll = self.rng.random()
+        for threshold, op in self.mix:
+            if roll < threshold:
+                return op
+        return self.mix[-1][1]
+
+    def next_entry(self):
+        rng = self.rng
+        op = self.operation()
+        if op in ('update', 'delete') and not self.live:
+            op = 'insert'
+        entry = {'ts': self.timestamp(), 'h': rng.randint(-1 << 62, 1 << 62),
+                 'v': 2}
+        if op == 'insert':
+            ns = self.namespaces[skewed_index(rng, len(self.namespaces),
+                                              self.ns_skew)]
+            _id = self.next_id
+            self.next_id += 1
+            self.live.append((_id, ns))
+            entry.update(op='i', ns=ns, o=self.document(_id))
+        elif op == 'update':
+            _id, ns = self.live[skewed_index(rng, len(self.live),
+                                             self.id_skew)]
+            if rng.random() * 100 < REPLACE_PERCENT:
+                spec = self.document(_id)
+            else:
+                spec = self.set_spec()
+            entry.update(op='u', ns=ns, o2={'_id': _id}, o=spec)
+        elif op == 'delete':
+            index = skewed_index(rng, len(self.live), self.id_skew)
+            _id, ns = self.live[index]
+            # Keep the hot documents at the front.
+            del self.live[index]
+            entry.update(op='d', ns=ns, o={'_id': _id})
+        else:
+            db = self.namespaces[rng.randrange(len(self.namespaces))].split(
+                '.', 1)[0]
+            if self.temp_collections and rng.random() < 0.5:
+                db, coll = self.temp_collections.pop(
+                    rng.randrange(len(self.temp_collections)))
+                command = {'drop': coll}
+            else:
+                coll = 'tmp%d' % self.count
+                self.temp_collections.append((db, coll))
+                command = {'create': coll}
+            entry.update(op='c', ns=db + '.$cmd', o=command)
+        self.count += 1
+        return entry
+
+
+def generate(path, options):
+    generator = WorkloadGenerator(options)
+    with open(path, 'wb') as oplog_file:
+        # The entry that the OplogThread resumes from.
+        oplog_file.write(bson.BSON.encode({
+            'ts': Timestamp(options.start_time - 1, 1), 'op': 'n', 'ns': '',
+            'o': {'msg': 'start of the workload'}}))
+        for _ in range(options.entries):
+            oplog_file.write(bson.BSON.encode(generator.next_entry()))
+    print('Wrote %d entries to %s' % (options.entries, path))
+
+
+def load(path, raw_bson=False):
+    codec_options = CodecOptions()
+    if raw_bson:
+        codec_options = CodecOptions(document_class=util.RawBSONDocument)
+    with open(path, 'rb') as oplog_file:
+        return list(bson.decode_file_iter(oplog_file, codec_options))
+
+
+def load_doc_manager(name, target_url):
+    """Create the DocManager in module ``name``, like --doc-manager."""
+    if '.' not in name:
+        name = 'mongo_connector.doc_managers.%s' % name
+    module = __import__(name, fromlist=('DocManager',))
+    if target_url:
+        return module.DocManager(target_url)
+    return module.DocManager()
+
+
+class Feeder(threading.Thread):
+    """Thread that appends entries to the fake oplog at a controlled rate.
+    """
+
+    def __init__(self, oplog, entries, rate=0, speedup=0):
+        super(Feeder, self).__init__()
+        self.oplog = oplog
+        self.entries = entries
+        self.rate = rate
+        self.speedup = speedup
+        self.appended = 0
+        self.daemon = True
+
+    def due(self, elapsed):
+        """Return how many entries should have been appended by now."""
+        if self.rate:
+            return int(elapsed * self.rate)
+        first = self.entries[0]['ts'].time
+        # Entries are appended one second of the workload at a time.
+        limit = first + elapsed * self.speedup
+        count = self.appended
+        while (count < len(self.entries) and
+               self.entries[count]['ts'].time <= limit):
+            count += 1
+        return count
+
+    def run(self):
+        started = time.time()
+        while self.appended < len(self.entries):
+            if self.rate or self.speedup:
+                due = min(self.due(time.time() - started), len(self.entries))
+            else:
+                due = len(self.entries)
+            if due > self.appended:
+                self.oplog.append(self.entries[self.appended:due])
+                self.appended = due
+            else:
+                time.sleep(0.01)
+        self.oplog.close()
+
+
+def entries_processed(replset_name):
+    counter = metrics.REGISTRY.get('mongo_connector_oplog_entries_total')
+    return sum(counter.labels(replset_name, op).value()
+               for op in ('insert', 'update', 'delete', 'command'))
+
+
+def replay(path, options):
+    entries = load(path, options.raw_bson)
+    checkpoint, entries = entries[0]['ts'], entries[1:]
+    if not entries:
+        raise ValueError('%s has no entries to replay' % path)
+    last_ts = entries[-1]['ts']
+    client = FakeClient([{'ts': checkpoint, 'op': 'n', 'ns': '', 'o': {}}])
+
+    if options.doc_manager:
+        docman = load_doc_manager(options.doc_manager, options.target_url)
+    else:
+        docman = DocManager()
+    namespace_config = NamespaceConfig(
+        include_fields=options.include_fields and
+        options.include_fields.split(','),
+        exclude_fields=options.exclude_fields and
+        options.exclude_fields.split(','))
+    kwargs = {'raw_bson': options.raw_bson, 'count_entries': True}
+    for option in options.option:
+        key, value = option.split('=', 1)
+        kwargs[key] = int(value)
+    opman = OplogThread(client, (docman,),
+                        ProgressSlots({client.set_name: checkpoint}),
+                        namespace_config, **kwargs)
+    server = None
+    if options.metrics_port:
+        server = metrics.MetricsServer(options.metrics_port)
+        server.start()
+
+    feeder = Feeder(client.oplog, entries, options.rate, options.speedup)
+    print('Replaying %d entries from %s' % (len(entries), path))
+    started = last_report = time.time()
+    opman.start()
+    feeder.start()
+    max_lag = 0
+    try:
+        while opman.checkpoint != last_ts:
+            if not opman.is_alive():
+                raise RuntimeError('The OplogThread stopped')
+            time.sleep(0.1)
+            appended = feeder.appended
+            lag = 0
+            if appended and opman.checkpoint is not None:
+                lag = (entries[appended - 1]['ts'].time -
+                       opman.checkpoint.time)
+            max_lag = max(max_lag, lag)
+            now = time.time()
+            if now - last_report >= options.report_interval:
+                last_report = now
+                print('%6.1fs appended %9d processed %9d checkpoint lag '
+                      '%4ds' % (now - started, appended,
+                                entries_processed(client.set_name), lag))
+                sys.stdout.flush()
+    finally:
+        elapsed = time.time() - started
+        client.oplog.close()
+        opman.join()
+        docman.stop()
+        if server is not None:
+            server.stop()
+    print('Applied %d entries in %.1fs: %.0f entries/sec, maximum '
+          'checkpoint lag %ds' % (len(entries), elapsed,
+                                  len(entries) / elapsed, max_lag))
+
+
+def option_parser():
+    parser = optparse.OptionParser(usage='\n'.join(
+        __doc__.rstrip().splitlines()[-2:]))
+    group = optparse.OptionGroup(parser, 'generate options')
+    group.add_option('--entries', type='int', default=100000,
+                     help='Number of oplog entries (default 100000).')
+    group.add_option('--mix', default=DEFAULT_MIX,
+                     help='Share of each operation (default %s).'
+                          % DEFAULT_MIX)
+    group.add_option('--namespaces', type='int', default=200,
+                     help='Number of namespaces (default 200).')
+    group.add_option('--ns-skew', type='float', default=1.5,
+                     help='Skew of the namespaces written to, 1 is '
+                          'uniform (default 1.5).')
+    group.add_option('--id-skew', type='float', default=3,
+                     help='Skew of the documents updated and deleted, 1 is '
+                          'uniform (default 3).')
+    group.add_option('--doc-fields', type='int', default=10,
+                     help='Average number of fields per document '
+                          '(default 10).')
+    group.add_option('--max-set-depth', type='int', default=3,
+                     help='Maximum depth of the fields set by updates '
+                          '(default 3).')
+    group.add_option('--source-rate', type='int', default=1000,
+                     help='Entries per second the workload is timestamped '
+                          'at (default 1000).')
+    group.add_option('--start-time', type='int', default=1500000000,
+                     help='Time of the first entry (default 1500000000).')
+    group.add_option('--seed', type='int', default=0,
+                     help='Random seed (default 0).')
+    parser.add_option_group(group)
+
+    group = optparse.OptionGroup(parser, 'replay options')
+    group.add_option('--rate', type='float', default=0,
+                     help='Entries per second to append to the oplog.')
+    group.add_option('--speedup', type='float', default=0,
+                     help='Append entries this many times faster than they '
+                          'were written. By default, and when neither '
+                          '--rate nor --speedup is given, every entry is '
+                          'appended at once.')
+    group.add_option('-d', '--doc-manager',
+                     help='DocManager module to replay into, eg '
+                          'mongo_doc_manager (default: the simulator).')
+    group.add_option('-t', '--target-url',
+                     help='URL of the target system of the DocManager.')
+    group.add_option('--include-fields',
+                     help='Comma separated fields to replicate.')
+    group.add_option('--exclude-fields',
+                     help='Comma separated fields not to replicate.')
+    group.add_option('--raw-bson', action='store_true', default=False,
+                     help='Read the oplog as raw BSON, like --raw-bson.')
+    group.add_option('--option', action='append', default=[],
+                     metavar='KEY=INT',
+                     help='Integer keyword argument of OplogThread, eg '
+                          'apply_threads=4 or stage_timing_interval=5. '
+                          'May be repeated.')
+    group.add_option('--metrics-port', type='int', default=0,
+                     help='Serve the metrics on this local port.')
+    group.add_option('--report-interval', type='float', default=5,
+                     help='Seconds between progress reports (default 5).')
+    parser.add_option_group(group)
+    return parser
+
+
+def main():
+    parser = option_parser()
+    options, args = parser.parse_args()
+
+    if len(args) != 2 or args[0] not in ('generate', 'replay'):
+        parser.error('expected "generate FILE" or "replay FILE"')
+    if args[0] == 'generate':
+        generate(args[1], options)
+    else:
+        replay(args[1], options)
+
+
+if __name__ == '__main__':
+    main()
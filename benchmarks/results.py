@@ -0,0 +1,96 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Saves benchmark results and compares them with earlier ones.
+
+Results are lists of dicts with a "case" name and numbers. They are saved
+as JSON so that a run can be compared with a baseline from another commit,
+or appended to a history of runs to follow each case over time.
+"""
+
+import json
+import os
+import resource
+import sys
+import time
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of this process in megabytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Bytes on macOS, kilobytes elsewhere.
+        return peak / (1024.0 * 1024)
+    return peak / 1024.0
+
+
+def cpu_seconds():
+    """Return the CPU time used by every thread of this process so far."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def save(path, results):
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=1, sort_keys=True)
+
+
+def load(path):
+    with open(path) as results_file:
+        return json.load(results_file)
+
+
+def load_history(path):
+    """Return the runs appended to the history file at ``path``, oldest
+    first, or an empty list if it doesn't exist yet.
+    """
+    if not os.path.exists(path):
+        return []
+    return load(path)
+
+
+def append_history(path, results, label=None):
+    """Append a run to the history file at ``path``.
+
+    Each run records when it happened and an optional ``label``, such as
+    the commit that was measured.
+    """
+    history = load_history(path)
+    history.append({'time': time.time(), 'label': label,
+                    'results': results})
+    save(path, history)
+    return history
+
+
+def compare(results, baseline, metric, tolerance, higher_is_better=True):
+    """Print how ``metric`` changed for each case since ``baseline``.
+
+    Returns the names of the cases that got worse by more than
+    ``tolerance``, a fraction.
+    """
+    previous = dict((result['case'], result) for result in baseline)
+    regressions = []
+    for result in results:
+        old = previous.get(result['case'])
+        if old is None or not old.get(metric):
+            continue
+        change = (result[metric] - old[metric]) / float(old[metric])
+        if not higher_is_better:
+            change = -change
+        flag = ''
+        if change < -tolerance:
+            regressions.append(result['case'])
+            flag = '  REGRESSION'
+        print('%-50s %+7.1f%%%s' % (result['case'], 100 * change, flag))
+    return regressions
@@ -0,0 +1,290 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures the end-to-end throughput of an OplogThread without MongoDB.
+
+The "oplog" cases tail a synthetic oplog through OplogThread.run, which
+filters, batches and applies each entry to the DocManager simulator. The
+"dump" cases run OplogThread.dump_collection over synthetic collections.
+The oplog and the collections are served in-process by fake_mongo, so only
+mongo-connector and the simulator are measured.
+
+Each case runs in its own process and reports entries (or documents) per
+second, CPU time per entry across every thread, and the peak RSS of the
+process, which includes the synthetic data. Cases cover every combination
+of document size, number of namespaces and field filter. Save the results
+of a run with --save and compare another run with them using --compare,
+which fails if a case got slower than --tolerance.
+
+Usage: python benchmarks/throughput.py [options]
+"""
+
+import itertools
+import json
+import optparse
+import random
+import subprocess
+import sys
+import threading
+import time
+
+sys.path[0:0] = [""]
+
+from bson import BSON
+from bson.timestamp import Timestamp
+
+from benchmarks import results as bench_results
+from benchmarks.fake_mongo import FakeClient
+from mongo_connector.doc_managers.doc_manager_simulator import DocManager
+from mongo_connector.namespace_config import NamespaceConfig
+from mongo_connector.oplog_manager import OplogThread
+from mongo_connector.progress_slots import ProgressSlots
+
+# The field filters each case may use.
+FILTERS = {
+    'none': {},
+    'include': {'include_fields': ['f0', 'f1', 'f2', 'nested.a']},
+    'exclude': {'exclude_fields': ['f1', 'f3', 'nested.b']},
+}
+
+# The fraction of the oplog entries that are updates and deletes, the rest
+# are inserts.
+UPDATE_RATIO = 0.2
+DELETE_RATIO = 0.1
+
+# The timestamp of the entry that the OplogThread resumes from.
+CHECKPOINT = Timestamp(1000, 0)
+
+
+def make_document(_id, num_fields):
+    """Return a document with about ``num_fields`` fields of mixed types.
+    """
+    doc = {'_id': _id}
+    for i in range(num_fields):
+        if i % 3 == 0:
+            doc['f%d' % i] = i * _id
+        elif i % 3 == 1:
+            doc['f%d' % i] = 'value %d of document %d' % (i, _id)
+        else:
+            doc['f%d' % i] = [i, float(_id)]
+    doc['nested'] = {'a': _id, 'b': 'nested value', 'c': {'d': True}}
+    return doc
+
+
+def namespaces(count):
+    """Return ``count`` namespaces, spread over up to 10 databases."""
+    return ['bench%d.coll%d' % (i % 10, i) for i in range(count)]
+
+
+def make_oplog(num_entries, num_fields, num_namespaces, seed=0):
+    """Return a list of inserts, updates and deletes on documents spread
+    over ``num_namespaces`` namespaces, after a checkpoint entry.
+    """
+    rng = random.Random(seed)
+    all_ns = namespaces(num_namespaces)
+    # The _ids of the documents that exist, and their namespace.
+    live = []
+    entries = [{'ts': CHECKPOINT, 'op': 'n', 'ns': '',
+                'o': {'msg': 'checkpoint'}}]
+    next_id = 0
+    for i in range(1, num_entries + 1):
+        ts = Timestamp(CHECKPOINT.time, i)
+        roll = rng.random()
+        if live and roll < DELETE_RATIO and i < num_entries:
+            index = rng.randrange(len(live))
+            live[index], live[-1] = live[-1], live[index]
+            _id, ns = live.pop()
+            entries.append({'ts': ts, 'op': 'd', 'ns': ns,
+                            'o': {'_id': _id}})
+        elif live and roll < DELETE_RATIO + UPDATE_RATIO and i < num_entries:
+            _id, ns = live[rng.randrange(len(live))]
+            entries.append({'ts': ts, 'op': 'u', 'ns': ns,
+                            'o2': {'_id': _id},
+                            'o': {'$set': {'f0': i, 'nested.a': i}}})
+        else:
+            # The last entry is always an insert, which is never filtered
+            # out, so that the benchmark knows when it has been applied.
+            ns = all_ns[next_id % num_namespaces]
+            entries.append({'ts': ts, 'op': 'i', 'ns': ns,
+                            'o': make_document(next_id, num_fields)})
+            live.append((next_id, ns))
+            next_id += 1
+    return entries
+
+
+class BenchmarkDocManager(DocManager):
+    """The DocManager simulator, which notes when an entry is applied."""
+
+    def __init__(self, last_ts):
+        super(BenchmarkDocManager, self).__init__()
+        self.last_ts = last_ts
+        self.applied = 0
+        self.done = threading.Event()
+
+    def apply_batch(self, entries):
+        super(BenchmarkDocManager, self).apply_batch(entries)
+        self.applied += len(entries)
+        if entries[-1]['ts'] == self.last_ts:
+            self.done.set()
+
+
+def run_oplog_case(case):
+    entries = make_oplog(case['entries'], case['fields'],
+                         case['namespaces'])
+    client = FakeClient(entries)
+    docman = BenchmarkDocManager(entries[-1]['ts'])
+    opman = OplogThread(
+        client, (docman,),
+        ProgressSlots({client.set_name: CHECKPOINT}),
+        NamespaceConfig(**FILTERS[case['filter']]),
+        **case.get('options', {}))
+
+    cpu_started = bench_results.cpu_seconds()
+    started = time.time()
+    opman.start()
+    if not docman.done.wait(case['timeout']):
+        raise RuntimeError('Timed out after applying %d entries'
+                           % docman.applied)
+    elapsed = time.time() - started
+    cpu = bench_results.cpu_seconds() - cpu_started
+    client.oplog.close()
+    opman.join()
+    return elapsed, cpu, case['entries']
+
+
+def run_dump_case(case):
+    all_ns = namespaces(case['namespaces'])
+    collections = dict((ns, []) for ns in all_ns)
+    for _id in range(case['entries']):
+        collections[all_ns[_id % len(all_ns)]].append(
+            make_document(_id, case['fields']))
+    client = FakeClient([{'ts': CHECKPOINT, 'op': 'n', 'ns': '',
+                          'o': {'msg': 'checkpoint'}}], collections)
+    docman = DocManager()
+    opman = OplogThread(
+        client, (docman,), ProgressSlots(),
+        NamespaceConfig(**FILTERS[case['filter']]),
+        **case.get('options', {}))
+
+    cpu_started = bench_results.cpu_seconds()
+    started = time.time()
+    if opman.dump_collection() is None:
+        raise RuntimeError('The collection dump failed')
+    elapsed = time.time() - started
+    cpu = bench_results.cpu_seconds() - cpu_started
+    return elapsed, cpu, case['entries']
+
+
+def run_case(case):
+    """Run a case in this process and return its result."""
+    if case['kind'] == 'oplog':
+        elapsed, cpu, count = run_oplog_case(case)
+    else:
+        elapsed, cpu, count = run_dump_case(case)
+    sample = make_document(0, case['fields'])
+    return {
+        'case': case_name(case),
+        'doc_bytes': len(BSON.encode(sample)),
+        'per_sec': count / elapsed,
+        'cpu_us': 1e6 * cpu / count,
+        'peak_rss_mb': bench_results.peak_rss_mb(),
+    }
+
+
+def run_case_in_subprocess(case):
+    """Run a case in a new process, so that its peak RSS is its own."""
+    output = subprocess.check_output(
+        [sys.executable, __file__, '--run-case', json.dumps(case)])
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def case_name(case):
+    return '%s fields=%d namespaces=%d filter=%s' % (
+        case['kind'], case['fields'], case['namespaces'], case['filter'])
+
+
+def cases(options):
+    def int_list(value):
+        return [int(item) for item in value.split(',')]
+
+    for kind, fields, num_ns, filter_name in itertools.product(
+            options.kinds.split(','), int_list(options.doc_fields),
+            int_list(options.namespaces), options.filters.split(',')):
+        if kind == 'dump' and filter_name != 'none':
+            # Fields are filtered by the projection of the dump's queries,
+            # which the fake collections don't apply.
+            continue
+        yield {'kind': kind, 'fields': fields, 'namespaces': num_ns,
+               'filter': filter_name, 'entries': options.entries,
+               'timeout': options.timeout}
+
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__.rsplit('\n', 2)[-2])
+    parser.add_option('--entries', type='int', default=20000,
+                      help='Oplog entries or documents per case '
+                           '(default 20000).')
+    parser.add_option('--kinds', default='oplog,dump',
+                      help='Comma separated kinds of cases: oplog, dump '
+                           '(default both).')
+    parser.add_option('--doc-fields', default='5,20,100',
+                      help='Comma separated numbers of fields per document '
+                           '(default 5,20,100).')
+    parser.add_option('--namespaces', default='1,100,1000',
+                      help='Comma separated numbers of namespaces '
+                           '(default 1,100,1000).')
+    parser.add_option('--filters', default='none,include,exclude',
+                      help='Comma separated field filters: %s (default '
+                           'all).' % ', '.join(sorted(FILTERS)))
+    parser.add_option('--timeout', type='float', default=600,
+                      help='Seconds to wait for each case (default 600).')
+    parser.add_option('--save', metavar='FILE',
+                      help='Save the results to FILE as JSON.')
+    parser.add_option('--compare', metavar='FILE',
+                      help='Compare entries/sec with the results saved in '
+                           'FILE and exit with status 1 on a regression.')
+    parser.add_option('--tolerance', type='float', default=0.1,
+                      help='Fraction by which a case may get slower than '
+                           'the --compare results (default 0.1).')
+    parser.add_option('--run-case', help=optparse.SUPPRESS_HELP)
+    options, _ = parser.parse_args()
+
+    if options.run_case:
+        print(json.dumps(run_case(json.loads(options.run_case))))
+        return
+
+    print('%-50s %9s %12s %10s %8s' % (
+        'case', 'doc bytes', 'entries/sec', 'cpu us/op', 'rss MB'))
+    results = []
+    for case in cases(options):
+        result = run_case_in_subprocess(case)
+        results.append(result)
+        print('%-50s %9d %12.0f %10.1f %8.1f' % (
+            result['case'], result['doc_bytes'], result['per_sec'],
+            result['cpu_us'], result['peak_rss_mb']))
+        sys.stdout.flush()
+
+    if options.save:
+        bench_results.save(options.save, results)
+    if options.compare:
+        print('\nChange in entries/sec since %s:' % options.compare)
+        regressions = bench_results.compare(
+            results, bench_results.load(options.compare), 'per_sec',
+            options.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Saves the oplog checkpoint of each replica set so that replication can be
+resumed.
+"""
+
+import json
+import logging
+import os
+
+from mongo_connector import errors, util
+
+
+LOG = logging.getLogger(__name__)
+
+CHECKPOINT_STORES = ('file', 'target')
+"""The names of the checkpoint stores that can be configured."""
+
+
+class CheckpointStore(object):
+    """Where the oplog checkpoints are saved.
+
+    Checkpoints are bson Timestamps keyed by the name of the replica set or
+    shard whose oplog they belong to.
+    """
+
+    def read(self):
+        """Return a dict of the saved checkpoints, or None if there are none.
+        """
+        raise NotImplementedError
+
+    def update(self, name, checkpoint):
+        """Called by the OplogThread of replica set ``name`` once every oplog
+        entry up to ``checkpoint`` has been applied to the target systems.
+        """
+        pass
+
+    def flush(self, checkpoints):
+        """Called periodically, and when the Connector stops, with a dict of
+        the current checkpoint of every OplogThread.
+        """
+        pass
+
+
+class FileCheckpointStore(CheckpointStore):
+    """Saves the checkpoints in a JSON file, the oplog progress file.
+
+    The file is rewritten each time the checkpoints are flushed, so a crash
+    replays the oplog entries applied since the last flush.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # The contents last written to the file.
+        self._written = None
+
+    def read(self):
+        # Check for empty file
+        try:
+            if os.stat(self.path).st_size == 0:
+                LOG.info("MongoConnector: Empty oplog progress file.")
+                return None
+        except OSError:
+            return None
+
+        with open(self.path, 'r') as progress_file:
+            try:
+                data = json.load(progress_file)
+            except ValueError:
+                LOG.exception(
+                    'Cannot read oplog progress file "%s". '
+                    'It may have been modified or truncated by another '
+                    'program. You can create a new progress file '
+                    'starting at the current moment in time by running '
+                    'mongo-connector --no-dump <other options>. '
+                    'You may also be trying to read an oplog progress file '
+                    'created with the old format for sharded clusters. '
+                    'See https://github.com/10gen-labs/mongo-connector/wiki'
+                    '/Oplog-Progress-File for complete documentation.'
+                    % self.path)
+                return None
+        # data format:
+        # [name, timestamp] = replica set
+        # [[name, timestamp], [name, timestamp], ...] = sharded cluster
+        if not isinstance(data[0], list):
+            data = [data]
+        return dict((name, util.long_to_bson_ts(timestamp))
+                    for name, timestamp in data)
+
+    def flush(self, checkpoints):
+        items = [[name, util.bson_ts_to_long(checkpoints[name])]
+                 for name in checkpoints]
+        if len(items) == 1:
+            # Write 1-dimensional array, as in previous versions.
+            json_str = json.dumps(items[0])
+        else:
+            # Write a 2d array to support sharded clusters.
+            json_str = json.dumps(items)
+        # Don't rewrite the file when no checkpoint has changed.
+        if json_str == self._written:
+            return
+        util.write_file_atomically(self.path, json_str)
+        self._written = json_str
+
+
+class TargetCheckpointStore(CheckpointStore):
+    """Saves the checkpoints in the target systems, through the DocManagers'
+    write_checkpoint and read_checkpoints methods.
+
+    Each checkpoint is saved as soon as the oplog entries before it have been
+    applied, so the checkpoints never run ahead of, or far behind, the data
+    in the target systems.
+    """
+
+    def __init__(self, doc_managers):
+        self.doc_managers = doc_managers
+
+    def read(self):
+        # Replay the oplog from the oldest checkpoint of any target system.
+        # A replica set is only resumed if every target system has a
+        # checkpoint for it.
+        checkpoints = None
+        for dm in self.doc_managers:
+            try:
+                dm_checkpoints = dm.read_checkpoints()
+            except NotImplementedError:
+                raise errors.InvalidConfiguration(
+                    "%s cannot store oplog checkpoints in the target system."
+                    % dm.__class__.__module__)
+            if checkpoints is None:
+                checkpoints = dict(dm_checkpoints)
+                continue
+            for name in list(checkpoints):
+                if name not in dm_checkpoints:
+                    del checkpoints[name]
+                else:
+                    checkpoints[name] = min(checkpoints[name],
+                                            dm_checkpoints[name])
+        return checkpoints or None
+
+    def update(self, name, checkpoint):
+        for dm in self.doc_managers:
+            try:
+                dm.write_checkpoint(name, checkpoint)
+            except (errors.OperationFailed, errors.ConnectionFailed):
+                # The target keeps its previous checkpoint, which is still
+                # safe to resume from.
+                LOG.exception("Unable to save oplog checkpoint %r of %s in "
+                              "the target system" % (checkpoint, name))
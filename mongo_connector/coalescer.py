@@ -0,0 +1,142 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Collapses consecutive oplog entries on the same document.
+"""
+
+import copy
+import logging
+
+from mongo_connector.errors import UpdateDoesNotApply
+from mongo_connector.util import document_key
+
+LOG = logging.getLogger(__name__)
+
+# Update operators that can be merged into a single update.
+_MERGEABLE_OPERATORS = frozenset(['$set', '$unset', '$v'])
+
+
+def coalesce_entries(entries):
+    """Return the net effect of a run of consecutive oplog entries.
+
+    Entries on the same (namespace, _id) are merged when possible:
+
+    - an update following an insert becomes an insert of the updated
+      document,
+    - an update following a replacement becomes a single replacement,
+    - consecutive $set/$unset updates on unrelated fields become one update,
+    - anything followed by a delete or an insert becomes that delete or
+      insert.
+
+    A merged entry takes the timestamp and the position of the last entry
+    it replaces. Commands are never merged and entries are never merged
+    across a command. The entries themselves are not modified.
+    """
+    result = []
+    # Maps document keys to the index of their latest entry in result.
+    latest = {}
+    for entry in entries:
+        operation = entry['op']
+        if operation == 'c':
+            latest.clear()
+        elif operation in ('i', 'u', 'd'):
+            if operation == 'u':
+                key = document_key(entry['ns'], entry['o2']['_id'])
+            else:
+                key = document_key(entry['ns'], entry['o']['_id'])
+            index = latest.get(key)
+            if index is not None:
+                merged = _merge(result[index], entry)
+                if merged is not None:
+                    result[index] = None
+                    entry = merged
+            latest[key] = len(result)
+        result.append(entry)
+    return [entry for entry in result if entry is not None]
+
+
+def _merge(first, second):
+    """Merge two entries on the same document, or return None."""
+    if second['op'] in ('i', 'd'):
+        return second
+    if first['op'] == 'd':
+        return None
+
+    update_spec = second['o']
+    if not _is_replacement(update_spec):
+        if not _is_mergeable(update_spec):
+            return None
+        if first['op'] == 'u' and not _is_replacement(first['o']):
+            if not _is_mergeable(first['o']):
+                return None
+            merged_spec = _merge_updates(first['o'], update_spec)
+            if merged_spec is None:
+                return None
+            return dict(second, o=merged_spec)
+
+    # Apply the update to the inserted or replacement document.
+    # DocManagerBase imports the connector module, which imports this one.
+    from mongo_connector.doc_managers.doc_manager_base import DocManagerBase
+    try:
+        document = DocManagerBase().apply_update(
+            copy.deepcopy(first['o']), update_spec)
+    except UpdateDoesNotApply:
+        LOG.debug("Not merging update %r into %r" % (update_spec, first))
+        return None
+    if first['op'] == 'i':
+        if '_id' not in document:
+            document = dict(document, _id=first['o']['_id'])
+        return dict(first, ts=second['ts'], o=document)
+    return dict(second, o=document)
+
+
+def _is_replacement(update_spec):
+    return not any(key.startswith('$') for key in update_spec)
+
+
+def _is_mergeable(update_spec):
+    return (_MERGEABLE_OPERATORS.issuperset(update_spec) and
+            update_spec.get('$v', 1) == 1)
+
+
+def _conflicts(path, other):
+    """Return True if one field path contains the other."""
+    return (path.startswith(other + '.') or
+            other.startswith(path + '.'))
+
+
+def _merge_updates(first, second):
+    """Merge two $set/$unset update specs, or return None.
+
+    A field written by both updates keeps the value from the second one.
+    The updates are not merged when a field in one of them is contained in
+    a different field in the other, since MongoDB rejects such updates.
+    """
+    second_fields = set(second.get('$set', ()))
+    second_fields.update(second.get('$unset', ()))
+    merged = {}
+    for operator in ('$set', '$unset'):
+        for field, value in first.get(operator, {}).items():
+            if field in second_fields:
+                continue
+            for other in second_fields:
+                if _conflicts(field, other):
+                    return None
+            merged.setdefault(operator, {})[field] = value
+    for operator in ('$set', '$unset'):
+        if operator in second:
+            merged.setdefault(operator, {}).update(second[operator])
+    if '$v' in second:
+        merged['$v'] = second['$v']
+    return merged
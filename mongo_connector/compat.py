@@ -17,6 +17,8 @@ if PY3:
     from urllib.error import URLError
     from urllib.error import HTTPError
 
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
     def u(s):
         return str(s)
 
@@ -33,5 +35,7 @@ else:
     from urllib2 import URLError
     from urllib2 import HTTPError
 
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
     def u(s):
         return unicode(s)
@@ -15,26 +15,31 @@
 """
 
 import copy
-import json
 import logging
 import logging.handlers
 import os
 import platform
 import pymongo
 import re
-import shutil
 import signal
 import ssl
 import sys
 import threading
 import time
 
+from bson import json_util
 from pymongo import MongoClient
 
 from mongo_connector import config, constants, errors, util
+from mongo_connector.checkpoint_store import (CHECKPOINT_STORES,
+                                              FileCheckpointStore,
+                                              TargetCheckpointStore)
+from mongo_connector.compat import reraise
 from mongo_connector.constants import __version__
-from mongo_connector.locking_dict import LockingDict
+from mongo_connector.dump_progress import DumpProgress
+from mongo_connector.metrics import MetricsServer
 from mongo_connector.oplog_manager import OplogThread
+from mongo_connector.progress_slots import ProgressSlots
 from mongo_connector.command_helper import CommandHelper
 from mongo_connector.util import log_fatal_exceptions, retry_until_ok
 from mongo_connector.namespace_config import (NamespaceConfig,
@@ -118,8 +123,38 @@ class Connector(threading.Thread):
         # The set of OplogThreads created
         self.shard_set = {}
 
-        # Dict of OplogThread/timestamp pairs to record progress
-        self.oplog_progress = LockingDict()
+        # The checkpoint of each OplogThread, to record progress
+        self.oplog_progress = ProgressSlots()
+
+        # The DumpProgress of each OplogThread whose collection dump is
+        # unfinished
+        self.dump_progress = ProgressSlots()
+
+        # Minimum number of seconds between writes of the progress files
+        self.oplog_progress_interval = kwargs.pop(
+            'oplog_progress_interval',
+            constants.DEFAULT_OPLOG_PROGRESS_INTERVAL)
+        self._last_progress_write = 0
+        # The contents last written to the dump progress file
+        self._written_dump_progress = None
+
+        # The local port that the metrics are served on, or 0 to not serve
+        # them
+        self.metrics_port = kwargs.pop('metrics_port',
+                                       constants.DEFAULT_METRICS_PORT)
+        self.metrics_server = None
+        # The OplogThreads only count the entries they replicate when the
+        # counts are served.
+        kwargs['count_entries'] = bool(self.metrics_port)
+
+        # Where the oplog checkpoints are saved
+        checkpoint_store = kwargs.pop('checkpoint_store', 'file')
+        if checkpoint_store == 'target':
+            self.checkpoint_store = TargetCheckpointStore(self.doc_managers)
+        elif self.oplog_checkpoint is not None:
+            self.checkpoint_store = FileCheckpointStore(self.oplog_checkpoint)
+        else:
+            self.checkpoint_store = None
 
         # Timezone awareness
         self.tz_aware = kwargs.get('tz_aware', False)
@@ -151,7 +186,9 @@ class Connector(threading.Thread):
             dest_mapping=kwargs.get('dest_mapping'),
             namespace_options=kwargs.get('namespace_options'),
             include_fields=kwargs.get('fields'),
-            exclude_fields=kwargs.get('exclude_fields')
+            exclude_fields=kwargs.get('exclude_fields'),
+            cache_size=kwargs.get('namespace_cache_size',
+                                  constants.DEFAULT_NAMESPACE_CACHE_SIZE)
         )
 
         # Initialize and set the command helper
@@ -159,7 +196,7 @@ class Connector(threading.Thread):
         for dm in self.doc_managers:
             dm.command_helper = command_helper
 
-        if self.oplog_checkpoint is not None:
+        if isinstance(self.checkpoint_store, FileCheckpointStore):
             if not os.path.exists(self.oplog_checkpoint):
                 info_str = ("MongoConnector: Can't find %s, "
                             "attempting to create an empty progress log" %
@@ -201,6 +238,19 @@ class Connector(threading.Thread):
             oplog_checkpoint=os.path.abspath(config['oplogFile']),
             collection_dump=(not config['noDump']),
             batch_size=config['batchSize'],
+            oplog_progress_interval=config['oplogProgressInterval'],
+            checkpoint_store=config['checkpointStore'],
+            metrics_port=config['metricsPort'],
+            stage_timing_interval=config['stageTimingInterval'],
+            oplog_queue_size=config['oplogQueueSize'],
+            apply_batch_size=config['applyBatchSize'],
+            coalesce_window=config['coalesceWindow'],
+            coalesce_window_ms=config['coalesceWindowMs'],
+            apply_threads=config['applyThreads'],
+            dump_threads=config['dumpThreads'],
+            dump_queue_size=config['dumpQueueSize'],
+            read_preference=config['readPreference.mode'],
+            max_staleness_seconds=config['readPreference.maxStalenessSeconds'],
             continue_on_error=config['continueOnError'],
             auth_username=config['authentication.adminUsername'],
             auth_key=auth_key,
@@ -211,11 +261,13 @@ class Connector(threading.Thread):
             dest_mapping=config['namespaces.mapping'],
             namespace_options=config['namespaces.namespace_options'],
             gridfs_set=config['namespaces.gridfs'],
+            namespace_cache_size=config['namespaceCacheSize'],
             ssl_certfile=config['ssl.sslCertfile'],
             ssl_keyfile=config['ssl.sslKeyfile'],
             ssl_ca_certs=config['ssl.sslCACerts'],
             ssl_cert_reqs=config['ssl.sslCertificatePolicy'],
-            tz_aware=config['timezoneAware']
+            tz_aware=config['timezoneAware'],
+            raw_bson=config['rawBson']
         )
         return connector
 
@@ -228,83 +280,97 @@ class Connector(threading.Thread):
             dm.stop()
 
     def write_oplog_progress(self):
-        """ Writes oplog progress to file provided by user
+        """ Writes oplog progress to the checkpoint store
         """
 
-        if self.oplog_checkpoint is None:
+        if self.checkpoint_store is None:
             return None
 
-        with self.oplog_progress as oplog_prog:
-            oplog_dict = oplog_prog.get_dict()
-        items = [[name, util.bson_ts_to_long(oplog_dict[name])]
-                 for name in oplog_dict]
-        if not items:
+        checkpoints = self.oplog_progress.snapshot()
+        if not checkpoints:
             return
 
-        # write to temp file
-        backup_file = self.oplog_checkpoint + '.backup'
-        os.rename(self.oplog_checkpoint, backup_file)
-
-        # for each of the threads write to file
-        with open(self.oplog_checkpoint, 'w') as dest:
-            if len(items) == 1:
-                # Write 1-dimensional array, as in previous versions.
-                json_str = json.dumps(items[0])
-            else:
-                # Write a 2d array to support sharded clusters.
-                json_str = json.dumps(items)
-            try:
-                dest.write(json_str)
-            except IOError:
-                # Basically wipe the file, copy from backup
-                dest.truncate()
-                with open(backup_file, 'r') as backup:
-                    shutil.copyfile(backup, dest)
+        self.checkpoint_store.flush(checkpoints)
 
-        os.remove(backup_file)
-
-    def read_oplog_progress(self):
-        """Reads oplog progress from file provided by user.
-        This method is only called once before any threads are spanwed.
+    def write_progress(self):
+        """Writes the oplog and collection dump progress files, at most once
+        every oplog_progress_interval seconds.
         """
+        now = time.time()
+        if now - self._last_progress_write < self.oplog_progress_interval:
+            return
+        self._last_progress_write = now
+        self.write_oplog_progress()
+        self.write_dump_progress()
 
+    @property
+    def dump_progress_file(self):
+        """The file that stores the progress of unfinished collection dumps,
+        next to the oplog progress file.
+        """
         if self.oplog_checkpoint is None:
             return None
+        return self.oplog_checkpoint + '.dump'
 
-        # Check for empty file
-        try:
-            if os.stat(self.oplog_checkpoint).st_size == 0:
-                LOG.info("MongoConnector: Empty oplog progress file.")
-                return None
-        except OSError:
+    def write_dump_progress(self):
+        """Writes the progress of unfinished collection dumps to the dump
+        progress file, or removes the file once all dumps are finished.
+
+        This must be called after write_oplog_progress, so that the progress
+        of a dump is only forgotten once its oplog checkpoint is saved.
+        """
+        dump_file = self.dump_progress_file
+        if dump_file is None:
+            return None
+
+        dump_dict = self.dump_progress.snapshot()
+        data = dict((name, dump_dict[name].to_dict()) for name in dump_dict)
+        if not data:
+            if os.path.exists(dump_file):
+                os.remove(dump_file)
+            self._written_dump_progress = None
+            return
+
+        json_str = json_util.dumps(data)
+        if json_str == self._written_dump_progress:
+            return
+        util.write_file_atomically(dump_file, json_str)
+        self._written_dump_progress = json_str
+
+    def read_dump_progress(self):
+        """Reads the progress of unfinished collection dumps from the dump
+        progress file.
+        This method is only called once before any threads are spawned.
+        """
+        dump_file = self.dump_progress_file
+        if dump_file is None or not os.path.exists(dump_file):
             return None
 
-        with open(self.oplog_checkpoint, 'r') as progress_file:
+        with open(dump_file, 'r') as progress_file:
             try:
-                data = json.load(progress_file)
-            except ValueError:
+                data = json_util.loads(progress_file.read())
+                progress = dict((name, DumpProgress.from_dict(data[name]))
+                                for name in data)
+            except (ValueError, KeyError, TypeError):
                 LOG.exception(
-                    'Cannot read oplog progress file "%s". '
-                    'It may be corrupt after Mongo Connector was shut down'
-                    'uncleanly. You can try to recover from a backup file '
-                    '(may be called "%s.backup") or create a new progress file '
-                    'starting at the current moment in time by running '
-                    'mongo-connector --no-dump <other options>. '
-                    'You may also be trying to read an oplog progress file '
-                    'created with the old format for sharded clusters. '
-                    'See https://github.com/10gen-labs/mongo-connector/wiki'
-                    '/Oplog-Progress-File for complete documentation.'
-                    % (self.oplog_checkpoint, self.oplog_checkpoint))
+                    'Cannot read collection dump progress file "%s". '
+                    'Unfinished collection dumps will be restarted.'
+                    % dump_file)
                 return
-            # data format:
-            # [name, timestamp] = replica set
-            # [[name, timestamp], [name, timestamp], ...] = sharded cluster
-            if not isinstance(data[0], list):
-                data = [data]
-            with self.oplog_progress:
-                self.oplog_progress.dict = dict(
-                    (name, util.long_to_bson_ts(timestamp))
-                    for name, timestamp in data)
+        self.dump_progress.load(progress)
+
+    def read_oplog_progress(self):
+        """Reads oplog progress from the checkpoint store.
+        This method is only called once before any threads are spanwed.
+        """
+
+        if self.checkpoint_store is None:
+            return None
+
+        checkpoints = self.checkpoint_store.read()
+        if checkpoints is None:
+            return None
+        self.oplog_progress.load(checkpoints)
 
     @staticmethod
     def copy_uri_options(hosts, mongodb_uri):
@@ -336,10 +402,34 @@ class Connector(threading.Thread):
             update_mininum_mongodb_version(Version.from_client(
                 self.create_authed_client(host)))
 
+    def start_metrics_server(self):
+        """Serve the metrics over HTTP, if a metrics port is configured."""
+        if not self.metrics_port:
+            return
+        try:
+            self.metrics_server = MetricsServer(self.metrics_port)
+        except (IOError, OSError):
+            LOG.exception("MongoConnector: Could not serve the metrics on "
+                          "port %d", self.metrics_port)
+            return
+        self.metrics_server.start()
+
+    def stop_metrics_server(self):
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+
     @log_fatal_exceptions
     def run(self):
         """Discovers the mongo cluster and creates a thread for each primary.
         """
+        self.start_metrics_server()
+        try:
+            self._run()
+        finally:
+            self.stop_metrics_server()
+
+    def _run(self):
         # Reset the global minimum MongoDB version
         update_mininum_mongodb_version(None)
         self.main_conn = self.create_authed_client()
@@ -357,6 +447,7 @@ class Connector(threading.Thread):
             LOG.always('Target DocManager: %s version: %s', name, version)
 
         self.read_oplog_progress()
+        self.read_dump_progress()
         conn_type = None
 
         try:
@@ -384,7 +475,8 @@ class Connector(threading.Thread):
             # non sharded configuration
             oplog = OplogThread(
                 self.main_conn, self.doc_managers, self.oplog_progress,
-                self.namespace_config, **self.kwargs)
+                self.namespace_config, dump_progress_dict=self.dump_progress,
+                checkpoint_store=self.checkpoint_store, **self.kwargs)
             self.shard_set[0] = oplog
             LOG.info('MongoConnector: Starting connection thread %s' %
                      self.main_conn)
@@ -401,7 +493,7 @@ class Connector(threading.Thread):
                         dm.stop()
                     return
 
-                self.write_oplog_progress()
+                self.write_progress()
                 time.sleep(1)
 
         else:       # sharded cluster
@@ -423,7 +515,7 @@ class Connector(threading.Thread):
                                 dm.stop()
                             return
 
-                        self.write_oplog_progress()
+                        self.write_progress()
                         time.sleep(1)
                         continue
                     try:
@@ -442,6 +534,8 @@ class Connector(threading.Thread):
                     oplog = OplogThread(
                         shard_conn, self.doc_managers, self.oplog_progress,
                         self.namespace_config, mongos_client=self.main_conn,
+                        dump_progress_dict=self.dump_progress,
+                        checkpoint_store=self.checkpoint_store,
                         **self.kwargs)
                     self.shard_set[shard_id] = oplog
                     msg = "Starting connection thread"
@@ -452,6 +546,7 @@ class Connector(threading.Thread):
             LOG.info("recieved signal %s: shutting down...", self.signal)
         self.oplog_thread_join()
         self.write_oplog_progress()
+        self.write_dump_progress()
 
     def oplog_thread_join(self):
         """Stops all the OplogThreads
@@ -538,6 +633,344 @@ def get_config_options():
         "You may want more frequent updates if you are at risk "
         "of falling behind the earliest timestamp in the oplog")
 
+    def apply_oplog_progress_interval(option, cli_values):
+        if cli_values['oplog_progress_interval'] is not None:
+            option.value = cli_values['oplog_progress_interval']
+        if option.value < 0:
+            raise errors.InvalidConfiguration(
+                "oplogProgressInterval must be non-negative.")
+
+    oplog_progress_interval = add_option(
+        config_key="oplogProgressInterval",
+        default=constants.DEFAULT_OPLOG_PROGRESS_INTERVAL,
+        type=int,
+        apply_function=apply_oplog_progress_interval)
+
+    # --oplog-progress-interval specifies how often the --oplog-ts config
+    # file is rewritten with the latest position of the oplog
+    oplog_progress_interval.add_cli(
+        "--oplog-progress-interval", type="int",
+        dest="oplog_progress_interval", help=
+        "Specify an int to wait at least N seconds between "
+        "writes of the --oplog-ts config file. The file is only rewritten "
+        "when the position of the oplog has changed, and it is always "
+        "written when mongo-connector shuts down. Larger values reduce disk "
+        "activity, at the cost of replaying more of the oplog after a "
+        "crash. By default, the file is written at most once a second.")
+
+    def apply_checkpoint_store(option, cli_values):
+        if cli_values['checkpoint_store'] is not None:
+            option.value = cli_values['checkpoint_store']
+        if option.value not in CHECKPOINT_STORES:
+            raise errors.InvalidConfiguration(
+                "checkpointStore must be one of: %s"
+                % ', '.join(CHECKPOINT_STORES))
+
+    checkpoint_store = add_option(
+        config_key="checkpointStore",
+        default="file",
+        type=str,
+        apply_function=apply_checkpoint_store)
+
+    # --checkpoint-store specifies where the oplog checkpoints are saved
+    checkpoint_store.add_cli(
+        "--checkpoint-store", dest="checkpoint_store",
+        choices=CHECKPOINT_STORES, help=
+        "Specify where to save the position of the oplog that has been "
+        "replicated. 'file' (the default) saves it in the --oplog-ts config "
+        "file. 'target' saves it in each target system as soon as the "
+        "oplog entries before it have been applied, so that no entries are "
+        "replayed after a crash and mongo-connector can run without a "
+        "persistent disk. Only DocManagers that implement write_checkpoint "
+        "and read_checkpoints, such as the MongoDB DocManager, support "
+        "'target'. The progress of an unfinished collection dump is still "
+        "saved next to the --oplog-ts file.")
+
+    def apply_metrics_port(option, cli_values):
+        if cli_values['metrics_port'] is not None:
+            option.value = cli_values['metrics_port']
+        if not 0 <= option.value <= 65535:
+            raise errors.InvalidConfiguration(
+                "metricsPort must be between 0 and 65535.")
+
+    metrics_port = add_option(
+        config_key="metricsPort",
+        default=constants.DEFAULT_METRICS_PORT,
+        type=int,
+        apply_function=apply_metrics_port)
+
+    # --metrics-port specifies the local port that the metrics are served on
+    metrics_port.add_cli(
+        "--metrics-port", type="int", dest="metrics_port", help=
+        "Specify a port to serve metrics at http://127.0.0.1:<port>/metrics "
+        "in the Prometheus text format: the oplog entries replicated by "
+        "each replica set by operation and by database, how long the calls "
+        "to the DocManagers take, the length of the oplog and apply queues, "
+        "the replication lag, the progress of the collection dump, and the "
+        "number of rollbacks. The endpoint only listens on the loopback "
+        "interface. By default (0), the metrics are not served.")
+
+    def apply_stage_timing_interval(option, cli_values):
+        if cli_values['stage_timing_interval'] is not None:
+            option.value = cli_values['stage_timing_interval']
+        if option.value < 0:
+            raise errors.InvalidConfiguration(
+                "stageTimingInterval must be non-negative.")
+
+    stage_timing_interval = add_option(
+        config_key="stageTimingInterval",
+        default=constants.DEFAULT_STAGE_TIMING_INTERVAL,
+        type=int,
+        apply_function=apply_stage_timing_interval)
+
+    # --stage-timing-interval specifies how often the time taken by each
+    # stage of the OplogThreads is reported
+    stage_timing_interval.add_cli(
+        "--stage-timing-interval", type="int",
+        dest="stage_timing_interval", help=
+        "Specify an int to time each stage that oplog entries go through: "
+        "reading the oplog (fetch), decoding BSON with --raw-bson "
+        "(decode; otherwise entries are decoded as they are read, as part "
+        "of fetch), checking the namespace (skip_check, which includes "
+        "filter), filtering "
+        "fields (filter), coalescing (coalesce), and the calls to the "
+        "DocManagers (apply_batch and insert_file). Every N seconds, the "
+        "number of calls, total time and percentiles of each stage are "
+        "logged and published to the metrics (see --metrics-port). This "
+        "shows whether the source or the target systems hold replication "
+        "back. By default (0), the stages are not timed.")
+
+    def apply_oplog_queue_size(option, cli_values):
+        if cli_values['oplog_queue_size'] is not None:
+            option.value = cli_values['oplog_queue_size']
+        if option.value < 0:
+            raise errors.InvalidConfiguration(
+                "oplogQueueSize must be non-negative.")
+
+    oplog_queue_size = add_option(
+        config_key="oplogQueueSize",
+        default=constants.DEFAULT_OPLOG_QUEUE_SIZE,
+        type=int,
+        apply_function=apply_oplog_queue_size)
+
+    # --oplog-queue-size specifies how many oplog entries may be read ahead
+    # of the entries being applied to the target systems
+    oplog_queue_size.add_cli(
+        "--oplog-queue-size", type="int", dest="oplog_queue_size", help=
+        "Specify an int to read oplog entries in a separate thread and "
+        "buffer up to N of them while earlier entries are being applied to "
+        "the target systems. This lets reading from the oplog overlap with "
+        "writing to the target systems. The oplog progress is only updated "
+        "once entries have been applied. By default (0), entries are read "
+        "and applied in the same thread.")
+
+    def apply_apply_batch_size(option, cli_values):
+        if cli_values['apply_batch_size'] is not None:
+            option.value = cli_values['apply_batch_size']
+        if option.value < 1:
+            raise errors.InvalidConfiguration(
+                "applyBatchSize must be positive.")
+
+    apply_batch_size = add_option(
+        config_key="applyBatchSize",
+        default=constants.DEFAULT_APPLY_BATCH_SIZE,
+        type=int,
+        apply_function=apply_apply_batch_size)
+
+    # --apply-batch-size specifies how many consecutive oplog entries may be
+    # handed to a DocManager at once
+    apply_batch_size.add_cli(
+        "--apply-batch-size", type="int", dest="apply_batch_size", help=
+        "Specify an int to apply up to N consecutive oplog entries to the "
+        "target systems at once. Entries are only batched when they are "
+        "read ahead with --oplog-queue-size, in which case they are applied "
+        "as soon as no more are waiting to be applied, or held to be "
+        "coalesced with --coalesce-window or --coalesce-window-ms. "
+        "Otherwise each entry is applied as soon as it is read. By default, "
+        "up to 1000 entries are applied at once.")
+
+    def apply_apply_threads(option, cli_values):
+        if cli_values['apply_threads'] is not None:
+            option.value = cli_values['apply_threads']
+        if option.value < 1:
+            raise errors.InvalidConfiguration(
+                "applyThreads must be positive.")
+
+    apply_threads = add_option(
+        config_key="applyThreads",
+        default=constants.DEFAULT_APPLY_THREADS,
+        type=int,
+        apply_function=apply_apply_threads)
+
+    # --apply-threads specifies how many threads apply oplog entries to the
+    # target systems for each replica set
+    apply_threads.add_cli(
+        "--apply-threads", type="int", dest="apply_threads", help=
+        "Specify an int to apply oplog entries from each replica set on N "
+        "threads. Entries are assigned to a thread based on their namespace "
+        "and _id, so operations on the same document are still applied in "
+        "order. Commands are applied once all preceding entries have been "
+        "applied. The oplog progress only includes entries that every "
+        "thread has applied. By default (1), entries are applied on the "
+        "thread that reads the oplog.")
+
+    def apply_dump_threads(option, cli_values):
+        if cli_values['dump_threads'] is not None:
+            option.value = cli_values['dump_threads']
+        if option.value < 1:
+            raise errors.InvalidConfiguration(
+                "dumpThreads must be positive.")
+
+    dump_threads = add_option(
+        config_key="dumpThreads",
+        default=constants.DEFAULT_DUMP_THREADS,
+        type=int,
+        apply_function=apply_dump_threads)
+
+    # --dump-threads specifies how many threads dump collections to each
+    # target system during the initial collection dump
+    dump_threads.add_cli(
+        "--dump-threads", type="int", dest="dump_threads", help=
+        "Specify an int to dump collections to each target system on N "
+        "threads during the initial collection dump. Collections are "
+        "dumped in parallel with each other, and large collections are "
+        "split into ranges of _ids that are dumped in parallel too. By "
+        "default (1), collections are dumped one after another.")
+
+    def apply_dump_queue_size(option, cli_values):
+        if cli_values['dump_queue_size'] is not None:
+            option.value = cli_values['dump_queue_size']
+        if option.value < 0:
+            raise errors.InvalidConfiguration(
+                "dumpQueueSize must be non-negative.")
+
+    dump_queue_size = add_option(
+        config_key="dumpQueueSize",
+        default=constants.DEFAULT_DUMP_QUEUE_SIZE,
+        type=int,
+        apply_function=apply_dump_queue_size)
+
+    # --dump-queue-size specifies how many documents may be read ahead of the
+    # documents being written during the initial collection dump
+    dump_queue_size.add_cli(
+        "--dump-queue-size", type="int", dest="dump_queue_size", help=
+        "Specify an int to read documents in a separate thread during the "
+        "initial collection dump, and buffer up to N of them while earlier "
+        "documents are being written to a target system. This lets reading "
+        "from MongoDB overlap with writing to the target systems. By "
+        "default (0), documents are read and written in the same thread.")
+
+    def apply_read_preference(option, cli_values):
+        if cli_values['read_preference']:
+            option.value['mode'] = cli_values['read_preference']
+        if cli_values['max_staleness_seconds'] is not None:
+            option.value['maxStalenessSeconds'] = (
+                cli_values['max_staleness_seconds'])
+
+        mode = option.value['mode']
+        max_staleness = option.value['maxStalenessSeconds']
+        if mode not in util.READ_PREFERENCE_MODES:
+            raise errors.InvalidConfiguration(
+                "readPreference.mode must be one of: %s." %
+                ", ".join(sorted(util.READ_PREFERENCE_MODES)))
+        if mode == 'primary':
+            if max_staleness != -1:
+                raise errors.InvalidConfiguration(
+                    "readPreference.maxStalenessSeconds can not be used "
+                    "with the primary read preference.")
+        elif max_staleness == -1:
+            raise errors.InvalidConfiguration(
+                "readPreference.maxStalenessSeconds is required to read "
+                "from secondaries, so that the oplog can be replayed from "
+                "before the oldest data they may return.")
+        elif max_staleness < 90:
+            raise errors.InvalidConfiguration(
+                "readPreference.maxStalenessSeconds must be at least 90.")
+        try:
+            util.read_preference(mode, max_staleness)
+        except ValueError:
+            reraise(errors.InvalidConfiguration, *sys.exc_info()[1:])
+
+    default_read_preference = {
+        'mode': 'primary',
+        'maxStalenessSeconds': -1
+    }
+
+    read_preference = add_option(
+        config_key="readPreference",
+        default=default_read_preference,
+        type=dict,
+        apply_function=apply_read_preference)
+
+    # --read-preference specifies where the collection dump and rollbacks
+    # read documents from
+    read_preference.add_cli(
+        "--read-preference", dest="read_preference", help=
+        "The read preference for the collection dump and for the documents "
+        "read again during a rollback: primary, primaryPreferred, "
+        "secondary, secondaryPreferred or nearest. The oplog is always read "
+        "from the primary. Reading from secondaries requires "
+        "--max-staleness-seconds. Defaults to primary.")
+
+    # --max-staleness-seconds specifies how far behind the primary a
+    # secondary may be to be read from
+    read_preference.add_cli(
+        "--max-staleness-seconds", type="int",
+        dest="max_staleness_seconds", help=
+        "The maximum number of seconds that a secondary may be behind the "
+        "primary to be read from, at least 90. The oplog is replayed from "
+        "this much earlier than the start of the collection dump or "
+        "rollback, so that changes a secondary has not replicated yet are "
+        "not missed.")
+
+    def apply_coalesce_window(option, cli_values):
+        if cli_values['coalesce_window'] is not None:
+            option.value = cli_values['coalesce_window']
+        if option.value < 0:
+            raise errors.InvalidConfiguration(
+                "coalesceWindow must be non-negative.")
+
+    coalesce_window = add_option(
+        config_key="coalesceWindow",
+        default=constants.DEFAULT_COALESCE_WINDOW,
+        type=int,
+        apply_function=apply_coalesce_window)
+
+    # --coalesce-window specifies how many oplog entries to hold so that
+    # operations on the same document can be merged
+    coalesce_window.add_cli(
+        "--coalesce-window", type="int", dest="coalesce_window", help=
+        "Specify an int to hold up to N oplog entries before applying "
+        "them, so that several operations on the same document are sent to "
+        "the target systems as a single operation. For example, an insert "
+        "followed by updates is applied as one insert of the updated "
+        "document. By default (0), entries are applied as soon as possible "
+        "without coalescing, unless --coalesce-window-ms is set.")
+
+    def apply_coalesce_window_ms(option, cli_values):
+        if cli_values['coalesce_window_ms'] is not None:
+            option.value = cli_values['coalesce_window_ms']
+        if option.value < 0:
+            raise errors.InvalidConfiguration(
+                "coalesceWindowMs must be non-negative.")
+
+    coalesce_window_ms = add_option(
+        config_key="coalesceWindowMs",
+        default=constants.DEFAULT_COALESCE_WINDOW_MS,
+        type=int,
+        apply_function=apply_coalesce_window_ms)
+
+    # --coalesce-window-ms specifies how long to hold oplog entries so that
+    # operations on the same document can be merged
+    coalesce_window_ms.add_cli(
+        "--coalesce-window-ms", type="int", dest="coalesce_window_ms", help=
+        "Specify an int to hold oplog entries for up to N milliseconds "
+        "before applying them, so that several operations on the same "
+        "document are sent to the target systems as a single operation. "
+        "This can be combined with --coalesce-window. By default (0), "
+        "entries are applied as soon as possible without coalescing, unless "
+        "--coalesce-window is set.")
+
     def apply_verbosity(option, cli_values):
         if cli_values['verbose']:
             option.value = 3
@@ -935,6 +1368,31 @@ def get_config_options():
         "test.fs.files and chunks are stored in test.fs.chunks, "
         "you can use `--gridfs-set test.fs`.")
 
+    def apply_namespace_cache_size(option, cli_values):
+        if cli_values['namespace_cache_size'] is not None:
+            option.value = cli_values['namespace_cache_size']
+        if option.value < 0:
+            raise errors.InvalidConfiguration(
+                "namespaceCacheSize must be non-negative.")
+
+    namespace_cache_size = add_option(
+        config_key="namespaceCacheSize",
+        default=constants.DEFAULT_NAMESPACE_CACHE_SIZE,
+        type=int,
+        apply_function=apply_namespace_cache_size)
+
+    # --namespace-cache-size specifies how many looked up namespaces are
+    # remembered
+    namespace_cache_size.add_cli(
+        "--namespace-cache-size", type="int", dest="namespace_cache_size",
+        help=
+        "Specify an int to remember how the namespaces configuration maps "
+        "up to N recently seen namespaces, including namespaces that are "
+        "not replicated. Older namespaces are looked up again "
+        "when they are seen, so memory use does not grow with the number "
+        "of namespaces in the source cluster. By default, up to 10000 "
+        "namespaces are remembered.")
+
     def apply_doc_managers(option, cli_values):
         if not option.value:
             if not cli_values['doc_manager'] and not cli_values['target_url']:
@@ -1192,6 +1650,26 @@ def get_config_options():
         "--tz-aware", dest="tz_aware", action="store_true",
         help="Make all dates and times timezone-aware.")
 
+    def apply_raw_bson(option, cli_values):
+        if cli_values['raw_bson']:
+            option.value = True
+        if option.value and util.RawBSONDocument is None:
+            raise errors.InvalidConfiguration(
+                "rawBson requires PyMongo 3.2 or later.")
+
+    raw_bson = add_option(
+        config_key="rawBson", default=False, type=bool,
+        apply_function=apply_raw_bson)
+
+    # --raw-bson to read oplog entries as raw BSON and only decode the
+    # documents they contain when they are needed
+    raw_bson.add_cli(
+        "--raw-bson", dest="raw_bson", action="store_true", help=
+        "Read oplog entries as raw BSON. The documents in an entry are only "
+        "decoded when they are filtered, coalesced or handed to a "
+        "DocManager that can not write raw BSON, which saves decoding and "
+        "re-encoding them when replicating to MongoDB.")
+
     return result
 
 
@@ -19,6 +19,55 @@ __version__ = '2.5.2.dev0'
 # default = -1 (no maximum)
 DEFAULT_BATCH_SIZE = -1
 
+# Maximum # of oplog entries to read ahead of the entries being applied
+# default = 0 (read and apply entries in the same thread)
+DEFAULT_OPLOG_QUEUE_SIZE = 0
+
+# Minimum # of seconds between writes of the oplog progress file
+# default = 1 (write the progress file at most once a second)
+DEFAULT_OPLOG_PROGRESS_INTERVAL = 1
+
+# Local port that the metrics are served on over HTTP
+# default = 0 (don't serve the metrics)
+DEFAULT_METRICS_PORT = 0
+
+# Interval in seconds between reports of how long each stage of the
+# OplogThreads takes
+# default = 0 (don't time the stages)
+DEFAULT_STAGE_TIMING_INTERVAL = 0
+
+# Maximum # of consecutive oplog entries to apply in a single call to a
+# DocManager
+DEFAULT_APPLY_BATCH_SIZE = 1000
+
+# Number of threads that apply oplog entries to the DocManagers
+# default = 1 (apply entries on the thread that reads the oplog)
+DEFAULT_APPLY_THREADS = 1
+
+# Maximum # of oplog entries and milliseconds to wait for before applying
+# oplog entries, so that operations on the same document can be coalesced
+# default = 0 (apply entries as soon as possible without coalescing)
+DEFAULT_COALESCE_WINDOW = 0
+DEFAULT_COALESCE_WINDOW_MS = 0
+
+# Number of threads that dump collections to each DocManager during the
+# initial collection dump
+# default = 1 (dump collections one after another on a single cursor)
+DEFAULT_DUMP_THREADS = 1
+
+# Maximum # of documents to read ahead of the documents being written to a
+# DocManager during the initial collection dump
+# default = 0 (read and write documents in the same thread)
+DEFAULT_DUMP_QUEUE_SIZE = 0
+
+# Approximate # of documents in each _id range that large collections are
+# split into, so that the ranges can be dumped on several threads
+DEFAULT_DUMP_RANGE_SIZE = 100000
+
+# Maximum # of namespaces whose lookup results are cached, in addition to
+# the configured namespaces
+DEFAULT_NAMESPACE_CACHE_SIZE = 10000
+
 # Interval in seconds between doc manager flushes (i.e. auto commit)
 # default = None (never auto commit)
 DEFAULT_COMMIT_INTERVAL = None
@@ -51,3 +100,6 @@ DEFAULT_LOG_FORMAT = (
 DEFAULT_META_COLLECTION_NAME = "__oplog"
 # If a single meta collection is used, defines the default cap size
 DEFAULT_META_COLLECTION_CAP_SIZE = 5 * 1024 * 1024
+# The collection in the meta database of the MongoDB DocManager that holds
+# the oplog checkpoints, when they are stored in the target system
+CHECKPOINT_COLLECTION_NAME = "__checkpoints"
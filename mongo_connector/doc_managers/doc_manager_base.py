@@ -15,9 +15,11 @@
 import logging
 import sys
 
+from mongo_connector import errors
 from mongo_connector.compat import reraise
 from mongo_connector.connector import get_mininum_mongodb_version
 from mongo_connector.errors import UpdateDoesNotApply
+from mongo_connector.util import bson_ts_to_long
 
 
 LOG = logging.getLogger(__name__)
@@ -26,6 +28,10 @@ LOG = logging.getLogger(__name__)
 class DocManagerBase(object):
     """Base class for all DocManager implementations."""
 
+    # Whether apply_batch accepts oplog entries whose 'o' and 'o2' documents
+    # are bson.raw_bson.RawBSONDocuments. Otherwise, they are decoded first.
+    accepts_raw_bson = False
+
     def apply_update(self, doc, update_spec):
         """Apply an update operation to a document."""
 
@@ -128,6 +134,36 @@ class DocManagerBase(object):
         for doc in docs:
             self.upsert(doc, namespace, timestamp)
 
+    def apply_batch(self, entries):
+        """Apply a run of consecutive oplog entries.
+
+        ``entries`` is a list of oplog entries that have already been
+        filtered and renamed for the target system. It may contain inserts,
+        updates, deletes and commands but never GridFS files.
+
+        An OperationFailed is logged and the rest of the entries are still
+        applied. A ConnectionFailed is raised, so that the entries are read
+        from the oplog again instead of being lost.
+
+        This method may be overridden to apply many operations at once.
+        """
+        for entry in entries:
+            operation = entry['op']
+            namespace = entry['ns']
+            timestamp = bson_ts_to_long(entry['ts'])
+            try:
+                if operation == 'd':
+                    self.remove(entry['o']['_id'], namespace, timestamp)
+                elif operation == 'i':
+                    self.upsert(entry['o'], namespace, timestamp)
+                elif operation == 'u':
+                    self.update(entry['o2']['_id'], entry['o'], namespace,
+                                timestamp)
+                elif operation == 'c':
+                    self.handle_command(entry['o'], namespace, timestamp)
+            except errors.OperationFailed:
+                LOG.exception("Unable to process oplog document %r" % entry)
+
     def update(self, doc, update_spec, namespace, timestamp):
         """Update a document.
 
@@ -171,6 +207,20 @@ class DocManagerBase(object):
         """Get the document that was modified or deleted most recently."""
         raise NotImplementedError
 
+    def write_checkpoint(self, name, checkpoint):
+        """Save the oplog checkpoint of the replica set or shard ``name``.
+
+        ``checkpoint`` is a bson Timestamp. Every oplog entry up to it has
+        been applied. This and read_checkpoints only need to be implemented
+        to support storing checkpoints in the target system.
+        """
+        raise NotImplementedError
+
+    def read_checkpoints(self):
+        """Get a dict of the checkpoints saved by write_checkpoint, by name.
+        """
+        raise NotImplementedError
+
     def stop(self):
         """Stop all threads started by this DocManager."""
         raise NotImplementedError
@@ -26,6 +26,7 @@ from threading import RLock
 from mongo_connector import constants
 from mongo_connector.errors import OperationFailed
 from mongo_connector.doc_managers.doc_manager_base import DocManagerBase
+from mongo_connector.doc_managers.timestamp_index import TimestampIndexMixin
 from mongo_connector.compat import u
 
 __version__ = constants.__version__
@@ -80,7 +81,7 @@ class Entry(object):
         self.ns, self.ts = ns, ts
 
 
-class DocManager(DocManagerBase):
+class DocManager(TimestampIndexMixin, DocManagerBase):
     """BackendSimulator emulates both a target DocManager and a server.
 
     The DocManager class creates a connection to the backend engine and
@@ -89,6 +90,9 @@ class DocManager(DocManagerBase):
     The reason for storing id/doc pairs as opposed to doc's is so that multiple
     updates to the same doc reflect the most up to date version as opposed to
     multiple, slightly different versions of a doc.
+
+    Rollbacks search the documents through a timestamp index, see
+    TimestampIndexMixin.
     """
 
     def __init__(self, url=None, unique_key='_id',
@@ -103,6 +107,7 @@ class DocManager(DocManagerBase):
         self.url = url
         self.chunk_size = chunk_size
         self.kwargs = kwargs
+        self.checkpoints = {}
 
     def stop(self):
         """Stops any running threads in the DocManager.
@@ -132,6 +137,7 @@ class DocManager(DocManagerBase):
 
         doc_id = doc["_id"]
         self.doc_dict[doc_id] = Entry(doc=doc, ns=namespace, ts=timestamp)
+        self._index_document(doc_id, namespace, timestamp)
 
     def insert_file(self, f, namespace, timestamp):
         """Inserts a file to the doc dict.
@@ -139,6 +145,7 @@ class DocManager(DocManagerBase):
         doc = f.get_metadata()
         doc['content'] = f.read()
         self.doc_dict[f._id] = Entry(doc=doc, ns=namespace, ts=timestamp)
+        self._index_document(f._id, namespace, timestamp)
 
     def remove(self, document_id, namespace, timestamp):
         """Removes the document from the doc dict.
@@ -150,37 +157,26 @@ class DocManager(DocManagerBase):
         except KeyError:
             raise OperationFailed("Document does not exist: %s"
                                   % u(document_id))
-
-    def search(self, start_ts, end_ts):
-        """Searches through all documents and finds all documents that were
-        modified or deleted within the range.
-
-        Since we have very few documents in the doc dict when this is called,
-        linear search is fine. This method is only used by rollbacks to query
-        all the documents in the target engine within a certain timestamp
-        window. The input will be two longs (converted from Bson timestamp)
-        which specify the time range. The start_ts refers to the timestamp
-        of the last oplog entry after a rollback. The end_ts is the timestamp
-        of the last document committed to the backend.
-        """
-        for _id in self.doc_dict:
-            entry = self.doc_dict[_id]
-            if entry.ts <= end_ts or entry.ts >= start_ts:
-                yield entry.meta_dict
+        self._index_document(document_id, namespace, timestamp)
 
     def commit(self):
         """Simply passes since we're not using an engine that needs commiting.
         """
         pass
 
-    def get_last_doc(self):
-        """Searches through the doc dict to find the document that was
-        modified or deleted most recently."""
-        return max(self.doc_dict.values(), key=lambda x: x.ts).meta_dict
-
     def handle_command(self, command_doc, namespace, timestamp):
         pass
 
+    def write_checkpoint(self, name, checkpoint):
+        """Saves the checkpoint in the checkpoints dict.
+        """
+        self.checkpoints[name] = checkpoint
+
+    def read_checkpoints(self):
+        """Returns a copy of the checkpoints dict.
+        """
+        return dict(self.checkpoints)
+
     def _search(self):
         """Returns all documents in the doc dict.
 
@@ -201,3 +197,4 @@ class DocManager(DocManagerBase):
         to simulate deleting all documents from a backend.
         """
         self.doc_dict = {}
+        self._clear_index()
@@ -26,9 +26,11 @@ import pymongo
 
 from bson import SON
 from gridfs import GridFS
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
 
 from mongo_connector import errors, constants
-from mongo_connector.util import exception_wrapper
+from mongo_connector.util import (bson_ts_to_long, document_key,
+                                  exception_wrapper)
 from mongo_connector.doc_managers.doc_manager_base import DocManagerBase
 
 wrap_exceptions = exception_wrapper({
@@ -60,6 +62,9 @@ class DocManager(DocManagerBase):
         them as fields in the document, due to compatibility issues.
         """
 
+    # Raw documents are written to MongoDB without being decoded.
+    accepts_raw_bson = True
+
     def __init__(self, url, **kwargs):
         """ Verify URL and establish a connection.
         """
@@ -118,7 +123,8 @@ class DocManager(DocManagerBase):
         else:
             for name in self.meta_database.collection_names(
                     include_system_collections=False):
-                yield name
+                if name != constants.CHECKPOINT_COLLECTION_NAME:
+                    yield name
 
     def stop(self):
         """Stops any running threads
@@ -155,6 +161,112 @@ class DocManager(DocManagerBase):
             if new_db:
                 self.mongo[new_db].drop_collection(coll)
 
+    @wrap_exceptions
+    def apply_batch(self, entries):
+        """Apply a run of consecutive oplog entries with bulk writes.
+
+        Inserts, updates and removes are grouped by namespace into unordered
+        bulk writes to the data and meta collections. A group is written out
+        before a document that it already contains is touched again and
+        before any command, so operations on the same document are applied
+        in oplog order.
+        """
+        segment = _BulkSegment()
+        for entry in entries:
+            operation = entry['op']
+            if operation == 'c':
+                self._write_segment(segment)
+                segment = _BulkSegment()
+                try:
+                    self.handle_command(entry['o'], entry['ns'],
+                                        bson_ts_to_long(entry['ts']))
+                except errors.OperationFailed:
+                    LOG.exception(
+                        "Unable to process oplog document %r" % entry)
+                continue
+            if operation not in ('i', 'u', 'd'):
+                continue
+            namespace = entry['ns']
+            if operation == 'u':
+                document_id = entry['o2']['_id']
+            else:
+                document_id = entry['o']['_id']
+            if not segment.add(namespace, document_id, entry):
+                self._write_segment(segment)
+                segment = _BulkSegment()
+                segment.add(namespace, document_id, entry)
+        self._write_segment(segment)
+
+    def _write_segment(self, segment):
+        """Write the operations collected in a _BulkSegment."""
+        for namespace, entries in segment.items():
+            database, coll = self._db_and_collection(namespace)
+            collection = self.mongo[database][coll]
+            meta_collection = self.meta_database[
+                self._get_meta_collection(namespace)]
+
+            # Documents that were inserted as GridFS files have to be
+            # removed through GridFS.
+            removed_ids = [entry['o']['_id'] for entry in entries
+                           if entry['op'] == 'd']
+            gridfs_ids = {}
+            if removed_ids:
+                for meta_doc in meta_collection.find(
+                        {self.id_field: {'$in': removed_ids},
+                         'ns': namespace,
+                         'gridfs_id': {'$exists': True}}):
+                    gridfs_ids[meta_doc[self.id_field]] = meta_doc[
+                        'gridfs_id']
+
+            requests = []
+            meta_requests = []
+            for entry in entries:
+                operation = entry['op']
+                if operation == 'd':
+                    document_id = entry['o']['_id']
+                    meta_requests.append(DeleteOne(
+                        {self.id_field: document_id, 'ns': namespace}))
+                    if document_id in gridfs_ids:
+                        GridFS(self.mongo[database], coll).delete(
+                            gridfs_ids[document_id])
+                    else:
+                        requests.append(DeleteOne({'_id': document_id}))
+                    continue
+
+                if operation == 'i':
+                    document_id = entry['o']['_id']
+                    requests.append(ReplaceOne(
+                        {'_id': document_id}, entry['o'], upsert=True))
+                else:
+                    document_id = entry['o2']['_id']
+                    update_spec = entry['o']
+                    if any(key.startswith('$') for key in update_spec):
+                        requests.append(UpdateOne(
+                            {'_id': document_id}, update_spec))
+                    else:
+                        requests.append(ReplaceOne(
+                            {'_id': document_id}, update_spec))
+                meta_requests.append(ReplaceOne(
+                    {self.id_field: document_id, 'ns': namespace},
+                    {self.id_field: document_id,
+                     '_ts': bson_ts_to_long(entry['ts']),
+                     'ns': namespace},
+                    upsert=True))
+
+            self._bulk_write(meta_collection, meta_requests)
+            self._bulk_write(collection, requests)
+
+    def _bulk_write(self, collection, requests):
+        if not requests:
+            return
+        try:
+            collection.bulk_write(requests, ordered=False)
+        except pymongo.errors.BulkWriteError as bwe:
+            # The other operations in the batch have still been applied.
+            for error in bwe.details['writeErrors']:
+                LOG.error("Unable to apply %r to %s: %s" % (
+                    error['op'], collection.full_name, error['errmsg']))
+
     @wrap_exceptions
     def update(self, document_id, update_spec, namespace, timestamp):
         """Apply updates given in update_spec to the document whose id
@@ -289,6 +401,21 @@ class DocManager(DocManagerBase):
         """
         return
 
+    @wrap_exceptions
+    def write_checkpoint(self, name, checkpoint):
+        """Saves an oplog checkpoint in the meta database.
+        """
+        self.meta_database[constants.CHECKPOINT_COLLECTION_NAME].replace_one(
+            {'_id': name}, {'_id': name, 'ts': checkpoint}, upsert=True)
+
+    @wrap_exceptions
+    def read_checkpoints(self):
+        """Returns the oplog checkpoints saved in the meta database.
+        """
+        return dict(
+            (doc['_id'], doc['ts']) for doc in
+            self.meta_database[constants.CHECKPOINT_COLLECTION_NAME].find())
+
     @wrap_exceptions
     def get_last_doc(self):
         """Returns the last document stored in Mongo.
@@ -300,3 +427,25 @@ class DocManager(DocManagerBase):
                     yield ts_ns_doc
 
         return max(docs_by_ts(), key=lambda x: x["_ts"])
+
+
+class _BulkSegment(object):
+    """Oplog entries, grouped by namespace, that touch distinct documents.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._keys = set()
+
+    def add(self, namespace, document_id, entry):
+        """Add an entry, or return False if its document is already present.
+        """
+        key = document_key(namespace, document_id)
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        self._entries.setdefault(namespace, []).append(entry)
+        return True
+
+    def items(self):
+        return self._entries.items()
@@ -0,0 +1,156 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Keeps the documents in a target system in timestamp order, so that the
+searches made by rollbacks don't have to scan every document.
+"""
+
+import bisect
+import itertools
+import threading
+
+from mongo_connector.util import document_key
+
+# Guards creating the index of each TimestampIndexMixin.
+_INDEX_INIT_LOCK = threading.Lock()
+
+
+class TimestampIndex(object):
+    """Values ordered by the timestamp they were last written at.
+
+    Each key has at most one value. Finding the values in a range of
+    timestamps and the newest value takes logarithmic time. Writing a value
+    usually takes constant time, since timestamps mostly increase.
+
+    Values that are replaced or removed stay in the ordered list until it
+    has more stale entries than live ones, at which point it is compacted.
+    """
+
+    def __init__(self):
+        # (timestamp, sequence number) pairs, in order.
+        self._order = []
+        # The live (key, value) for each sequence number in _order.
+        self._live = {}
+        # The sequence number of the value of each key.
+        self._sequences = {}
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._live)
+
+    def add(self, key, timestamp, value):
+        """Set the value of ``key``, written at ``timestamp``."""
+        old = self._sequences.get(key)
+        if old is not None:
+            del self._live[old]
+        sequence = next(self._counter)
+        self._sequences[key] = sequence
+        self._live[sequence] = (key, value)
+        entry = (timestamp, sequence)
+        if not self._order or self._order[-1] < entry:
+            self._order.append(entry)
+        else:
+            bisect.insort(self._order, entry)
+        self._compact()
+
+    def remove(self, key):
+        """Remove the value of ``key``, if there is one."""
+        sequence = self._sequences.pop(key, None)
+        if sequence is not None:
+            del self._live[sequence]
+            self._compact()
+
+    def clear(self):
+        """Remove every value."""
+        self._order = []
+        self._live = {}
+        self._sequences = {}
+
+    def range(self, start_ts, end_ts):
+        """Return a list of the values written between ``start_ts`` and
+        ``end_ts``, inclusive, in timestamp order."""
+        order = self._order
+        values = []
+        for i in range(bisect.bisect_left(order, (start_ts, -1)), len(order)):
+            timestamp, sequence = order[i]
+            if timestamp > end_ts:
+                break
+            if sequence in self._live:
+                values.append(self._live[sequence][1])
+        return values
+
+    def last(self):
+        """Return the value written most recently, or None."""
+        # Stale entries at the end are dropped along the way.
+        while self._order:
+            sequence = self._order[-1][1]
+            if sequence in self._live:
+                return self._live[sequence][1]
+            self._order.pop()
+        return None
+
+    def _compact(self):
+        if len(self._order) > 2 * len(self._live) + 1000:
+            self._order = [entry for entry in self._order
+                           if entry[1] in self._live]
+
+
+class TimestampIndexMixin(object):
+    """Implements DocManager.search and get_last_doc with a TimestampIndex.
+
+    A DocManager that uses this mixin calls _index_document each time it
+    writes or removes a document, and _clear_index when it forgets all
+    documents. Removed documents stay in the index, since rollbacks have to
+    find them too. The index is kept in memory, so it only covers the
+    documents written since the DocManager was created.
+    """
+
+    def _timestamp_index(self):
+        # Mixins don't get an __init__, so create the index on first use.
+        if getattr(self, '_ts_index', None) is None:
+            with _INDEX_INIT_LOCK:
+                if getattr(self, '_ts_index', None) is None:
+                    self._ts_index_lock = threading.Lock()
+                    self._ts_index = TimestampIndex()
+        return self._ts_index, self._ts_index_lock
+
+    def _index_document(self, document_id, namespace, timestamp):
+        """Record that a document was written or removed at ``timestamp``.
+        """
+        index, lock = self._timestamp_index()
+        meta = {'_id': document_id, 'ns': namespace, '_ts': timestamp}
+        with lock:
+            index.add(document_key(namespace, document_id), timestamp, meta)
+
+    def _clear_index(self):
+        """Forget every document."""
+        index, lock = self._timestamp_index()
+        with lock:
+            index.clear()
+
+    def search(self, start_ts, end_ts):
+        """Get the documents that were written or removed between
+        ``start_ts`` and ``end_ts``, inclusive.
+        """
+        index, lock = self._timestamp_index()
+        with lock:
+            return iter(index.range(start_ts, end_ts))
+
+    def get_last_doc(self):
+        """Get the document that was written or removed most recently, or
+        None if there are none.
+        """
+        index, lock = self._timestamp_index()
+        with lock:
+            return index.last()
@@ -0,0 +1,123 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Records the progress of a collection dump so that it can be resumed.
+"""
+
+import threading
+
+
+class DumpProgress(object):
+    """The progress of the collection dump of a replica set.
+
+    The collections are dumped in tasks: a task is either a range of _ids of
+    a collection, identified by its index in ``tasks``, or the files of a
+    GridFS bucket, identified by the bucket's namespace. For each DocManager
+    the progress holds the last _id written by every started task and which
+    tasks are finished.
+
+    Instances are thread-safe.
+    """
+
+    def __init__(self, timestamp, namespaces, gridfs_namespaces, tasks,
+                 num_doc_managers):
+        # The newest oplog entry when the dump started. The oplog is replayed
+        # from this timestamp once the dump is finished.
+        self.timestamp = timestamp
+        self.namespaces = sorted(namespaces)
+        self.gridfs_namespaces = sorted(gridfs_namespaces)
+        # (namespace, (min _id, max _id)) tuples.
+        self.tasks = [(namespace, tuple(id_range))
+                      for namespace, id_range in tasks]
+        self._last_ids = [{} for _ in range(num_doc_managers)]
+        self._finished = [set() for _ in range(num_doc_managers)]
+        self._lock = threading.Lock()
+
+    def can_resume(self, namespaces, gridfs_namespaces, num_doc_managers):
+        """Return True if a dump of these namespaces to this many DocManagers
+        can continue from this progress.
+
+        Namespaces that no longer exist do not prevent resuming, new ones do
+        since their documents may have been written before the dump started.
+        """
+        return (set(namespaces).issubset(self.namespaces) and
+                set(gridfs_namespaces).issubset(self.gridfs_namespaces) and
+                num_doc_managers == len(self._last_ids))
+
+    def last_id(self, dm_index, task):
+        """Return the last _id the DocManager wrote for a task, or None if
+        the task was not started.
+        """
+        with self._lock:
+            return self._last_ids[dm_index].get(task)
+
+    def is_finished(self, dm_index, task):
+        with self._lock:
+            return task in self._finished[dm_index]
+
+    def update(self, dm_index, task, last_id):
+        """Record that the DocManager wrote every document of a task up to
+        and including last_id.
+        """
+        with self._lock:
+            self._last_ids[dm_index][task] = last_id
+
+    def finish(self, dm_index, task):
+        """Record that the DocManager wrote every document of a task."""
+        with self._lock:
+            self._finished[dm_index].add(task)
+            self._last_ids[dm_index].pop(task, None)
+
+    def remaining_tasks(self):
+        """Return the number of tasks that some DocManager has not finished.
+        """
+        tasks = list(range(len(self.tasks))) + self.gridfs_namespaces
+        with self._lock:
+            return sum(1 for task in tasks
+                       if any(task not in finished
+                              for finished in self._finished))
+
+    def to_dict(self):
+        """Return the progress as a document that can be saved as Extended
+        JSON.
+        """
+        with self._lock:
+            return {
+                'ts': self.timestamp,
+                'namespaces': self.namespaces,
+                'gridfs_namespaces': self.gridfs_namespaces,
+                'tasks': [[namespace, list(id_range)]
+                          for namespace, id_range in self.tasks],
+                # Task keys may be ints or strings, so last _ids are stored
+                # as [task, _id] pairs rather than as a document.
+                'last_ids': [[[task, last_id]
+                              for task, last_id in last_ids.items()]
+                             for last_ids in self._last_ids],
+                'finished': [sorted(finished, key=str)
+                             for finished in self._finished],
+            }
+
+    @classmethod
+    def from_dict(cls, doc):
+        """Create a DumpProgress from a document returned by to_dict."""
+        progress = cls(doc['ts'], doc['namespaces'],
+                       doc['gridfs_namespaces'], doc['tasks'],
+                       len(doc['last_ids']))
+        for dm_index, last_ids in enumerate(doc['last_ids']):
+            for task, last_id in last_ids:
+                progress.update(dm_index, task, last_id)
+        for dm_index, finished in enumerate(doc['finished']):
+            for task in finished:
+                progress.finish(dm_index, task)
+        return progress
@@ -0,0 +1,174 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Removes fields that should not be replicated from oplog entries.
+"""
+
+# Returned by _lookup_update_field when no field is selected.
+_NOT_SELECTED = object()
+
+
+class FieldFilter(object):
+    """Filters documents and update specs by a set of included or excluded
+    fields.
+
+    The fields are compiled once into a tree of field names, so that each
+    document is filtered in a single pass instead of once per field.
+
+    NOTE: this does not support array indexing, for example 'a.b.2'.
+    """
+
+    def __init__(self, include_fields=None, exclude_fields=None):
+        self.include = bool(include_fields)
+        self._tree = _compile(include_fields or exclude_fields or ())
+
+    def __bool__(self):
+        return bool(self._tree)
+
+    __nonzero__ = __bool__
+
+    def filter_document(self, doc):
+        """Filter a document, eg the 'o' field of an insert.
+
+        Excluded fields are removed from the document itself, included fields
+        are copied to a new document.
+        """
+        if self.include:
+            return _include(self._tree, doc)
+        return _exclude(self._tree, doc)
+
+    def filter_update(self, update_fields):
+        """Filter the fields of a $set or $unset update operator.
+
+        The top level fields may be in dot notation, eg "a.b.c".
+        """
+        tree = self._tree
+        if self.include:
+            result = {}
+            for field, value in update_fields.items():
+                selected = _lookup_update_field(tree, field)
+                if selected is None:
+                    result[field] = value
+                elif selected is not _NOT_SELECTED and isinstance(value,
+                                                                  dict):
+                    value = _include(selected, value)
+                    if value:
+                        result[field] = value
+            return result
+
+        for field in list(update_fields):
+            selected = _lookup_update_field(tree, field)
+            if selected is None:
+                del update_fields[field]
+            elif selected is not _NOT_SELECTED:
+                value = update_fields[field]
+                if isinstance(value, dict):
+                    _exclude(selected, value)
+        return update_fields
+
+    def filter_oplog_entry(self, entry):
+        """Remove fields from an oplog entry that should not be replicated.
+
+        Returns None when nothing is left to update.
+        """
+        if not self._tree:
+            return entry
+        entry_o = entry['o']
+        # 'i' indicates an insert. 'o' field is the doc to be inserted.
+        if entry['op'] == 'i':
+            entry['o'] = self.filter_document(entry_o)
+        # 'u' indicates an update. The 'o' field describes an update spec
+        # if '$set' or '$unset' are present.
+        elif entry['op'] == 'u' and ('$set' in entry_o or '$unset' in entry_o):
+            for operator in ('$set', '$unset'):
+                if operator in entry_o:
+                    update_fields = self.filter_update(entry_o[operator])
+                    # not allowed to have empty $set/$unset, so remove if
+                    # empty
+                    if update_fields:
+                        entry_o[operator] = update_fields
+                    else:
+                        entry_o.pop(operator)
+            if not entry_o:
+                return None
+        # 'u' indicates an update. The 'o' field is the replacement document
+        # if no '$set' or '$unset' are present.
+        elif entry['op'] == 'u':
+            entry['o'] = self.filter_document(entry_o)
+
+        return entry
+
+
+def _compile(fields):
+    """Compile fields in dot notation into a tree of nested dicts.
+
+    A field that is selected as a whole maps to None, eg
+    ['a.b', 'a.c.d', 'e'] compiles to
+    {'a': {'b': None, 'c': {'d': None}}, 'e': None}.
+    """
+    tree = {}
+    # A field contains all the longer fields it is a prefix of, so compile
+    # the shorter fields first.
+    for field in sorted(fields, key=len):
+        path = field.split('.')
+        node = tree
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+            if node is None:
+                break
+        else:
+            node[path[-1]] = None
+    return tree
+
+
+def _include(tree, doc):
+    """Return a new document with the fields of doc selected by tree."""
+    result = {}
+    for key, subtree in tree.items():
+        if key in doc:
+            value = doc[key]
+            if subtree is None:
+                result[key] = value
+            elif isinstance(value, dict):
+                value = _include(subtree, value)
+                if value:
+                    result[key] = value
+    return result
+
+
+def _exclude(tree, doc):
+    """Remove the fields selected by tree from doc."""
+    for key, subtree in tree.items():
+        if key in doc:
+            if subtree is None:
+                del doc[key]
+            else:
+                value = doc[key]
+                if isinstance(value, dict):
+                    _exclude(subtree, value)
+    return doc
+
+
+def _lookup_update_field(tree, field):
+    """Find what the tree selects from a field in dot notation.
+
+    Returns None when the whole field is selected, the subtree selecting part
+    of the field's value, or _NOT_SELECTED.
+    """
+    node = tree
+    for key in field.split('.'):
+        node = node.get(key, _NOT_SELECTED)
+        if node is None or node is _NOT_SELECTED:
+            break
+    return node
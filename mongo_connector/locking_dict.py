@@ -1,10 +1,36 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Deprecated: use mongo_connector.progress_slots.ProgressSlots instead.
+"""
+
 import threading
+import warnings
 
 
 class LockingDict():
+    """A dict guarded by a single lock.
 
-    def __init__(self):
+    Besides its original interface, it has the publish, get, snapshot and
+    load methods of ProgressSlots, so that an OplogThread can still be
+    created with a LockingDict.
+    """
 
+    def __init__(self):
+        warnings.warn("LockingDict is deprecated, use "
+                      "mongo_connector.progress_slots.ProgressSlots instead",
+                      DeprecationWarning, stacklevel=2)
         self.dict = {}
         self.lock = threading.Lock()
 
@@ -23,3 +49,22 @@ class LockingDict():
 
     def release_lock(self):
         self.lock.release()
+
+    def publish(self, name, value):
+        with self.lock:
+            if value is None:
+                self.dict.pop(name, None)
+            else:
+                self.dict[name] = value
+
+    def get(self, name):
+        with self.lock:
+            return self.dict.get(name)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.dict)
+
+    def load(self, values):
+        with self.lock:
+            self.dict = dict(values)
@@ -0,0 +1,108 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""A bounded mapping that evicts the items that have not been used recently.
+"""
+
+import threading
+
+from collections import deque, namedtuple
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'max_size', 'size'])
+
+# Fields of the entries of an LRUCache.
+_KEY, _VALUE, _USED = 0, 1, 2
+
+
+class LRUCache(object):
+    """Thread-safe mapping that holds at most max_size items.
+
+    When the cache is full, adding an item evicts one that has not been
+    used since it was added or last passed over for eviction, which
+    approximates the least recently used item. Reading an item does not
+    take a lock, so the hits and misses are approximate when several
+    threads use the cache. A max_size of 0 disables the cache.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Maps keys to [key, value, used] entries.
+        self._entries = {}
+        # The entries in the order they are considered for eviction.
+        self._queue = deque()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """Return the value for key and mark it as recently used."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        entry[_USED] = True
+        return entry[_VALUE]
+
+    def __setitem__(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[_VALUE] = value
+                entry[_USED] = True
+                return
+            while len(self._entries) >= self.max_size:
+                self._evict()
+            entry = [key, value, False]
+            self._entries[key] = entry
+            self._queue.append(entry)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._queue.remove(entry)
+            return entry[_VALUE]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._queue.clear()
+
+    def info(self):
+        """Return the hits, misses, maximum size and size of the cache."""
+        return CacheInfo(self.hits, self.misses, self.max_size,
+                         len(self._entries))
+
+    def _evict(self):
+        """Remove the first entry in the queue that was not used. Used
+        entries are marked unused and moved to the end of the queue.
+        """
+        while True:
+            entry = self._queue.popleft()
+            if not entry[_USED]:
+                del self._entries[entry[_KEY]]
+                return
+            entry[_USED] = False
+            self._queue.append(entry)
@@ -0,0 +1,356 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Counts what mongo-connector does, and serves the counts over HTTP in the
+Prometheus text format.
+"""
+
+import bisect
+import logging
+import threading
+import time
+
+from mongo_connector.compat import BaseHTTPRequestHandler, HTTPServer
+
+LOG = logging.getLogger(__name__)
+
+# The upper bounds, in seconds, of the buckets of a Histogram by default.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value != value:
+            return 'NaN'
+        if value in (float('inf'), float('-inf')):
+            return '+Inf' if value > 0 else '-Inf'
+        if value.is_integer():
+            return '%d' % value
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', r'\\')
+                     .replace('\n', r'\n').replace('"', r'\"'))
+        for name, value in zip(names, values))
+
+
+class _CounterChild(object):
+    __slots__ = ('_value', '_lock')
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def value(self):
+        return self._value
+
+
+class _GaugeChild(object):
+    __slots__ = ('_value', '_function', '_lock')
+
+    def __init__(self):
+        self._value = 0
+        self._function = None
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self._function = None
+        self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        """Read the value from ``function`` each time it is exported."""
+        self._function = function
+
+    def value(self):
+        function = self._function
+        if function is not None:
+            try:
+                return function()
+            except Exception:
+                LOG.exception('Could not read the value of a gauge')
+                return float('nan')
+        return self._value
+
+
+class _Timer(object):
+    __slots__ = ('_histogram', '_started')
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._histogram.observe(time.time() - self._started)
+
+
+class _HistogramChild(object):
+    __slots__ = ('_buckets', '_counts', '_sum', '_lock')
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        # The number of observations in each bucket, and above the last one.
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def time(self):
+        """Return a context manager that observes how long its block took.
+        """
+        return _Timer(self)
+
+    def value(self):
+        """Return the cumulative count of each bucket, the count of every
+        observation, and their sum."""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = []
+        count = 0
+        for bucket_count in counts[:-1]:
+            count += bucket_count
+            cumulative.append(count)
+        return cumulative, count + counts[-1], total
+
+
+class _Metric(object):
+    """A named metric with a value for each combination of label values.
+    """
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Replaced rather than modified, so that labels() only takes the
+        # lock to add a child.
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *labelvalues):
+        """Return the value for these label values, creating it if needed.
+        """
+        child = self._children.get(labelvalues)
+        if child is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError('%s takes %d label values, got %d' % (
+                    self.name, len(self.labelnames), len(labelvalues)))
+            with self._lock:
+                child = self._children.get(labelvalues)
+                if child is None:
+                    child = self._new_child()
+                    children = dict(self._children)
+                    children[labelvalues] = child
+                    self._children = children
+        return child
+
+    def remove(self, *labelvalues):
+        """Forget the value for these label values."""
+        with self._lock:
+            children = dict(self._children)
+            children.pop(labelvalues, None)
+            self._children = children
+
+    def clear(self):
+        """Forget every value."""
+        with self._lock:
+            self._children = {}
+
+    def _samples(self, child):
+        """Yield the (name suffix, extra labels, value) of each sample."""
+        yield '', (), child.value()
+
+    def collect(self):
+        """Return the lines of this metric in the Prometheus text format."""
+        lines = ['# HELP %s %s' % (self.name, self.documentation),
+                 '# TYPE %s %s' % (self.name, self.type_name)]
+        for labelvalues, child in sorted(self._children.items()):
+            for suffix, extra_labels, value in self._samples(child):
+                names = self.labelnames + tuple(
+                    name for name, _ in extra_labels)
+                values = labelvalues + tuple(
+                    label_value for _, label_value in extra_labels)
+                lines.append('%s%s%s %s' % (
+                    self.name, suffix, _format_labels(names, values),
+                    _format_value(value)))
+        return lines
+
+
+class Counter(_Metric):
+    """A count that only goes up, such as the number of oplog entries read.
+    """
+    type_name = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, such as the length of a queue."""
+    type_name = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class Histogram(_Metric):
+    """The distribution of observed values, such as how long calls take.
+    """
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _samples(self, child):
+        cumulative, count, total = child.value()
+        for bound, bucket_count in zip(self.buckets, cumulative):
+            yield '_bucket', (('le', _format_value(float(bound))),), \
+                bucket_count
+        yield '_bucket', (('le', '+Inf'),), count
+        yield '_count', (), count
+        yield '_sum', (), total
+
+
+class MetricsRegistry(object):
+    """The metrics exported by mongo-connector.
+
+    Creating a metric that is already registered returns the existing one,
+    so that modules can create their metrics when they are imported.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, *args, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError('%s is already registered as a %s'
+                                 % (name, metric.type_name))
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames,
+                              buckets=buckets)
+
+    def get(self, name):
+        """Return the metric called ``name``, or None."""
+        return self._metrics.get(name)
+
+    def clear(self):
+        """Forget the values of every metric."""
+        for metric in list(self._metrics.values()):
+            metric.clear()
+
+    def render(self):
+        """Return every metric in the Prometheus text format."""
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for _, metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+# The registry that mongo-connector records its metrics in.
+REGISTRY = MetricsRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        LOG.debug('Metrics request from %s: %s',
+                  self.address_string(), format % args)
+
+
+class MetricsServer(threading.Thread):
+    """Thread that serves a MetricsRegistry at /metrics over HTTP.
+
+    The server only listens on the loopback interface by default. Port 0
+    picks a free port, which is then available as ``port``.
+    """
+
+    def __init__(self, port, host='127.0.0.1', registry=REGISTRY):
+        super(MetricsServer, self).__init__()
+        self.httpd = HTTPServer((host, port), _MetricsHandler)
+        self.httpd.registry = registry
+        self.port = self.httpd.server_address[1]
+        self.daemon = True
+
+    def run(self):
+        LOG.info('Serving metrics at http://%s:%d/metrics',
+                 self.httpd.server_address[0], self.port)
+        self.httpd.serve_forever(poll_interval=0.5)
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
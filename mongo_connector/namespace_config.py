@@ -12,14 +12,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import bisect
 import logging
 import re
 
 from collections import namedtuple, MutableSet
 from itertools import combinations
 
+from bson.regex import Regex
+
 from mongo_connector import errors
 from mongo_connector import compat
+from mongo_connector.constants import DEFAULT_NAMESPACE_CACHE_SIZE
+from mongo_connector.field_filter import FieldFilter
+from mongo_connector.lru_cache import LRUCache
 
 
 LOG = logging.getLogger(__name__)
@@ -34,9 +40,12 @@ class Namespace(_Namespace):
                 include_fields=None, exclude_fields=None):
         include_fields = set(include_fields or [])
         exclude_fields = set(exclude_fields or [])
-        return super(Namespace, cls).__new__(
+        namespace = super(Namespace, cls).__new__(
             cls, dest_name, source_name, gridfs, include_fields,
             exclude_fields)
+        # The include or exclude fields, compiled for filtering documents.
+        namespace.field_filter = FieldFilter(include_fields, exclude_fields)
+        return namespace
 
     def with_options(self, **kwargs):
         new_options = dict(
@@ -47,30 +56,119 @@ class Namespace(_Namespace):
         return Namespace(**new_options)
 
 
+# Returned by LRUCache.get for namespaces that have not been looked up.
+_NOT_CACHED = object()
+
+# Characters with a special meaning in a regex.
+_REGEX_SPECIAL_CHARS = frozenset('.^$*+?{}[]|()\\')
+
+
+def _literal_prefix(regex):
+    """Return a string that every string matched by the regex starts with.
+
+    This only handles the simple regexes created by namespace_to_regex, for
+    any other regex it may return a shorter prefix, eg the empty string.
+    """
+    pattern = regex.pattern
+    if (regex.flags & (re.IGNORECASE | re.VERBOSE)) or '|' in pattern:
+        return ''
+    prefix = []
+    i = 2 if pattern.startswith(r'\A') else 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            char = pattern[i + 1:i + 2]
+            if not char or char.isalnum():
+                break
+            i += 2
+        elif char in _REGEX_SPECIAL_CHARS:
+            break
+        else:
+            i += 1
+        if pattern[i:i + 1] in ('*', '+', '?', '{'):
+            # The character is repeated, it may not be there at all.
+            break
+        prefix.append(char)
+    return ''.join(prefix)
+
+
+class RegexMatcher(object):
+    """Finds the first regex in a list that matches a string.
+
+    The regexes are indexed by their literal prefix, so that only the
+    regexes whose prefix the string starts with are tried instead of every
+    regex in turn.
+    """
+    def __init__(self, regexes=()):
+        self._regexes = []
+        # A mapping from literal prefixes to the indexes of the regexes that
+        # start with them.
+        self._by_prefix = {}
+        # The sorted lengths of the prefixes in _by_prefix.
+        self._prefix_lengths = []
+        for regex in regexes:
+            self.append(regex)
+
+    def append(self, regex):
+        prefix = _literal_prefix(regex)
+        if prefix not in self._by_prefix:
+            self._by_prefix[prefix] = []
+            if len(prefix) not in self._prefix_lengths:
+                bisect.insort(self._prefix_lengths, len(prefix))
+        self._by_prefix[prefix].append(len(self._regexes))
+        self._regexes.append(regex)
+
+    def match(self, string):
+        """Return the index of the first regex that matches the string and
+        the match object, or (None, None) if no regex matches.
+        """
+        for index, match in self.match_all(string):
+            return index, match
+        return None, None
+
+    def match_all(self, string):
+        """Yield the index and the match object of every regex that matches
+        the string, in order.
+        """
+        candidates = []
+        for length in self._prefix_lengths:
+            if length > len(string):
+                break
+            indexes = self._by_prefix.get(string[:length])
+            if indexes:
+                candidates.extend(indexes)
+        candidates.sort()
+        for index in candidates:
+            match = self._regexes[index].match(string)
+            if match:
+                yield index, match
+
+
 class RegexSet(MutableSet):
     """Set that stores both plain strings and RegexObjects.
 
     Membership query results are cached so that repeated lookups of the same
-    string are fast.
+    string are fast. The cache holds at most cache_size strings.
     """
-    def __init__(self, regexes, strings):
+    def __init__(self, regexes, strings,
+                 cache_size=DEFAULT_NAMESPACE_CACHE_SIZE):
         self._regexes = set(regexes)
+        self._matcher = RegexMatcher(self._regexes)
         self._plain = set(strings)
-        self._not_found_cache = set()
+        # Maps strings to whether they match one of the regexes.
+        self._cache = LRUCache(cache_size)
 
     def __contains__(self, item):
-        if item in self._not_found_cache:
-            return False
         if item in self._plain:
             return True
         if item in self._regexes:
             return True
-        for regex in self._regexes:
-            if regex.match(item):
-                self._plain.add(item)
-                return True
-        self._not_found_cache.add(item)
-        return False
+        found = self._cache.get(item)
+        if found is None:
+            index, _ = self._matcher.match(item)
+            found = index is not None
+            self._cache[item] = found
+        return found
 
     def __iter__(self):
         for regex in self._regexes:
@@ -83,13 +181,18 @@ class RegexSet(MutableSet):
 
     def add(self, string):
         self._plain.add(string)
-        self._not_found_cache.discard(string)
+        self._cache.pop(string)
 
     def discard(self, string):
         self._plain.discard(string)
+        self._cache.pop(string)
+
+    def cache_info(self):
+        """Return the hits, misses and size of the membership cache."""
+        return self._cache.info()
 
     @staticmethod
-    def from_namespaces(namespaces):
+    def from_namespaces(namespaces, cache_size=DEFAULT_NAMESPACE_CACHE_SIZE):
         regexes = set()
         strings = set()
         for ns in namespaces:
@@ -97,7 +200,7 @@ class RegexSet(MutableSet):
                 regexes.add(namespace_to_regex(ns))
             else:
                 strings.add(ns)
-        return RegexSet(regexes, strings)
+        return RegexSet(regexes, strings, cache_size=cache_size)
 
 
 class NamespaceConfig(object):
@@ -105,7 +208,8 @@ class NamespaceConfig(object):
     """
     def __init__(self, namespace_set=None, ex_namespace_set=None,
                  gridfs_set=None, dest_mapping=None, namespace_options=None,
-                 include_fields=None, exclude_fields=None):
+                 include_fields=None, exclude_fields=None,
+                 cache_size=DEFAULT_NAMESPACE_CACHE_SIZE):
         # A mapping from non-wildcard source namespaces to a MappedNamespace
         # containing the non-wildcard target name.
         self._plain = {}
@@ -120,9 +224,18 @@ class NamespaceConfig(object):
         self._plain_db = {}
         # A list of (re.RegexObject, MappedNamespace) tuples. regex_map maps
         # wildcard source namespaces to a MappedNamespace containing the
-        # wildcard target name. When a namespace is matched, an entry is
-        # created in `self.plain` for faster subsequent lookups.
+        # wildcard target name.
         self._regex_map = []
+        # Matches a namespace against all the regexes in regex_map at once.
+        self._regex_matcher = RegexMatcher()
+        # Matches a target namespace against the wildcard target names in
+        # regex_map, in the same order.
+        self._target_matcher = RegexMatcher()
+        # The results of recent lookups, including namespaces that are not
+        # included, so that future lookups of the same namespace are fast.
+        # Unlike the attributes above this only holds the most recently
+        # used cache_size namespaces.
+        self._lookup_cache = LRUCache(cache_size)
 
         # Fields to include or exclude from all namespaces
         self._include_fields = validate_include_fields(include_fields)
@@ -141,10 +254,20 @@ class NamespaceConfig(object):
             exclude_fields=exclude_fields)
 
         # The set of, possibly wildcard, namespaces to exclude.
-        self._ex_namespace_set = RegexSet.from_namespaces(ex_namespace_set)
+        self._ex_namespace_set = RegexSet.from_namespaces(
+            ex_namespace_set, cache_size=0)
+
+        # The configured, possibly wildcard, source namespaces. Unlike the
+        # attributes above these do not grow as namespaces are looked up.
+        self._included_sources = []
+        self._excluded_sources = list(ex_namespace_set)
 
         for namespace in namespaces:
             self._register_namespace_and_command(namespace)
+            self._included_sources.append(namespace.source_name)
+            if namespace.gridfs:
+                self._included_sources.append(
+                    namespace.source_name + '.files')
 
     def _register_namespace_and_command(self, namespace):
         """Add a Namespace and the corresponding command namespace."""
@@ -159,8 +282,11 @@ class NamespaceConfig(object):
         """Add an included and possibly renamed Namespace."""
         src_name = namespace.source_name
         if "*" in src_name:
-            self._regex_map.append((namespace_to_regex(src_name),
-                                    namespace))
+            regex = namespace_to_regex(src_name)
+            self._regex_map.append((regex, namespace))
+            self._regex_matcher.append(regex)
+            self._target_matcher.append(
+                namespace_to_regex(namespace.dest_name))
         else:
             self._add_plain_namespace(namespace)
 
@@ -173,11 +299,8 @@ class NamespaceConfig(object):
         if len(src_names) > 1:
             # Another source namespace is already mapped to this target
             existing_src = (src_names - set([src_name])).pop()
-            raise errors.InvalidConfiguration(
-                "Multiple namespaces cannot be combined into one target "
-                "namespace. Trying to map '%s' to '%s' but there already "
-                "exists a mapping from '%s' to '%s'" %
-                (src_name, target_name, existing_src, target_name))
+            raise _combined_namespaces_error(src_name, target_name,
+                                             existing_src)
 
         self._plain[src_name] = namespace
         src_db, _ = src_name.split(".", 1)
@@ -188,6 +311,13 @@ class NamespaceConfig(object):
         """Given a plain source namespace, return the corresponding Namespace
         object, or None if it is not included.
         """
+        namespace = self._lookup_cache.get(plain_src_ns, _NOT_CACHED)
+        if namespace is _NOT_CACHED:
+            namespace = self._lookup(plain_src_ns)
+            self._lookup_cache[plain_src_ns] = namespace
+        return namespace
+
+    def _lookup(self, plain_src_ns):
         # Ignore the namespace if it is excluded.
         if plain_src_ns in self._ex_namespace_set:
             return None
@@ -201,22 +331,56 @@ class NamespaceConfig(object):
             return self._plain[plain_src_ns]
         except KeyError:
             # Search for the namespace in the wildcard namespaces.
-            for regex, namespace in self._regex_map:
-                new_name = match_replace_regex(regex, plain_src_ns,
-                                               namespace.dest_name)
-                if not new_name:
-                    continue
-                # Save the new target Namespace in the plain namespaces so
-                # future lookups are fast.
-                new_namespace = namespace.with_options(
-                    dest_name=new_name, source_name=plain_src_ns)
-                self._add_plain_namespace(new_namespace)
-                return new_namespace
-
-        # Save the not included namespace to the excluded namespaces so
-        # that future lookups of the same namespace are fast.
-        self._ex_namespace_set.add(plain_src_ns)
-        return None
+            namespace = self._wildcard_lookup(plain_src_ns)
+            if namespace is not None:
+                self._check_wildcard_target(plain_src_ns, namespace.dest_name)
+            return namespace
+
+    def _wildcard_lookup(self, plain_src_ns):
+        """Return the Namespace of a source namespace matched by a wildcard,
+        or None if no wildcard matches it.
+        """
+        index, match = self._regex_matcher.match(plain_src_ns)
+        if index is None:
+            return None
+        _, namespace = self._regex_map[index]
+        return namespace.with_options(
+            dest_name=namespace.dest_name.replace('*', match.group(1)),
+            source_name=plain_src_ns)
+
+    def _wildcard_sources(self, plain_target_ns):
+        """Yield the source namespaces that wildcards map to a target
+        namespace.
+
+        The sources are worked out from the configured wildcards instead of
+        being remembered as namespaces are looked up, so that memory does
+        not grow with the number of namespaces.
+        """
+        for index, match in self._target_matcher.match_all(plain_target_ns):
+            _, namespace = self._regex_map[index]
+            src_name = namespace.source_name.replace('*', match.group(1))
+            if (src_name in self._plain or
+                    src_name in self._ex_namespace_set):
+                continue
+            mapped = self._wildcard_lookup(src_name)
+            if mapped is not None and mapped.dest_name == plain_target_ns:
+                yield src_name
+
+    def _check_wildcard_target(self, src_name, target_name):
+        """Raise if another source namespace maps to the target of a
+        namespace matched by a wildcard.
+        """
+        for existing_src in self._reverse_plain.get(target_name, ()):
+            raise _combined_namespaces_error(src_name, target_name,
+                                             existing_src)
+        for existing_src in self._wildcard_sources(target_name):
+            if existing_src != src_name:
+                raise _combined_namespaces_error(src_name, target_name,
+                                                 existing_src)
+
+    def cache_info(self):
+        """Return the hits, misses and size of the lookup cache."""
+        return self._lookup_cache.info()
 
     def map_namespace(self, plain_src_ns):
         """Given a plain source namespace, return the corresponding plain
@@ -249,6 +413,8 @@ class NamespaceConfig(object):
             # Return the first (and only) item in the set
             for src_name in src_name_set:
                 return src_name
+        for src_name in self._wildcard_sources(plain_target_ns):
+            return src_name
         # The target namespace could also exist in the wildcard namespaces
         for _, namespace in self._regex_map:
             original_name = match_replace_regex(
@@ -274,9 +440,16 @@ class NamespaceConfig(object):
         """
         if not self._regex_map and not self._plain:
             return [plain_src_db]
-        # Lookup this namespace to seed the plain_db dictionary
-        self.lookup(plain_src_db + '.$cmd')
-        return list(self._plain_db.get(plain_src_db, set()))
+        databases = set(self._plain_db.get(plain_src_db, ()))
+        # Add the target databases of the wildcard command namespaces.
+        cmd_name = plain_src_db + '.$cmd'
+        if cmd_name not in self._ex_namespace_set:
+            for regex, namespace in self._regex_map:
+                new_name = match_replace_regex(regex, cmd_name,
+                                               namespace.dest_name)
+                if new_name:
+                    databases.add(new_name.split('.', 1)[0])
+        return list(databases)
 
     def projection(self, plain_src_name):
         """Return the projection for the given source namespace."""
@@ -289,6 +462,21 @@ class NamespaceConfig(object):
             return dict((field, include) for field in fields)
         return None
 
+    def source_namespace_query(self):
+        """Return a MongoDB query on source namespace names, or None.
+
+        The query matches every namespace that may be included. It also
+        matches namespaces that lookup() still rejects, so it can only be
+        used to filter namespaces out ahead of time. Command namespaces are
+        not taken into account.
+        """
+        query = {}
+        if self._included_sources:
+            query['$in'] = _namespace_patterns(self._included_sources)
+        if self._excluded_sources:
+            query['$nin'] = _namespace_patterns(self._excluded_sources)
+        return query or None
+
     def get_included_databases(self):
         """Return the databases we want to include, or empty list for all.
         """
@@ -491,6 +679,14 @@ def validate_namespace_options(namespace_set=None, ex_namespace_set=None,
     return ex_namespace_set, namespaces.values()
 
 
+def _combined_namespaces_error(src_name, target_name, existing_src):
+    return errors.InvalidConfiguration(
+        "Multiple namespaces cannot be combined into one target "
+        "namespace. Trying to map '%s' to '%s' but there already "
+        "exists a mapping from '%s' to '%s'" %
+        (src_name, target_name, existing_src, target_name))
+
+
 def match_replace_regex(regex, src_namespace, dest_namespace):
     """Return the new mapped namespace if the src_namespace matches the
     regex."""
@@ -500,6 +696,18 @@ def match_replace_regex(regex, src_namespace, dest_namespace):
     return None
 
 
+def _namespace_patterns(namespaces):
+    """Return plain namespaces and BSON regexes that match namespaces."""
+    patterns = []
+    for namespace in sorted(namespaces):
+        if '*' in namespace:
+            # Avoid re.UNICODE and other flags that MongoDB does not accept.
+            patterns.append(Regex(namespace_to_regex(namespace).pattern))
+        else:
+            patterns.append(namespace)
+    return patterns
+
+
 def wildcard_in_db(namespace):
     """Return True if a wildcard character appears in the database name."""
     return namespace.find('*') < namespace.find('.')
@@ -16,6 +16,7 @@
 """
 
 import bson
+import itertools
 import logging
 try:
     import Queue as queue
@@ -27,16 +28,105 @@ import threading
 
 import pymongo
 
+from bson.regex import Regex
 from pymongo import CursorType, errors as pymongo_errors
 
-from mongo_connector import errors, util
-from mongo_connector.constants import DEFAULT_BATCH_SIZE
+from mongo_connector import errors, metrics, stage_timer, util
+from mongo_connector.coalescer import coalesce_entries
+from mongo_connector.compat import reraise
+from mongo_connector.constants import (DEFAULT_APPLY_BATCH_SIZE,
+                                       DEFAULT_APPLY_THREADS,
+                                       DEFAULT_BATCH_SIZE,
+                                       DEFAULT_COALESCE_WINDOW,
+                                       DEFAULT_COALESCE_WINDOW_MS,
+                                       DEFAULT_DUMP_QUEUE_SIZE,
+                                       DEFAULT_DUMP_RANGE_SIZE,
+                                       DEFAULT_DUMP_THREADS,
+                                       DEFAULT_MAX_BULK,
+                                       DEFAULT_OPLOG_QUEUE_SIZE,
+                                       DEFAULT_STAGE_TIMING_INTERVAL)
+from mongo_connector.dump_progress import DumpProgress
+from mongo_connector.field_filter import FieldFilter
 from mongo_connector.gridfs_file import GridFSFile
 from mongo_connector.util import log_fatal_exceptions, retry_until_ok
 
 LOG = logging.getLogger(__name__)
 
 
+# Oplog namespaces that _should_skip_entry may or may not skip.
+_COMMAND_NAMESPACE_REGEX = Regex(r'\A[^.]*\.\$cmd\Z')
+_SYSTEM_NAMESPACE_REGEX = Regex(r'\A[^.]*\.system\.')
+_GRIDFS_CHUNKS_NAMESPACE_REGEX = Regex(r'\A[^.]*\..*\.chunks\Z')
+_GRIDFS_FILES_NAMESPACE_REGEX = Regex(r'\A[^.]*\..*\.files\Z')
+
+# The number of sampled _ids per _id range when splitting a collection for
+# the collection dump without splitVector.
+_SAMPLES_PER_RANGE = 10
+
+# The number of documents sent to a DocManager at once during the collection
+# dump. The dump progress is recorded after each batch.
+_DUMP_BATCH_SIZE = DEFAULT_MAX_BULK
+
+# The number of documents found by DocManager.search that are read again from
+# MongoDB, and removed or upserted, at once during a rollback.
+_ROLLBACK_BATCH_SIZE = DEFAULT_MAX_BULK
+
+# Seconds that a secondary may be behind the primary in addition to the
+# maxStalenessSeconds of the read preference: the driver only refreshes its
+# estimate of a secondary's staleness every heartbeat, 10 seconds by
+# default, and an idle primary only writes to the oplog every 10 seconds.
+_STALENESS_MARGIN_SECS = 20
+
+# The names of the operations counted by _OPLOG_ENTRIES.
+_OPERATION_NAMES = {'i': 'insert', 'u': 'update', 'd': 'delete',
+                    'c': 'command'}
+
+_OPLOG_ENTRIES = metrics.REGISTRY.counter(
+    'mongo_connector_oplog_entries_total',
+    'Oplog entries replicated, by replica set and operation.',
+    ('replica_set', 'op'))
+_DATABASE_ENTRIES = metrics.REGISTRY.counter(
+    'mongo_connector_database_entries_total',
+    'Oplog entries replicated, by source database.',
+    ('database',))
+_DOC_MANAGER_SECONDS = metrics.REGISTRY.histogram(
+    'mongo_connector_doc_manager_call_seconds',
+    'Time taken by calls to the DocManagers, by DocManager and method.',
+    ('doc_manager', 'method'))
+_QUEUE_DEPTH = metrics.REGISTRY.gauge(
+    'mongo_connector_queue_depth',
+    'Items waiting in the queues of an OplogThread.',
+    ('replica_set', 'queue'))
+_REPLICATION_LAG = metrics.REGISTRY.gauge(
+    'mongo_connector_replication_lag_seconds',
+    'Seconds between the checkpoint and the newest oplog entry.',
+    ('replica_set',))
+_DUMP_DOCUMENTS = metrics.REGISTRY.counter(
+    'mongo_connector_dump_documents_total',
+    'Documents written to the DocManagers by the collection dump.',
+    ('replica_set',))
+_DUMP_TASKS_REMAINING = metrics.REGISTRY.gauge(
+    'mongo_connector_dump_tasks_remaining',
+    'Collection dump tasks that some DocManager has not finished.',
+    ('replica_set',))
+_ROLLBACKS = metrics.REGISTRY.counter(
+    'mongo_connector_rollbacks_total',
+    'Rollbacks performed.',
+    ('replica_set',))
+_ROLLBACK_DOCUMENTS = metrics.REGISTRY.counter(
+    'mongo_connector_rollback_documents_total',
+    'Documents removed, upserted, or that failed to be upserted, during '
+    'rollbacks.',
+    ('replica_set', 'action'))
+
+
+def _time_call(docman, method):
+    """Return a context manager that records how long a call to a DocManager
+    takes."""
+    return _DOC_MANAGER_SECONDS.labels(docman.__class__.__module__,
+                                       method).time()
+
+
 class ReplicationLagLogger(threading.Thread):
     """Thread that periodically logs the current replication lag.
     """
@@ -55,6 +145,7 @@ class ReplicationLagLogger(threading.Thread):
             # OplogThread will perform a rollback, don't log anything
             return
         lag_secs = newest_write.time - checkpoint.time
+        _REPLICATION_LAG.labels(self.opman.replset_name).set(lag_secs)
         if lag_secs > 0:
             LOG.info("OplogThread for replica set '%s' is %s seconds behind "
                      "the oplog.",
@@ -76,6 +167,289 @@ class ReplicationLagLogger(threading.Thread):
             time.sleep(self.interval)
 
 
+class _CaughtUp(object):
+    """Marker put on the queue of an OplogReader each time the cursor runs
+    out of entries."""
+
+    __slots__ = ('oplog_ts',)
+
+    def __init__(self, oplog_ts):
+        self.oplog_ts = oplog_ts
+
+
+class OplogReader(threading.Thread):
+    """Thread that drains an oplog cursor into a bounded queue.
+
+    This lets the fetches from the oplog overlap with the writes made to the
+    target systems. The OplogReader can be iterated over just like the
+    tailable cursor it wraps: iteration stops once the reader has caught up
+    with the oplog and ``alive`` becomes False once the cursor is dead.
+    Exceptions raised by the cursor are re-raised to the consumer.
+
+    Each time the cursor catches up, ``last_timestamp`` is called and its
+    result becomes ``caught_up_ts`` once the consumer has iterated up to
+    that point.
+    """
+    # Marker put on the queue once the cursor is exhausted.
+    FINISHED = object()
+
+    def __init__(self, cursor, max_size, last_timestamp=None):
+        super(OplogReader, self).__init__()
+        self.cursor = cursor
+        self.queue = queue.Queue(max_size)
+        self.last_timestamp = last_timestamp
+        # The newest timestamp in the oplog, looked up when the cursor
+        # caught up with the oplog for the last time that the consumer has
+        # iterated up to.
+        self.caught_up_ts = None
+        self.running = True
+        self.finished = False
+        self.daemon = True
+
+    @property
+    def alive(self):
+        return not self.finished
+
+    def _put(self, item):
+        # Don't block forever on a full queue once the consumer has stopped.
+        while self.running:
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def run(self):
+        try:
+            while self.cursor.alive and self.running:
+                for entry in self.cursor:
+                    if not self.running:
+                        break
+                    self._put(entry)
+                caught_up_ts = None
+                if self.last_timestamp is not None:
+                    caught_up_ts = self.last_timestamp()
+                self._put(_CaughtUp(caught_up_ts))
+        except Exception:
+            self._put(sys.exc_info())
+        else:
+            self._put(self.FINISHED)
+
+    def __iter__(self):
+        while not self.finished:
+            item = self.queue.get()
+            if isinstance(item, _CaughtUp):
+                self.caught_up_ts = item.oplog_ts
+                return
+            elif item is self.FINISHED:
+                self.finished = True
+            elif isinstance(item, tuple):
+                # sys.exc_info() of an exception raised by the cursor.
+                self.finished = True
+                reraise(*item)
+            else:
+                yield item
+
+    def stop(self):
+        """Stop reading from the oplog."""
+        self.running = False
+
+
+class DumpReader(threading.Thread):
+    """Thread that reads the documents of a collection dump into a bounded
+    queue of batches.
+
+    This lets the reads from MongoDB overlap with the writes made to a
+    target system during the collection dump. Iterating over the DumpReader
+    yields lists of documents. Exceptions raised while reading the documents
+    are re-raised to the consumer.
+    """
+    # Marker put on the queue once all the documents are read.
+    FINISHED = object()
+
+    def __init__(self, docs, max_size, batch_size=_DUMP_BATCH_SIZE):
+        super(DumpReader, self).__init__()
+        self.docs = docs
+        # Hold at most max_size documents, in batches of batch_size.
+        self.batch_size = max(min(batch_size, max_size), 1)
+        self.queue = queue.Queue(max(max_size // self.batch_size, 1))
+        self.running = True
+        self.daemon = True
+
+    def _put(self, item):
+        # Don't block forever on a full queue once the consumer has stopped.
+        while self.running:
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def run(self):
+        try:
+            batch = []
+            for doc in self.docs:
+                if not self.running:
+                    return
+                batch.append(doc)
+                if len(batch) == self.batch_size:
+                    self._put(batch)
+                    batch = []
+            if batch:
+                self._put(batch)
+        except Exception:
+            self._put(sys.exc_info())
+        else:
+            self._put(self.FINISHED)
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is self.FINISHED:
+                return
+            elif isinstance(item, tuple):
+                # sys.exc_info() of an exception raised while reading.
+                reraise(*item)
+            yield item
+
+    def stop(self):
+        """Stop reading documents."""
+        self.running = False
+
+
+class ApplyLane(threading.Thread):
+    """Thread that applies the oplog entries dispatched to it, in order.
+    """
+
+    def __init__(self, apply_func, max_size):
+        super(ApplyLane, self).__init__()
+        self.apply_func = apply_func
+        self.queue = queue.Queue(max_size)
+        # Timestamp of the last batch that was dispatched to this lane and of
+        # the last batch that this lane has finished applying.
+        self.dispatched_ts = None
+        self.applied_ts = None
+        self.exc_info = None
+        self.daemon = True
+
+    def dispatch(self, entries, last_ts):
+        self.dispatched_ts = last_ts
+        self.queue.put((entries, last_ts))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                entries, last_ts = item
+                # Keep draining the queue after a failure so that
+                # ApplyLanes.wait() returns and re-raises the exception.
+                if self.exc_info is None:
+                    try:
+                        if entries:
+                            self.apply_func(entries)
+                        self.applied_ts = last_ts
+                    except Exception:
+                        self.exc_info = sys.exc_info()
+            finally:
+                self.queue.task_done()
+
+    def stop(self):
+        self.queue.put(None)
+
+
+class ApplyLanes(object):
+    """Applies oplog entries on several threads.
+
+    Entries are partitioned by a hash of their namespace and document _id so
+    that the operations on each document are applied in oplog order. Every
+    lane receives its part of each batch, possibly empty, so the lowest
+    timestamp that all lanes have applied is a safe checkpoint.
+    """
+
+    def __init__(self, apply_func, count, max_size=10):
+        self.lanes = [ApplyLane(apply_func, max_size) for _ in range(count)]
+        # The timestamp to checkpoint once every lane is idle.
+        self.last_ts = None
+
+    def start(self):
+        for lane in self.lanes:
+            lane.start()
+
+    def _check_errors(self):
+        for lane in self.lanes:
+            if lane.exc_info is not None:
+                reraise(*lane.exc_info)
+
+    def dispatch(self, entries):
+        """Partition entries, which must not contain commands, to the lanes.
+        """
+        self._check_errors()
+        if not entries:
+            return
+        parts = [[] for _ in self.lanes]
+        for entry in entries:
+            if entry['op'] == 'u':
+                document_id = entry['o2']['_id']
+            else:
+                document_id = entry['o']['_id']
+            key = util.document_key(entry['ns'], document_id)
+            parts[hash(key) % len(parts)].append(entry)
+        last_ts = entries[-1]['ts']
+        for lane, part in zip(self.lanes, parts):
+            lane.dispatch(part, last_ts)
+
+    def wait(self):
+        """Block until every dispatched entry has been applied."""
+        for lane in self.lanes:
+            lane.queue.join()
+        self._check_errors()
+
+    def recover(self):
+        """Block until every dispatched entry has been handled, and return
+        and forget the sys.exc_info() of the first lane that failed, if any.
+        """
+        exc_info = None
+        for lane in self.lanes:
+            lane.queue.join()
+            if exc_info is None:
+                exc_info = lane.exc_info
+            lane.exc_info = None
+        return exc_info
+
+    def applied_ts(self, last_ts=None):
+        """Return the latest timestamp up to which everything is applied.
+
+        ``last_ts`` is the timestamp of the last oplog entry that has been
+        read, once everything before it has been dispatched.
+        """
+        self._check_errors()
+        if last_ts is not None:
+            self.last_ts = last_ts
+        if all(lane.applied_ts == lane.dispatched_ts for lane in self.lanes):
+            return self.last_ts
+        applied = [lane.applied_ts for lane in self.lanes]
+        if None in applied:
+            return None
+        return min(applied)
+
+    def queued(self):
+        """Return the number of batches waiting to be applied."""
+        return sum(lane.queue.qsize() for lane in self.lanes)
+
+    def reset(self):
+        """Forget the timestamps applied from a previous oplog cursor."""
+        self.wait()
+        self.last_ts = None
+        for lane in self.lanes:
+            lane.dispatched_ts = lane.applied_ts = None
+
+    def stop(self):
+        for lane in self.lanes:
+            lane.stop()
+
+
 class OplogThread(threading.Thread):
     """Thread that tails an oplog.
 
@@ -88,6 +462,41 @@ class OplogThread(threading.Thread):
 
         self.batch_size = kwargs.get('batch_size', DEFAULT_BATCH_SIZE)
 
+        # The maximum number of consecutive oplog entries to apply at once.
+        self.apply_batch_size = kwargs.get('apply_batch_size',
+                                           DEFAULT_APPLY_BATCH_SIZE)
+
+        # Hold up to this many entries, or entries for up to this many
+        # milliseconds, so that operations on the same document can be
+        # coalesced before they are applied. 0 disables either limit.
+        self.coalesce_window = kwargs.get('coalesce_window',
+                                          DEFAULT_COALESCE_WINDOW)
+        self.coalesce_window_ms = kwargs.get('coalesce_window_ms',
+                                             DEFAULT_COALESCE_WINDOW_MS)
+        self.coalesce = bool(self.coalesce_window or self.coalesce_window_ms)
+
+        # The number of threads that apply oplog entries, or 1 to apply them
+        # on this thread.
+        self.apply_threads = kwargs.get('apply_threads',
+                                        DEFAULT_APPLY_THREADS)
+        self.lanes = None
+
+        # The newest oplog timestamps seen the last two times the cursor
+        # caught up with the oplog.
+        self._idle_oplog_timestamps = []
+
+        # Read oplog entries as RawBSONDocuments and only decode the
+        # documents they contain when needed.
+        self.raw_bson = kwargs.get('raw_bson', False)
+        if self.raw_bson and util.RawBSONDocument is None:
+            raise errors.InvalidConfiguration(
+                "Reading the oplog as raw BSON requires PyMongo 3.2 or later.")
+
+        # The maximum number of oplog entries read ahead of the entry that is
+        # being applied, or 0 to read and apply entries in the same thread.
+        self.oplog_queue_size = kwargs.get('oplog_queue_size',
+                                           DEFAULT_OPLOG_QUEUE_SIZE)
+
         # The connection to the primary for this replicaSet.
         self.primary_client = primary_client
 
@@ -107,22 +516,79 @@ class OplogThread(threading.Thread):
         # Stores the timestamp of the last oplog entry read.
         self.checkpoint = None
 
-        # A dictionary that stores OplogThread/timestamp pairs.
-        # Represents the last checkpoint for a OplogThread.
+        # The ProgressSlots that the checkpoint of each OplogThread is
+        # published to.
         self.oplog_progress = oplog_progress_dict
 
+        # The CheckpointStore told about each new checkpoint, or None.
+        self.checkpoint_store = kwargs.get('checkpoint_store')
+
         # The namespace configuration
         self.namespace_config = namespace_config
 
         # Whether the collection dump gracefully handles exceptions
         self.continue_on_error = kwargs.get('continue_on_error', False)
 
+        # The number of threads that dump collections to each DocManager.
+        self.dump_threads = kwargs.get('dump_threads', DEFAULT_DUMP_THREADS)
+
+        # The approximate number of documents in each _id range of a
+        # collection dumped on several threads.
+        self.dump_range_size = kwargs.get('dump_range_size',
+                                          DEFAULT_DUMP_RANGE_SIZE)
+
+        # The maximum number of documents read ahead of the documents being
+        # written to a DocManager during the collection dump, or 0 to read
+        # and write documents in the same thread.
+        self.dump_queue_size = kwargs.get('dump_queue_size',
+                                          DEFAULT_DUMP_QUEUE_SIZE)
+
+        # The read preference for the collection dump and for the documents
+        # read again during a rollback, or None to read from the primary.
+        # The oplog is always read from the primary.
+        self.max_staleness_seconds = kwargs.get('max_staleness_seconds', -1)
+        try:
+            self.read_preference = util.read_preference(
+                kwargs.get('read_preference', 'primary'),
+                self.max_staleness_seconds)
+        except ValueError:
+            reraise(errors.InvalidConfiguration, *sys.exc_info()[1:])
+
+        # The ProgressSlots that the DumpProgress of OplogThreads whose
+        # collection dump is not finished is published to, or None to not
+        # record it.
+        self.dump_progress = kwargs.get('dump_progress_dict')
+
         LOG.info('OplogThread: Initializing oplog thread')
 
         self.oplog = self.primary_client.local.oplog.rs
+        # The options used to decode raw documents from the oplog.
+        self.codec_options = self.oplog.codec_options
         self.replset_name = (
             self.primary_client.admin.command('ismaster')['setName'])
 
+        # Times the stages that each oplog entry goes through and reports
+        # them every stage_timing_interval seconds, or None if disabled.
+        self.stage_timer = None
+        stage_timing_interval = kwargs.get('stage_timing_interval',
+                                           DEFAULT_STAGE_TIMING_INTERVAL)
+        if stage_timing_interval:
+            self.stage_timer = stage_timer.StageTimer(
+                self.replset_name, stage_timing_interval)
+
+        # The FieldFilter used by filter_oplog_entry, and the include and
+        # exclude fields it was created with.
+        self._field_filter = None
+        self._field_filter_fields = None
+
+        # Whether to count the entries replicated by this thread in the
+        # metrics, which is only worth the cost when they are served.
+        self.count_entries = kwargs.get('count_entries', False)
+        # The counter of each operation replicated by this thread.
+        self._entry_counters = dict(
+            (op, _OPLOG_ENTRIES.labels(self.replset_name, name))
+            for op, name in _OPERATION_NAMES.items())
+
         if not self.oplog.find_one():
             err_msg = 'OplogThread: No oplog for thread:'
             LOG.warning('%s %s' % (err_msg, self.primary_client))
@@ -178,11 +644,17 @@ class OplogThread(threading.Thread):
         # Update the namespace.
         entry['ns'] = namespace.dest_name
 
+        field_filter = namespace.field_filter
+        if self.raw_bson and (is_gridfs_file or field_filter):
+            with self._time_stage('decode'):
+                entry['o'] = util.decode_raw_bson(entry['o'],
+                                                  self.codec_options)
+
         # Take fields out of the oplog entry that shouldn't be replicated.
         # This may nullify the document if there's nothing to do.
-        if not self.filter_oplog_entry(
-                entry, include_fields=namespace.include_fields,
-                exclude_fields=namespace.exclude_fields):
+        with self._time_stage('filter'):
+            keep = field_filter.filter_oplog_entry(entry)
+        if not keep:
             return True, False
         return False, is_gridfs_file
 
@@ -192,6 +664,22 @@ class OplogThread(threading.Thread):
         """
         ReplicationLagLogger(self, 30).start()
         LOG.debug("OplogThread: Run thread started")
+        if self.apply_threads > 1:
+            self.lanes = ApplyLanes(self.apply_to_doc_managers,
+                                    self.apply_threads)
+            self.lanes.start()
+            _QUEUE_DEPTH.labels(self.replset_name, 'apply').set_function(
+                self.lanes.queued)
+        try:
+            self._run()
+        finally:
+            if self.lanes is not None:
+                self.lanes.stop()
+                _QUEUE_DEPTH.labels(self.replset_name, 'apply').set(0)
+            if self.stage_timer is not None:
+                self.stage_timer.flush()
+
+    def _run(self):
         while self.running is True:
             LOG.debug("OplogThread: Getting cursor")
             cursor, cursor_empty = retry_until_ok(self.init_cursor)
@@ -209,16 +697,41 @@ class OplogThread(threading.Thread):
                 time.sleep(1)
                 continue
 
+            reader = None
+            if self.oplog_queue_size > 0:
+                # Keep fetching oplog entries while the current ones are
+                # being applied. The checkpoint is only updated below, after
+                # the entries have been applied.
+                reader = OplogReader(cursor, self.oplog_queue_size,
+                                     self.get_last_oplog_timestamp)
+                reader.start()
+                cursor = reader
+                _QUEUE_DEPTH.labels(self.replset_name, 'oplog').set_function(
+                    reader.queue.qsize)
+
+            if self.lanes is not None:
+                self.lanes.reset()
+            self._idle_oplog_timestamps = []
+
             last_ts = None
+            apply_failed = False
             remove_inc = 0
             upsert_inc = 0
             update_inc = 0
+            # Consecutive entries waiting to be applied to the targets.
+            batch = []
+            batch_started = time.time()
+            timer = self.stage_timer
             try:
                 LOG.debug("OplogThread: about to process new oplog entries")
                 while cursor.alive and self.running:
                     LOG.debug("OplogThread: Cursor is still"
                               " alive and thread is still running.")
-                    for n, entry in enumerate(cursor):
+                    entries = cursor
+                    if timer is not None:
+                        # Time how long each entry is waited for.
+                        entries = timer.timed_iter(cursor, 'fetch')
+                    for n, entry in enumerate(entries):
                         # Break out if this thread should stop
                         if not self.running:
                             break
@@ -227,70 +740,48 @@ class OplogThread(threading.Thread):
                                   " document number in this cursor is %d"
                                   % n)
 
-                        skip, is_gridfs_file = self._should_skip_entry(entry)
+                        if self.raw_bson:
+                            # Only decode the top level fields of the entry.
+                            with self._time_stage('decode'):
+                                entry = dict(entry)
+                        with self._time_stage('skip_check'):
+                            skip, is_gridfs_file = self._should_skip_entry(
+                                entry)
+                        if not skip:
+                            operation = entry['op']
+                            if self.count_entries:
+                                self._count_entry(entry)
+                            if operation == 'd':
+                                remove_inc += 1
+                            elif operation == 'i':
+                                upsert_inc += 1
+                            elif operation == 'u':
+                                update_inc += 1
+
+                            if is_gridfs_file and operation == 'i':
+                                # GridFS files are read from MongoDB by the
+                                # DocManagers, so they cannot be batched.
+                                self.apply_batch(batch)
+                                batch = []
+                                self.insert_gridfs_file(entry)
+                            else:
+                                if not batch:
+                                    batch_started = time.time()
+                                batch.append(entry)
+
+                        # update the last_ts on skipped entries to ensure
+                        # our checkpoint does not fall off the oplog. This
+                        # also prevents reprocessing skipped entries.
+                        last_ts = entry['ts']
+
+                        if self._batch_is_ready(batch, batch_started,
+                                                cursor):
+                            self.apply_batch(batch)
+                            batch = []
+
                         if skip:
-                            # update the last_ts on skipped entries to ensure
-                            # our checkpoint does not fall off the oplog. This
-                            # also prevents reprocessing skipped entries.
-                            last_ts = entry['ts']
                             continue
 
-                        # Sync the current oplog operation
-                        operation = entry['op']
-                        ns = entry['ns']
-                        timestamp = util.bson_ts_to_long(entry['ts'])
-                        for docman in self.doc_managers:
-                            try:
-                                LOG.debug("OplogThread: Operation for this "
-                                          "entry is %s" % str(operation))
-
-                                # Remove
-                                if operation == 'd':
-                                    docman.remove(
-                                        entry['o']['_id'], ns, timestamp)
-                                    remove_inc += 1
-
-                                # Insert
-                                elif operation == 'i':  # Insert
-                                    # Retrieve inserted document from
-                                    # 'o' field in oplog record
-                                    doc = entry.get('o')
-                                    # Extract timestamp and namespace
-                                    if is_gridfs_file:
-                                        db, coll = ns.split('.', 1)
-                                        gridfile = GridFSFile(
-                                            self.primary_client[db][coll],
-                                            doc)
-                                        docman.insert_file(
-                                            gridfile, ns, timestamp)
-                                    else:
-                                        docman.upsert(doc, ns, timestamp)
-                                    upsert_inc += 1
-
-                                # Update
-                                elif operation == 'u':
-                                    docman.update(entry['o2']['_id'],
-                                                  entry['o'],
-                                                  ns, timestamp)
-                                    update_inc += 1
-
-                                # Command
-                                elif operation == 'c':
-                                    # use unmapped namespace
-                                    doc = entry.get('o')
-                                    docman.handle_command(doc,
-                                                          entry['ns'],
-                                                          timestamp)
-
-                            except errors.OperationFailed:
-                                LOG.exception(
-                                    "Unable to process oplog document %r"
-                                    % entry)
-                            except errors.ConnectionFailed:
-                                LOG.exception(
-                                    "Connection failed while processing oplog "
-                                    "document %r" % entry)
-
                         if (remove_inc + upsert_inc + update_inc) % 1000 == 0:
                             LOG.debug(
                                 "OplogThread: Documents removed: %d, "
@@ -299,19 +790,26 @@ class OplogThread(threading.Thread):
 
                         LOG.debug("OplogThread: Doc is processed.")
 
-                        last_ts = entry['ts']
-
                         # update timestamp per batch size
                         # n % -1 (default for self.batch_size) == 0 for all n
                         if n % self.batch_size == 1:
-                            self.update_checkpoint(last_ts)
+                            self.apply_batch(batch)
+                            batch = []
+                            self.update_applied_checkpoint(last_ts)
                             last_ts = None
 
                     # update timestamp after running through oplog
-                    if last_ts is not None:
+                    self.apply_batch(batch)
+                    batch = []
+                    if self.running:
+                        idle_ts = self._idle_checkpoint(cursor)
+                        if idle_ts is not None and (
+                                last_ts is None or idle_ts > last_ts):
+                            last_ts = idle_ts
+                    if last_ts is not None or self.lanes is not None:
                         LOG.debug("OplogThread: updating checkpoint after "
                                   "processing new oplog entries")
-                        self.update_checkpoint(last_ts)
+                        self.update_applied_checkpoint(last_ts)
 
             except (pymongo.errors.AutoReconnect,
                     pymongo.errors.OperationFailure,
@@ -319,167 +817,256 @@ class OplogThread(threading.Thread):
                 LOG.exception(
                     "Cursor closed due to an exception. "
                     "Will attempt to reconnect.")
+            except errors.ConnectionFailed:
+                LOG.exception(
+                    "Could not apply oplog entries to a target system. "
+                    "Will read the oplog again from the last checkpoint.")
+                apply_failed = True
+            finally:
+                if reader is not None:
+                    reader.stop()
+                    _QUEUE_DEPTH.labels(self.replset_name, 'oplog').set(0)
 
             # update timestamp before attempting to reconnect to MongoDB,
             # after being join()'ed, or if the cursor closes
-            if last_ts is not None:
+            if batch:
+                LOG.debug("OplogThread: discarding %d oplog entries that "
+                          "were not applied" % len(batch))
+                last_ts = None
+            if self.lanes is not None:
+                exc_info = self.lanes.recover()
+                if exc_info is not None:
+                    if not issubclass(exc_info[0], errors.ConnectionFailed):
+                        reraise(*exc_info)
+                    apply_failed = True
+            if apply_failed:
+                # Some entries before last_ts may not have been applied.
+                last_ts = None
+            elif last_ts is not None or self.lanes is not None:
                 LOG.debug("OplogThread: updating checkpoint after an "
                           "Exception, cursor closing, or join() on this"
                           "thread.")
-                self.update_checkpoint(last_ts)
+                self.update_applied_checkpoint(last_ts)
 
             LOG.debug("OplogThread: Sleeping. Documents removed: %d, "
                       "upserted: %d, updated: %d"
                       % (remove_inc, upsert_inc, update_inc))
             time.sleep(2)
 
-    def join(self):
-        """Stop this thread from managing the oplog.
+    def _count_entry(self, entry):
+        """Count an oplog entry that is replicated in the metrics."""
+        counter = self._entry_counters.get(entry['op'])
+        if counter is not None:
+            counter.inc()
+        # Counted by database rather than namespace, so that the number of
+        # counters stays bounded while temporary collections come and go.
+        _DATABASE_ENTRIES.labels(entry['ns'].split('.', 1)[0]).inc()
+
+    def _idle_checkpoint(self, cursor):
+        """Return a timestamp that the checkpoint can safely advance to.
+
+        This is called each time the cursor has caught up with the oplog.
+        Entries that are filtered out by the oplog query never reach this
+        thread, so the checkpoint could otherwise stay behind while only
+        other namespaces are written to, until it falls off the oplog. The
+        newest entry in the oplog is looked up each time, and the one found
+        two calls ago is returned: the cursor has caught up with the oplog
+        since, so every entry up to it has been read.
         """
-        LOG.debug("OplogThread: exiting due to join call.")
-        self.running = False
-        threading.Thread.join(self)
+        idle_ts = None
+        if len(self._idle_oplog_timestamps) == 2:
+            idle_ts = self._idle_oplog_timestamps.pop(0)
+        if isinstance(cursor, OplogReader):
+            # The reader may be several catch-ups ahead of this thread, so
+            # use the timestamp it looked up when it caught up with the
+            # oplog at the point that this thread has reached.
+            newest_ts, cursor.caught_up_ts = cursor.caught_up_ts, None
+        else:
+            newest_ts = self.get_last_oplog_timestamp()
+        if newest_ts is not None:
+            self._idle_oplog_timestamps.append(newest_ts)
+        if idle_ts is None or (self.checkpoint is not None and
+                               idle_ts <= self.checkpoint):
+            return None
+        return idle_ts
 
-    @classmethod
-    def _find_field(cls, field, doc):
-        """Find the field in the document which matches the given field.
+    def _batch_is_ready(self, batch, batch_started, cursor):
+        """Return True if the pending oplog entries should be applied now.
+        """
+        if len(batch) >= self.apply_batch_size:
+            return True
+        if not self.coalesce:
+            if isinstance(cursor, OplogReader):
+                # Apply the batch when the next entry is not available yet.
+                return cursor.queue.empty()
+            # Reading directly from the cursor, there is no way to tell
+            # whether the next entry is available without waiting for it, so
+            # each entry is applied as soon as it is read.
+            return True
+        if self.coalesce_window and len(batch) >= self.coalesce_window:
+            return True
+        if self.coalesce_window_ms:
+            elapsed = (time.time() - batch_started) * 1000
+            return elapsed >= self.coalesce_window_ms
+        return False
 
-        The field may be in dot notation, eg "a.b.c". Returns a list with
-        a single tuple (path, field_value) or the empty list if the field
-        is not present.
+    def apply_batch(self, batch):
+        """Apply a run of consecutive oplog entries to each target system.
         """
-        path = field.split('.')
-        try:
-            for key in path:
-                doc = doc[key]
-            return [(path, doc)]
-        except (KeyError, TypeError):
-            return []
+        if not batch:
+            return
+        if self.coalesce:
+            if self.raw_bson:
+                # Merging operations needs the documents.
+                with self._time_stage('decode'):
+                    batch = [util.decode_oplog_entry(entry,
+                                                     self.codec_options)
+                             for entry in batch]
+            with self._time_stage('coalesce'):
+                batch = coalesce_entries(batch)
+        if self.lanes is None:
+            self.apply_to_doc_managers(batch)
+            return
 
-    @classmethod
-    def _find_update_fields(cls, field, doc):
-        """Find the fields in the update document which match the given field.
+        # Commands may affect any document, so they are applied on this
+        # thread once everything before them has been applied.
+        entries = []
+        for entry in batch:
+            if entry['op'] == 'c':
+                self.lanes.dispatch(entries)
+                entries = []
+                self.lanes.wait()
+                self.apply_to_doc_managers([entry])
+            else:
+                entries.append(entry)
+        self.lanes.dispatch(entries)
 
-        Both the field and the top level keys in the doc may be in dot
-        notation, eg "a.b.c". Returns a list of tuples (path, field_value) or
-        the empty list if the field is not present.
+    def apply_to_doc_managers(self, batch):
+        """Apply oplog entries to each target system on the current thread.
         """
-        def find_partial_matches():
-            for key in doc:
-                if len(key) > len(field):
-                    # Handle case where field is a prefix of key, eg field is
-                    # 'a' and key is 'a.b'.
-                    if key.startswith(field) and key[len(field)] == '.':
-                        yield [key], doc[key]
-                        # Continue searching, there may be multiple matches.
-                        # For example, field 'a' should match 'a.b' and 'a.c'.
-                elif len(key) < len(field):
-                    # Handle case where key is a prefix of field, eg field is
-                    # 'a.b' and key is 'a'.
-                    if field.startswith(key) and field[len(key)] == '.':
-                        # Search for the remaining part of the field
-                        matched = cls._find_field(field[len(key) + 1:],
-                                                  doc[key])
-                        if matched:
-                            # Add the top level key to the path.
-                            match = matched[0]
-                            match[0].insert(0, key)
-                            yield match
-                        # Stop searching, it's not possible for any other
-                        # keys in the update doc to match this field.
-                        return
+        decoded_batch = None
+        for docman in self.doc_managers:
+            entries = batch
+            if self.raw_bson and not getattr(docman, 'accepts_raw_bson',
+                                             False):
+                if decoded_batch is None:
+                    with self._time_stage('decode'):
+                        decoded_batch = [
+                            util.decode_oplog_entry(entry,
+                                                    self.codec_options)
+                            for entry in batch]
+                entries = decoded_batch
+            try:
+                with _time_call(docman, 'apply_batch'):
+                    with self._time_stage('apply_batch'):
+                        docman.apply_batch(entries)
+            except errors.OperationFailed:
+                LOG.exception(
+                    "Unable to process oplog batch ending with document %r"
+                    % batch[-1])
+            except errors.ConnectionFailed:
+                # The checkpoint must not move past the batch, which is
+                # applied again once the oplog is read again.
+                LOG.exception(
+                    "Connection failed while processing oplog batch ending "
+                    "with document %r" % batch[-1])
+                raise
+
+    def _time_stage(self, stage):
+        """Return a context manager that times a stage, if enabled."""
+        if self.stage_timer is None:
+            return stage_timer.NULL_TIMER
+        return self.stage_timer.time(stage)
+
+    def insert_gridfs_file(self, entry):
+        """Insert the GridFS file from an oplog entry into each target system.
+        """
+        if self.lanes is not None:
+            self.lanes.wait()
+        ns = entry['ns']
+        timestamp = util.bson_ts_to_long(entry['ts'])
+        db, coll = ns.split('.', 1)
+        for docman in self.doc_managers:
+            try:
+                gridfile = GridFSFile(self.primary_client[db][coll],
+                                      entry['o'])
+                with _time_call(docman, 'insert_file'):
+                    with self._time_stage('insert_file'):
+                        docman.insert_file(gridfile, ns, timestamp)
+            except errors.OperationFailed:
+                LOG.exception("Unable to process oplog document %r" % entry)
+            except errors.ConnectionFailed:
+                LOG.exception(
+                    "Connection failed while processing oplog "
+                    "document %r" % entry)
+                raise
 
-        try:
-            return [([field], doc[field])]
-        except KeyError:
-            # Field does not exactly match any key in the update doc.
-            return list(find_partial_matches())
-
-    def _pop_excluded_fields(self, doc, exclude_fields, update=False):
-        # Remove all the fields that were passed in exclude_fields.
-        find_fields = self._find_update_fields if update else self._find_field
-        for field in exclude_fields:
-            for path, _ in find_fields(field, doc):
-                # Delete each matching field in the original document.
-                temp_doc = doc
-                for p in path[:-1]:
-                    temp_doc = temp_doc[p]
-                temp_doc.pop(path[-1])
-
-        return doc  # Need this to be similar to copy_included_fields.
-
-    def _copy_included_fields(self, doc, include_fields, update=False):
-        new_doc = {}
-        find_fields = self._find_update_fields if update else self._find_field
-        for field in include_fields:
-            for path, value in find_fields(field, doc):
-                # Copy each matching field in the original document.
-                temp_doc = new_doc
-                for p in path[:-1]:
-                    temp_doc = temp_doc.setdefault(p, {})
-                temp_doc[path[-1]] = value
-
-        return new_doc
+    def join(self):
+        """Stop this thread from managing the oplog.
+        """
+        LOG.debug("OplogThread: exiting due to join call.")
+        self.running = False
+        threading.Thread.join(self)
 
     def filter_oplog_entry(self, entry, include_fields=None,
                            exclude_fields=None):
         """Remove fields from an oplog entry that should not be replicated.
 
         NOTE: this does not support array indexing, for example 'a.b.2'"""
-        if not include_fields and not exclude_fields:
-            return entry
-        elif include_fields:
-            filter_fields = self._copy_included_fields
-        else:
-            filter_fields = self._pop_excluded_fields
-
-        fields = include_fields or exclude_fields
-        entry_o = entry['o']
-        # 'i' indicates an insert. 'o' field is the doc to be inserted.
-        if entry['op'] == 'i':
-            entry['o'] = filter_fields(entry_o, fields)
-        # 'u' indicates an update. The 'o' field describes an update spec
-        # if '$set' or '$unset' are present.
-        elif entry['op'] == 'u' and ('$set' in entry_o or '$unset' in entry_o):
-            if '$set' in entry_o:
-                entry['o']["$set"] = filter_fields(
-                    entry_o["$set"], fields, update=True)
-            if '$unset' in entry_o:
-                entry['o']["$unset"] = filter_fields(
-                    entry_o["$unset"], fields, update=True)
-            # not allowed to have empty $set/$unset, so remove if empty
-            if "$set" in entry_o and not entry_o['$set']:
-                entry_o.pop("$set")
-            if "$unset" in entry_o and not entry_o['$unset']:
-                entry_o.pop("$unset")
-            if not entry_o:
-                return None
-        # 'u' indicates an update. The 'o' field is the replacement document
-        # if no '$set' or '$unset' are present.
-        elif entry['op'] == 'u':
-            entry['o'] = filter_fields(entry_o, fields)
-
-        return entry
+        fields = (tuple(include_fields or ()), tuple(exclude_fields or ()))
+        if fields != self._field_filter_fields:
+            # Compile the fields only when they change.
+            self._field_filter = FieldFilter(include_fields, exclude_fields)
+            self._field_filter_fields = fields
+        return self._field_filter.filter_oplog_entry(entry)
 
     def get_oplog_cursor(self, timestamp=None):
         """Get a cursor to the oplog after the given timestamp, excluding
-        no-op entries.
+        no-op entries and entries that would be skipped anyway.
 
         If no timestamp is specified, returns a cursor to the entire oplog.
         """
-        query = {'op': {'$ne': 'n'}}
+        query = self._oplog_filter()
+        oplog = self.oplog
+        if self.raw_bson:
+            oplog = oplog.with_options(
+                codec_options=oplog.codec_options._replace(
+                    document_class=util.RawBSONDocument))
         if timestamp is None:
-            cursor = self.oplog.find(
+            cursor = oplog.find(
                 query,
                 cursor_type=CursorType.TAILABLE_AWAIT)
         else:
-            query['ts'] = {'$gte': timestamp}
-            cursor = self.oplog.find(
+            # The entry at the checkpoint is always returned first, even if
+            # it is filtered out, so that init_cursor can find it.
+            query = {'ts': {'$gte': timestamp},
+                     '$or': [{'ts': timestamp}, query]}
+            cursor = oplog.find(
                 query,
                 cursor_type=CursorType.TAILABLE_AWAIT,
                 oplog_replay=True)
         return cursor
 
+    def _oplog_filter(self):
+        """Return a query that matches the oplog entries that may be applied.
+
+        This filters out most of the entries that _should_skip_entry would
+        skip, so that they are never sent by the server.
+        """
+        query = {'op': {'$ne': 'n'}, 'fromMigrate': {'$ne': True}}
+        ns_query = {'$nin': [_SYSTEM_NAMESPACE_REGEX,
+                             _GRIDFS_CHUNKS_NAMESPACE_REGEX]}
+        source_query = self.namespace_config.source_namespace_query() or {}
+        if '$in' in source_query:
+            ns_query['$in'] = source_query['$in']
+        else:
+            # GridFS files are only replicated from included namespaces.
+            ns_query['$nin'].append(_GRIDFS_FILES_NAMESPACE_REGEX)
+        ns_query['$nin'].extend(source_query.get('$nin', []))
+        # Commands are never filtered out.
+        query['$or'] = [{'ns': _COMMAND_NAMESPACE_REGEX}, {'ns': ns_query}]
+        return query
+
     def get_collection(self, namespace):
         """Get a pymongo collection from a namespace."""
         database, coll = namespace.split('.', 1)
@@ -490,15 +1077,32 @@ class OplogThread(threading.Thread):
 
         This method is called when we're initializing the cursor and have no
         configs i.e. when we're starting for the first time.
+
+        If a previous dump was interrupted, the dump continues where it
+        stopped and returns the timestamp that the previous dump started at.
         """
 
         timestamp = retry_until_ok(self.get_last_oplog_timestamp)
         if timestamp is None:
             return None
-        long_ts = util.bson_ts_to_long(timestamp)
+        read_preference = self.read_preference
+        if read_preference is not None:
+            # Replay the oplog from before the oldest data the dump may read
+            # from a secondary.
+            read_ts = self._secondary_read_timestamp(timestamp)
+            if read_ts is None:
+                LOG.warning("OplogThread: The oplog does not go back "
+                            "maxStalenessSeconds before the collection "
+                            "dump, dumping the collections from the "
+                            "primary.")
+                read_preference = None
+            else:
+                timestamp = read_ts
         # Flag if this oplog thread was cancelled during the collection dump.
         # Use a list to workaround python scoping.
         dump_cancelled = [False]
+        # Flag if a dump thread failed, so that the others stop.
+        dump_failed = [False]
 
         def get_all_ns():
             ns_set = []
@@ -533,34 +1137,54 @@ class OplogThread(threading.Thread):
 
         dump_set, gridfs_dump_set = get_all_ns()
 
+        def get_collection(namespace):
+            collection = self.get_collection(namespace)
+            if read_preference is not None:
+                collection = collection.with_options(
+                    read_preference=read_preference)
+            return collection
+
         LOG.debug("OplogThread: Dumping set of collections %s " % dump_set)
 
-        def docs_to_dump(from_coll):
-            last_id = None
+        def docs_to_dump(from_coll, id_range=(None, None), last_id=None):
+            min_id, max_id = id_range
             attempts = 0
             projection = self.namespace_config.projection(from_coll.full_name)
             # Loop to handle possible AutoReconnect
             while attempts < 60:
-                if last_id is None:
+                if min_id is None and max_id is None and last_id is None:
                     cursor = retry_until_ok(
                         from_coll.find,
                         projection=projection,
                         sort=[("_id", pymongo.ASCENDING)]
                     )
                 else:
+                    # Scan a range of the _id index rather than querying it,
+                    # since $gt and $lt only match _ids of the same type as
+                    # the bounds.
                     cursor = retry_until_ok(
                         from_coll.find,
-                        {"_id": {"$gt": last_id}},
                         projection=projection,
                         sort=[("_id", pymongo.ASCENDING)]
-                    )
+                    ).hint([("_id", pymongo.ASCENDING)])
+                    if last_id is not None:
+                        # The lower bound is inclusive, so the last document
+                        # is dumped again.
+                        cursor.min([("_id", last_id)])
+                    elif min_id is not None:
+                        cursor.min([("_id", min_id)])
+                    if max_id is not None:
+                        cursor.max([("_id", max_id)])
                 try:
                     for doc in cursor:
                         if not self.running:
                             # Thread was joined while performing the
                             # collection dump.
                             dump_cancelled[0] = True
-                            raise StopIteration
+                            return
+                        if dump_failed[0]:
+                            # Another dump thread failed.
+                            return
                         last_id = doc["_id"]
                         yield doc
                     break
@@ -569,73 +1193,286 @@ class OplogThread(threading.Thread):
                     attempts += 1
                     time.sleep(1)
 
-        def upsert_each(dm):
-            num_failed = 0
+        def dump_tasks():
+            """Split the collections to dump into ranges of _ids.
+
+            Returns a list of (namespace, (min _id, max _id)) tuples, the
+            bounds are None when the range is not bounded.
+            """
+            tasks = []
             for namespace in dump_set:
-                from_coll = self.get_collection(namespace)
-                mapped_ns = self.namespace_config.map_namespace(namespace)
-                total_docs = retry_until_ok(from_coll.count)
-                num = None
-                for num, doc in enumerate(docs_to_dump(from_coll)):
-                    try:
+                from_coll = get_collection(namespace)
+                for id_range in self._dump_ranges(from_coll):
+                    tasks.append((namespace, id_range))
+            return tasks
+
+        def dump_stopped():
+            return dump_cancelled[0] or dump_failed[0]
+
+        def upsert_each(dm, task):
+            num_failed = 0
+            dm_index = self.doc_managers.index(dm)
+            namespace, id_range = progress.tasks[task]
+            from_coll = get_collection(namespace)
+            mapped_ns = self.namespace_config.map_namespace(namespace)
+            total_docs = retry_until_ok(from_coll.count)
+            num = None
+            docs = docs_to_dump(from_coll, id_range,
+                                progress.last_id(dm_index, task))
+            for num, doc in enumerate(docs):
+                try:
+                    with _time_call(dm, 'upsert'):
                         dm.upsert(doc, mapped_ns, long_ts)
-                    except Exception:
-                        if self.continue_on_error:
-                            LOG.exception(
-                                "Could not upsert document: %r" % doc)
-                            num_failed += 1
-                        else:
-                            raise
-                    if num % 10000 == 0:
-                        LOG.info("Upserted %d out of approximately %d docs "
-                                 "from collection '%s'",
-                                 num + 1, total_docs, namespace)
-                if num is not None:
-                    LOG.info("Upserted %d out of approximately %d docs from "
-                             "collection '%s'",
+                    dumped_docs.inc()
+                except Exception:
+                    if self.continue_on_error:
+                        LOG.exception(
+                            "Could not upsert document: %r" % doc)
+                        num_failed += 1
+                    else:
+                        raise
+                progress.update(dm_index, task, doc["_id"])
+                if num % 10000 == 0:
+                    LOG.info("Upserted %d out of approximately %d docs "
+                             "from collection '%s'",
                              num + 1, total_docs, namespace)
+            if num is not None:
+                LOG.info("Upserted %d out of approximately %d docs from "
+                         "collection '%s'",
+                         num + 1, total_docs, namespace)
             if num_failed > 0:
                 LOG.error("Failed to upsert %d docs" % num_failed)
+            if not dump_stopped():
+                progress.finish(dm_index, task)
 
-        def upsert_all(dm):
+        def upsert_range(dm, task):
+            dm_index = self.doc_managers.index(dm)
+            if progress.is_finished(dm_index, task):
+                return
             try:
-                for namespace in dump_set:
-                    from_coll = self.get_collection(namespace)
+                namespace, id_range = progress.tasks[task]
+                from_coll = get_collection(namespace)
+                mapped_ns = self.namespace_config.map_namespace(namespace)
+                last_id = progress.last_id(dm_index, task)
+                if last_id is not None:
+                    LOG.info("Resuming bulk upsert of collection '%s' from "
+                             "_id %r", namespace, last_id)
+                elif id_range == (None, None):
                     total_docs = retry_until_ok(from_coll.count)
-                    mapped_ns = self.namespace_config.map_namespace(
-                            namespace)
                     LOG.info("Bulk upserting approximately %d docs from "
                              "collection '%s'",
                              total_docs, namespace)
-                    dm.bulk_upsert(docs_to_dump(from_coll),
-                                   mapped_ns, long_ts)
+                else:
+                    LOG.info("Bulk upserting docs with _id in [%r, %r) from "
+                             "collection '%s'",
+                             id_range[0], id_range[1], namespace)
+                docs = docs_to_dump(from_coll, id_range, last_id)
+                reader = None
+                if self.dump_queue_size:
+                    reader = DumpReader(docs, self.dump_queue_size)
+                    reader.start()
+                    batches = iter(reader)
+                else:
+                    batches = iter(lambda: list(
+                        itertools.islice(docs, _DUMP_BATCH_SIZE)), [])
+                try:
+                    for batch in batches:
+                        with _time_call(dm, 'bulk_upsert'):
+                            dm.bulk_upsert(iter(batch), mapped_ns, long_ts)
+                        dumped_docs.inc(len(batch))
+                        progress.update(dm_index, task, batch[-1]["_id"])
+                finally:
+                    if reader is not None:
+                        reader.stop()
+                if not dump_stopped():
+                    progress.finish(dm_index, task)
             except Exception:
                 if self.continue_on_error:
                     LOG.exception("OplogThread: caught exception"
                                   " during bulk upsert, re-upserting"
                                   " documents serially")
-                    upsert_each(dm)
+                    upsert_each(dm, task)
                 else:
                     raise
 
-        def do_dump(dm, error_queue):
+        def run_tasks(dump_task):
+            """Call dump_task with the index of every task, on up to
+            dump_threads threads.
+            """
+            if self.dump_threads <= 1:
+                for task in range(len(progress.tasks)):
+                    dump_task(task)
+                return
+
+            task_queue = queue.Queue()
+            for task in range(len(progress.tasks)):
+                task_queue.put(task)
+            task_errors = queue.Queue()
+
+            def task_worker():
+                try:
+                    while self.running and not dump_failed[0]:
+                        try:
+                            task = task_queue.get_nowait()
+                        except queue.Empty:
+                            return
+                        dump_task(task)
+                except Exception:
+                    dump_failed[0] = True
+                    task_errors.put(sys.exc_info())
+
+            workers = [threading.Thread(target=task_worker)
+                       for _ in range(min(self.dump_threads,
+                                          len(progress.tasks)))]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
             try:
-                LOG.debug("OplogThread: Using bulk upsert function for "
-                          "collection dump")
-                upsert_all(dm)
+                reraise(*task_errors.get_nowait())
+            except queue.Empty:
+                pass
 
-                if gridfs_dump_set:
-                    LOG.info("OplogThread: dumping GridFS collections: %s",
-                             gridfs_dump_set)
+        def upsert_all(dm):
+            run_tasks(lambda task: upsert_range(dm, task))
 
+        def upsert_batch(dm, batch, mapped_ns):
+            try:
+                with _time_call(dm, 'bulk_upsert'):
+                    dm.bulk_upsert(iter(batch), mapped_ns, long_ts)
+                dumped_docs.inc(len(batch))
+            except Exception:
+                if not self.continue_on_error:
+                    raise
+                LOG.exception("OplogThread: caught exception during bulk "
+                              "upsert, re-upserting documents serially")
+                num_failed = 0
+                for doc in batch:
+                    try:
+                        with _time_call(dm, 'upsert'):
+                            dm.upsert(doc, mapped_ns, long_ts)
+                        dumped_docs.inc()
+                    except Exception:
+                        LOG.exception("Could not upsert document: %r" % doc)
+                        num_failed += 1
+                if num_failed > 0:
+                    LOG.error("Failed to upsert %d docs" % num_failed)
+
+        def fan_out_range(task):
+            """Read a task once and write it to every DocManager that has
+            not finished it.
+            """
+            dm_indexes = [dm_index
+                          for dm_index in range(len(self.doc_managers))
+                          if not progress.is_finished(dm_index, task)]
+            if not dm_indexes:
+                return
+            namespace, id_range = progress.tasks[task]
+            from_coll = get_collection(namespace)
+            mapped_ns = self.namespace_config.map_namespace(namespace)
+            last_ids = [progress.last_id(dm_index, task)
+                        for dm_index in dm_indexes]
+            last_id = last_ids[0]
+            if any(other_id != last_id for other_id in last_ids[1:]):
+                # The DocManagers stopped at different documents, so dump
+                # the whole task again.
+                last_id = None
+            if last_id is not None:
+                LOG.info("Resuming bulk upsert of collection '%s' from _id "
+                         "%r", namespace, last_id)
+            elif id_range == (None, None):
+                LOG.info("Bulk upserting approximately %d docs from "
+                         "collection '%s'",
+                         retry_until_ok(from_coll.count), namespace)
+            else:
+                LOG.info("Bulk upserting docs with _id in [%r, %r) from "
+                         "collection '%s'",
+                         id_range[0], id_range[1], namespace)
+
+            # A batch is recorded in the dump progress once every
+            # DocManager has written it. Each DocManager writes the batches
+            # in order, so the progress only moves forward.
+            written_lock = threading.Lock()
+            write_errors = queue.Queue()
+
+            def put_batch(batch_queue, item):
+                while self.running and not dump_failed[0]:
+                    try:
+                        batch_queue.put(item, timeout=1)
+                        return
+                    except queue.Full:
+                        pass
+
+            def write_batches(dm, batch_queue):
+                try:
+                    while self.running and not dump_failed[0]:
+                        try:
+                            item = batch_queue.get(timeout=1)
+                        except queue.Empty:
+                            continue
+                        if item is None:
+                            return
+                        batch, remaining = item
+                        upsert_batch(dm, batch, mapped_ns)
+                        with written_lock:
+                            remaining[0] -= 1
+                            if remaining[0] == 0:
+                                for dm_index in dm_indexes:
+                                    progress.update(dm_index, task,
+                                                    batch[-1]["_id"])
+                except Exception:
+                    dump_failed[0] = True
+                    write_errors.put(sys.exc_info())
+
+            # Each DocManager may fall behind the source by this many batches.
+            max_batches = max(self.dump_queue_size // _DUMP_BATCH_SIZE, 1)
+            batch_queues = [queue.Queue(max_batches) for _ in dm_indexes]
+            writers = [
+                threading.Thread(target=write_batches,
+                                 args=(self.doc_managers[dm_index],
+                                       batch_queue))
+                for dm_index, batch_queue in zip(dm_indexes, batch_queues)]
+            for writer in writers:
+                writer.start()
+            try:
+                docs = docs_to_dump(from_coll, id_range, last_id)
+                for batch in iter(lambda: list(
+                        itertools.islice(docs, _DUMP_BATCH_SIZE)), []):
+                    item = (batch, [len(batch_queues)])
+                    for batch_queue in batch_queues:
+                        put_batch(batch_queue, item)
+            finally:
+                for batch_queue in batch_queues:
+                    put_batch(batch_queue, None)
+                for writer in writers:
+                    writer.join()
+            try:
+                reraise(*write_errors.get_nowait())
+            except queue.Empty:
+                pass
+            if not dump_stopped():
+                for dm_index in dm_indexes:
+                    progress.finish(dm_index, task)
+
+        def dump_gridfs(dm, error_queue):
+            try:
                 # Dump GridFS files
+                dm_index = self.doc_managers.index(dm)
                 for gridfs_ns in gridfs_dump_set:
-                    mongo_coll = self.get_collection(gridfs_ns)
-                    from_coll = self.get_collection(gridfs_ns + '.files')
+                    if progress.is_finished(dm_index, gridfs_ns):
+                        continue
+                    mongo_coll = get_collection(gridfs_ns)
+                    from_coll = get_collection(gridfs_ns + '.files')
                     dest_ns = self.namespace_config.map_namespace(gridfs_ns)
-                    for doc in docs_to_dump(from_coll):
+                    last_id = progress.last_id(dm_index, gridfs_ns)
+                    for doc in docs_to_dump(from_coll, last_id=last_id):
                         gridfile = GridFSFile(mongo_coll, doc)
-                        dm.insert_file(gridfile, dest_ns, long_ts)
+                        with _time_call(dm, 'insert_file'):
+                            dm.insert_file(gridfile, dest_ns, long_ts)
+                        dumped_docs.inc()
+                        progress.update(dm_index, gridfs_ns, doc["_id"])
+                    if not dump_stopped():
+                        progress.finish(dm_index, gridfs_ns)
             except:
                 # Likely exceptions:
                 # pymongo.errors.OperationFailure,
@@ -643,8 +1480,55 @@ class OplogThread(threading.Thread):
                 # mongo_connector.errors.OperationFailed
                 error_queue.put(sys.exc_info())
 
-        # Extra threads (if any) that assist with collection dumps
-        dumping_threads = []
+        def do_dump(dm, error_queue):
+            try:
+                LOG.debug("OplogThread: Using bulk upsert function for "
+                          "collection dump")
+                upsert_all(dm)
+            except:
+                error_queue.put(sys.exc_info())
+                return
+            if gridfs_dump_set:
+                LOG.info("OplogThread: dumping GridFS collections: %s",
+                         gridfs_dump_set)
+            dump_gridfs(dm, error_queue)
+
+        def fan_out_dump(error_queue):
+            try:
+                LOG.debug("OplogThread: Reading each collection once for "
+                          "%d DocManagers", len(self.doc_managers))
+                run_tasks(fan_out_range)
+            except:
+                error_queue.put(sys.exc_info())
+                return
+            if gridfs_dump_set:
+                LOG.info("OplogThread: dumping GridFS collections: %s",
+                         gridfs_dump_set)
+            # GridFS files are read by each DocManager, so there is nothing
+            # to share between them.
+            gridfs_threads = [
+                threading.Thread(target=dump_gridfs, args=(dm, error_queue))
+                for dm in self.doc_managers]
+            for t in gridfs_threads:
+                t.start()
+            for t in gridfs_threads:
+                t.join()
+
+        progress = self._resumable_dump_progress(dump_set, gridfs_dump_set)
+        if progress is None:
+            progress = DumpProgress(timestamp, dump_set, gridfs_dump_set,
+                                    dump_tasks(), len(self.doc_managers))
+            self.update_dump_progress(progress)
+        else:
+            # Replay the oplog from where the interrupted dump started.
+            timestamp = progress.timestamp
+            LOG.info("OplogThread: Resuming the collection dump that "
+                     "started at %s", timestamp)
+        long_ts = util.bson_ts_to_long(timestamp)
+        dumped_docs = _DUMP_DOCUMENTS.labels(self.replset_name)
+        remaining_tasks = _DUMP_TASKS_REMAINING.labels(self.replset_name)
+        remaining_tasks.set_function(progress.remaining_tasks)
+
         # Did the dump succeed for all target systems?
         dump_success = True
         # Holds any exceptions we can't recover from
@@ -653,15 +1537,11 @@ class OplogThread(threading.Thread):
         if len(self.doc_managers) == 1:
             do_dump(self.doc_managers[0], errors)
         else:
-            # Slight performance gain breaking dump into separate
-            # threads if > 1 replication target
-            for dm in self.doc_managers:
-                t = threading.Thread(target=do_dump, args=(dm, errors))
-                dumping_threads.append(t)
-                t.start()
-            # cleanup
-            for t in dumping_threads:
-                t.join()
+            # Read the collections once and write each batch of documents
+            # to all the target systems.
+            fan_out_dump(errors)
+
+        remaining_tasks.set(progress.remaining_tasks())
 
         # Print caught exceptions
         try:
@@ -681,11 +1561,113 @@ class OplogThread(threading.Thread):
 
         if dump_cancelled[0]:
             LOG.warning('Initial collection dump was interrupted. '
-                        'Will re-run the collection dump on next startup.')
+                        'Will resume the collection dump on next startup.')
             return None
 
         return timestamp
 
+    def _secondary_read_timestamp(self, timestamp):
+        """Return the timestamp of an oplog entry, no later than timestamp,
+        that documents read with the read preference are at least as recent
+        as.
+
+        Returns None if the oplog does not go back that far.
+        """
+        if self.read_preference is None:
+            return timestamp
+        oldest_time = (timestamp.time - self.max_staleness_seconds -
+                       _STALENESS_MARGIN_SECS)
+        if oldest_time <= 0:
+            return None
+        entry = retry_until_ok(
+            self.oplog.find_one,
+            {'ts': {'$lt': bson.Timestamp(oldest_time, 0)},
+             'op': {'$ne': 'n'}},
+            sort=[('$natural', pymongo.DESCENDING)])
+        if entry is None:
+            return None
+        return entry['ts']
+
+    def _resumable_dump_progress(self, namespaces, gridfs_namespaces):
+        """Return the DumpProgress of an interrupted collection dump that can
+        be resumed, or None.
+        """
+        progress = self.read_dump_progress()
+        if progress is None:
+            return None
+        if not progress.can_resume(namespaces, gridfs_namespaces,
+                                   len(self.doc_managers)):
+            LOG.warning("OplogThread: The collections to dump have changed "
+                        "since the interrupted collection dump started, "
+                        "restarting the collection dump.")
+            return None
+        oldest_ts = retry_until_ok(self.get_oldest_oplog_timestamp)
+        if oldest_ts is None or progress.timestamp < oldest_ts:
+            LOG.warning("OplogThread: The interrupted collection dump started "
+                        "at %s, which has fallen off the oplog, restarting "
+                        "the collection dump.", progress.timestamp)
+            return None
+        return progress
+
+    def _dump_ranges(self, collection):
+        """Split a collection into ranges of _ids to dump on several threads.
+
+        Returns a list of (min _id, max _id) tuples. The min is inclusive,
+        the max is exclusive and None means the range is unbounded.
+        """
+        if self.dump_threads <= 1:
+            return [(None, None)]
+        try:
+            stats = collection.database.command('collstats', collection.name)
+        except pymongo.errors.OperationFailure:
+            LOG.warning("OplogThread: Unable to get the size of collection "
+                        "'%s', dumping it on a single thread",
+                        collection.full_name, exc_info=True)
+            return [(None, None)]
+        if stats.get('count', 0) < 2 * self.dump_range_size:
+            return [(None, None)]
+        split_keys = self._split_keys(collection, stats)
+        LOG.info("OplogThread: Dumping collection '%s' in %d ranges",
+                 collection.full_name, len(split_keys) + 1)
+        bounds = [None] + split_keys + [None]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def _split_keys(self, collection, stats):
+        """Return the sorted _ids that split a collection into ranges of
+        about dump_range_size documents.
+        """
+        # splitVector splits chunks at half their maximum size.
+        max_chunk_size = (2 * self.dump_range_size *
+                          max(stats.get('avgObjSize', 1), 1))
+        try:
+            result = collection.database.command(
+                'splitVector', collection.full_name,
+                keyPattern={'_id': 1}, maxChunkSizeBytes=max_chunk_size)
+            return [split_key['_id'] for split_key in result['splitKeys']]
+        except pymongo.errors.OperationFailure:
+            LOG.info("OplogThread: splitVector failed on collection '%s', "
+                     "sampling _ids instead", collection.full_name,
+                     exc_info=True)
+
+        # Take evenly spaced _ids from a sorted random sample.
+        num_ranges = stats['count'] // self.dump_range_size
+        try:
+            sample = [doc['_id'] for doc in collection.aggregate([
+                {'$sample': {'size': num_ranges * _SAMPLES_PER_RANGE}},
+                {'$project': {'_id': 1}},
+                {'$sort': {'_id': 1}}], allowDiskUse=True)]
+        except pymongo.errors.OperationFailure:
+            LOG.warning("OplogThread: Unable to sample collection '%s', "
+                        "dumping it on a single thread",
+                        collection.full_name, exc_info=True)
+            return []
+        split_keys = []
+        for _id in sample[_SAMPLES_PER_RANGE::_SAMPLES_PER_RANGE]:
+            # A sample may contain the same document more than once.
+            if not split_keys or split_keys[-1] != _id:
+                split_keys.append(_id)
+        return split_keys
+
     def _get_oplog_timestamp(self, newest_entry):
         """Return the timestamp of the latest or earliest entry in the oplog.
         """
@@ -748,6 +1730,9 @@ class OplogThread(threading.Thread):
                 cursor = self.get_oplog_cursor()
                 return cursor, self._cursor_empty(cursor)
 
+        # The checkpoint supersedes the progress of the collection dump.
+        self.update_dump_progress(None)
+
         cursor = self.get_oplog_cursor(timestamp)
         cursor_empty = self._cursor_empty(cursor)
 
@@ -783,54 +1768,69 @@ class OplogThread(threading.Thread):
         # first entry has been consumed
         return cursor, cursor_empty
 
+    def update_applied_checkpoint(self, last_ts):
+        """Update the checkpoint once all entries up to last_ts are applied.
+
+        When entries are applied on several threads, the checkpoint is only
+        advanced as far as every thread has gotten.
+        """
+        if self.lanes is not None:
+            last_ts = self.lanes.applied_ts(last_ts)
+        self.update_checkpoint(last_ts)
+
     def update_checkpoint(self, checkpoint):
-        """Store the current checkpoint in the oplog progress dictionary.
+        """Publish the current checkpoint in the oplog progress slots.
         """
         if checkpoint is not None and checkpoint != self.checkpoint:
             self.checkpoint = checkpoint
-            with self.oplog_progress as oplog_prog:
-                oplog_dict = oplog_prog.get_dict()
-                # If we have the repr of our oplog collection
-                # in the dictionary, remove it and replace it
-                # with our replica set name.
-                # This allows an easy upgrade path from mongo-connector 2.3.
-                # For an explanation of the format change, see the comment in
-                # read_last_checkpoint.
-                oplog_dict.pop(str(self.oplog), None)
-                oplog_dict[self.replset_name] = checkpoint
-                LOG.debug("OplogThread: oplog checkpoint updated to %s",
-                          checkpoint)
+            self.oplog_progress.publish(self.replset_name, checkpoint)
+            # If we have the repr of our oplog collection
+            # in the progress, remove it now that it has been replaced
+            # with our replica set name.
+            # This allows an easy upgrade path from mongo-connector 2.3.
+            # For an explanation of the format change, see the comment in
+            # read_last_checkpoint.
+            self.oplog_progress.publish(str(self.oplog), None)
+            LOG.debug("OplogThread: oplog checkpoint updated to %s",
+                      checkpoint)
+            if self.checkpoint_store is not None:
+                self.checkpoint_store.update(self.replset_name, checkpoint)
         else:
             LOG.debug("OplogThread: no checkpoint to update.")
 
     def read_last_checkpoint(self):
-        """Read the last checkpoint from the oplog progress dictionary.
+        """Read the last checkpoint from the oplog progress slots.
         """
         # In versions of mongo-connector 2.3 and before,
         # we used the repr of the
         # oplog collection as keys in the oplog_progress dictionary.
         # In versions thereafter, we use the replica set name. For backwards
         # compatibility, we check for both.
-        oplog_str = str(self.oplog)
-
-        ret_val = None
-        with self.oplog_progress as oplog_prog:
-            oplog_dict = oplog_prog.get_dict()
-            try:
-                # New format.
-                ret_val = oplog_dict[self.replset_name]
-            except KeyError:
-                try:
-                    # Old format.
-                    ret_val = oplog_dict[oplog_str]
-                except KeyError:
-                    pass
+        ret_val = self.oplog_progress.get(self.replset_name)
+        if ret_val is None:
+            ret_val = self.oplog_progress.get(str(self.oplog))
 
         LOG.debug("OplogThread: reading last checkpoint as %s " %
                   str(ret_val))
         self.checkpoint = ret_val
         return ret_val
 
+    def update_dump_progress(self, progress):
+        """Publish the DumpProgress of the collection dump in the dump
+        progress slots, or remove it if progress is None.
+        """
+        if self.dump_progress is None:
+            return
+        self.dump_progress.publish(self.replset_name, progress)
+
+    def read_dump_progress(self):
+        """Read the DumpProgress of an interrupted collection dump from the
+        dump progress slots.
+        """
+        if self.dump_progress is None:
+            return None
+        return self.dump_progress.get(self.replset_name)
+
     def rollback(self):
         """Rollback target system to consistent state.
 
@@ -874,97 +1874,135 @@ class OplogThread(threading.Thread):
 
         # rollback_cutoff_ts happened *before* the rollback
         rollback_cutoff_ts = last_oplog_entry['ts']
+        # The oplog is replayed from here once the rollback is done.
+        replay_ts = rollback_cutoff_ts
+        read_preference = self.read_preference
+        if read_preference is not None:
+            # Documents read again from a secondary may be older than the
+            # rollback cutoff, so replay the oplog from before them.
+            read_ts = self._secondary_read_timestamp(
+                retry_until_ok(self.get_last_oplog_timestamp))
+            if read_ts is None:
+                LOG.warning("OplogThread: The oplog does not go back "
+                            "maxStalenessSeconds before the rollback, "
+                            "reading documents from the primary.")
+                read_preference = None
+            elif read_ts < replay_ts:
+                replay_ts = read_ts
         start_ts = util.bson_ts_to_long(rollback_cutoff_ts)
         # timestamp of the most recent document on any target system
         end_ts = last_inserted_doc['_ts']
 
+        _ROLLBACKS.labels(self.replset_name).inc()
         for dm in self.doc_managers:
-            rollback_set = {}   # this is a dictionary of ns:list of docs
-
-            # group potentially conflicted documents by namespace
-            for doc in dm.search(start_ts, end_ts):
-                if doc['ns'] in rollback_set:
-                    rollback_set[doc['ns']].append(doc)
-                else:
-                    rollback_set[doc['ns']] = [doc]
-
-            # retrieve these documents from MongoDB, either updating
-            # or removing them in each target system
-            for namespace, doc_list in rollback_set.items():
-                # Get the original namespace
-                original_namespace = self.namespace_config.unmap_namespace(
-                    namespace)
-                if not original_namespace:
-                    original_namespace = namespace
-
-                database, coll = original_namespace.split('.', 1)
-                obj_id = bson.objectid.ObjectId
-                bson_obj_id_list = [obj_id(doc['_id']) for doc in doc_list]
-
-                # Use connection to whole cluster if in sharded environment.
-                client = self.mongos_client or self.primary_client
-                to_update = util.retry_until_ok(
-                    client[database][coll].find,
-                    {'_id': {'$in': bson_obj_id_list}},
+            # Read the keys of every potentially conflicted document before
+            # any of them is changed: the search may stream its results from
+            # the target system, which would skip or repeat documents if they
+            # were removed and upserted in the meantime. Only the keys are
+            # held in memory, and the documents are handled in chunks.
+            keys = [{'_id': doc['_id'], 'ns': doc['ns']}
+                    for doc in dm.search(start_ts, end_ts)]
+            removed = inserted = failed = 0
+            for start in range(0, len(keys), _ROLLBACK_BATCH_SIZE):
+                counts = self._rollback_chunk(
+                    dm, keys[start:start + _ROLLBACK_BATCH_SIZE],
+                    rollback_cutoff_ts, read_preference)
+                removed += counts[0]
+                inserted += counts[1]
+                failed += counts[2]
+            for action, count in (('removed', removed),
+                                  ('upserted', inserted),
+                                  ('failed', failed)):
+                _ROLLBACK_DOCUMENTS.labels(self.replset_name, action).inc(
+                    count)
+
+            LOG.debug("OplogThread: Rollback, removed %d docs, inserted %d "
+                      "documents and failed to insert %d documents. "
+                      "Returning a rollback cutoff time of %s "
+                      % (removed, inserted, failed, str(replay_ts)))
+
+        return replay_ts
+
+    def _rollback_chunk(self, dm, docs, rollback_cutoff_ts,
+                        read_preference):
+        """Bring a chunk of documents found by DocManager.search, given by
+        their _id and ns, back in line with MongoDB.
+
+        The documents that still exist in MongoDB are upserted into the
+        target system, the others are removed from it. Returns the number of
+        documents removed, upserted, and that failed to be upserted.
+        """
+        # group potentially conflicted documents by namespace
+        rollback_set = {}
+        for doc in docs:
+            rollback_set.setdefault(doc['ns'], []).append(doc)
+
+        cutoff_ts = util.bson_ts_to_long(rollback_cutoff_ts)
+        removed = inserted = failed = 0
+        # retrieve these documents from MongoDB, either updating
+        # or removing them in each target system
+        for namespace, doc_list in rollback_set.items():
+            # Get the original namespace
+            original_namespace = self.namespace_config.unmap_namespace(
+                namespace)
+            if not original_namespace:
+                original_namespace = namespace
+
+            database, coll = original_namespace.split('.', 1)
+            # Doc list are docs in target system, to_index are
+            # Docs in mongo
+            doc_hash = {}  # Hash by _id
+            for doc in doc_list:
+                doc_hash[bson.objectid.ObjectId(doc['_id'])] = doc
+
+            # Use connection to whole cluster if in sharded environment.
+            client = self.mongos_client or self.primary_client
+            collection = client[database][coll]
+            if read_preference is not None:
+                collection = collection.with_options(
+                    read_preference=read_preference)
+
+            def collect_existing_docs():
+                return list(collection.find(
+                    {'_id': {'$in': list(doc_hash)}},
                     projection=self.namespace_config.projection(
-                        original_namespace)
-                )
-                # Doc list are docs in target system, to_update are
-                # Docs in mongo
-                doc_hash = {}  # Hash by _id
-                for doc in doc_list:
-                    doc_hash[bson.objectid.ObjectId(doc['_id'])] = doc
-
-                to_index = []
-
-                def collect_existing_docs():
-                    for doc in to_update:
-                        if doc['_id'] in doc_hash:
-                            del doc_hash[doc['_id']]
-                            to_index.append(doc)
-                retry_until_ok(collect_existing_docs)
-
-                # Delete the inconsistent documents
-                LOG.debug("OplogThread: Rollback, removing inconsistent "
-                          "docs.")
-                remov_inc = 0
-                for document_id in doc_hash:
-                    try:
-                        dm.remove(document_id, namespace,
-                                  util.bson_ts_to_long(rollback_cutoff_ts))
-                        remov_inc += 1
-                        LOG.debug(
-                            "OplogThread: Rollback, removed %r " % doc)
-                    except errors.OperationFailed:
-                        LOG.warning(
-                            "Could not delete document during rollback: %r "
-                            "This can happen if this document was already "
-                            "removed by another rollback happening at the "
-                            "same time." % doc
-                        )
-
-                LOG.debug("OplogThread: Rollback, removed %d docs." %
-                          remov_inc)
-
-                # Insert the ones from mongo
-                LOG.debug("OplogThread: Rollback, inserting documents "
-                          "from mongo.")
-                insert_inc = 0
-                fail_insert_inc = 0
-                for doc in to_index:
-                    try:
-                        insert_inc += 1
-                        dm.upsert(doc,
-                                  namespace,
-                                  util.bson_ts_to_long(rollback_cutoff_ts))
-                    except errors.OperationFailed:
-                        fail_insert_inc += 1
-                        LOG.exception("OplogThread: Rollback, Unable to "
-                                      "insert %r" % doc)
-
-        LOG.debug("OplogThread: Rollback, Successfully inserted %d "
-                  " documents and failed to insert %d"
-                  " documents.  Returning a rollback cutoff time of %s "
-                  % (insert_inc, fail_insert_inc, str(rollback_cutoff_ts)))
-
-        return rollback_cutoff_ts
+                        original_namespace)))
+            to_index = retry_until_ok(collect_existing_docs)
+            for doc in to_index:
+                doc_hash.pop(doc['_id'], None)
+
+            # Delete the inconsistent documents
+            LOG.debug("OplogThread: Rollback, removing %d inconsistent "
+                      "docs." % len(doc_hash))
+            if doc_hash:
+                with _time_call(dm, 'apply_batch'):
+                    dm.apply_batch([
+                        {'op': 'd', 'ns': namespace,
+                         'o': {'_id': document_id},
+                         'ts': rollback_cutoff_ts}
+                        for document_id in doc_hash])
+                removed += len(doc_hash)
+
+            # Insert the ones from mongo
+            LOG.debug("OplogThread: Rollback, inserting %d documents "
+                      "from mongo." % len(to_index))
+            if to_index:
+                try:
+                    with _time_call(dm, 'bulk_upsert'):
+                        dm.bulk_upsert(iter(to_index), namespace, cutoff_ts)
+                    inserted += len(to_index)
+                except errors.OperationFailed:
+                    LOG.exception("OplogThread: Rollback, Unable to "
+                                  "insert %d documents into %s, "
+                                  "re-upserting them serially"
+                                  % (len(to_index), namespace))
+                    for doc in to_index:
+                        try:
+                            with _time_call(dm, 'upsert'):
+                                dm.upsert(doc, namespace, cutoff_ts)
+                            inserted += 1
+                        except errors.OperationFailed:
+                            failed += 1
+                            LOG.exception("OplogThread: Rollback, Unable to "
+                                          "insert %r" % doc)
+        return removed, inserted, failed
@@ -0,0 +1,87 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Shares the progress of the OplogThreads with the Connector.
+"""
+
+import threading
+
+
+class _Slot(object):
+    """Holds the latest value published for one name."""
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = None
+
+
+class ProgressSlots(object):
+    """Values published by the OplogThreads, such as their checkpoints, keyed
+    by replica set name.
+
+    Every name has its own slot. Once a slot exists, publishing to it is a
+    single attribute assignment, and the mapping of names to slots is never
+    modified in place, only replaced, so neither publishing nor taking a
+    snapshot waits on a lock. Only creating a slot takes a lock.
+    """
+
+    def __init__(self, values=None):
+        self._slots = {}
+        self._lock = threading.Lock()
+        if values:
+            self.load(values)
+
+    def _slot(self, name):
+        slot = self._slots.get(name)
+        if slot is None:
+            with self._lock:
+                slot = self._slots.get(name)
+                if slot is None:
+                    slot = _Slot()
+                    slots = dict(self._slots)
+                    slots[name] = slot
+                    self._slots = slots
+        return slot
+
+    def publish(self, name, value):
+        """Set the value of ``name``, or remove it if ``value`` is None."""
+        if value is None:
+            slot = self._slots.get(name)
+            if slot is not None:
+                slot.value = None
+            return
+        self._slot(name).value = value
+
+    def get(self, name):
+        """Return the value of ``name``, or None if there is none."""
+        slot = self._slots.get(name)
+        if slot is None:
+            return None
+        return slot.value
+
+    def snapshot(self):
+        """Return a dict of every value, by name."""
+        return dict((name, slot.value)
+                    for name, slot in self._slots.items()
+                    if slot.value is not None)
+
+    def load(self, values):
+        """Replace every value with those in the dict ``values``."""
+        with self._lock:
+            slots = {}
+            for name, value in values.items():
+                slots[name] = _Slot()
+                slots[name].value = value
+            self._slots = slots
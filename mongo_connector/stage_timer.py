@@ -0,0 +1,204 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Times the stages that an OplogThread goes through for each oplog entry,
+to find out whether the source or the targets hold replication back.
+
+Unless the oplog is read as raw BSON, PyMongo decodes each entry as it is
+read, so decoding is timed as part of the "fetch" stage rather than the
+"decode" stage.
+"""
+
+import logging
+import random
+import threading
+import time
+
+from mongo_connector import metrics
+
+LOG = logging.getLogger(__name__)
+
+# The most precise clock available.
+now = getattr(time, 'perf_counter', time.time)
+
+# The number of durations of each stage kept per interval to estimate the
+# percentiles.
+_SAMPLE_SIZE = 4096
+
+# The percentiles reported for each stage.
+PERCENTILES = (50, 90, 99)
+
+_STAGE_SECONDS = metrics.REGISTRY.gauge(
+    'mongo_connector_stage_seconds',
+    'Percentiles of the time taken by each stage of an OplogThread, over '
+    'the last stage timing interval.',
+    ('replica_set', 'stage', 'quantile'))
+_STAGE_SECONDS_TOTAL = metrics.REGISTRY.counter(
+    'mongo_connector_stage_seconds_total',
+    'Time spent in each stage of an OplogThread.',
+    ('replica_set', 'stage'))
+_STAGE_CALLS = metrics.REGISTRY.counter(
+    'mongo_connector_stage_calls_total',
+    'Times each stage of an OplogThread was timed.',
+    ('replica_set', 'stage'))
+
+
+class _NullTimer(object):
+    """Context manager that does nothing, used when timing is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _StageTimer(object):
+    __slots__ = ('_timer', '_stage', '_started')
+
+    def __init__(self, timer, stage):
+        self._timer = timer
+        self._stage = stage
+
+    def __enter__(self):
+        self._started = now()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._timer.record(self._stage, now() - self._started)
+
+
+class _Stage(object):
+    """The durations of a stage recorded during the current interval."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        # A uniform sample of the durations.
+        self.samples = []
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if len(self.samples) < _SAMPLE_SIZE:
+            self.samples.append(seconds)
+        else:
+            index = random.randrange(self.count)
+            if index < _SAMPLE_SIZE:
+                self.samples[index] = seconds
+
+    def summary(self):
+        samples = sorted(self.samples)
+        summary = {'count': self.count, 'total': self.total,
+                   'max': self.max}
+        for percentile in PERCENTILES:
+            rank = max(int(round(percentile / 100.0 * len(samples))), 1)
+            summary['p%d' % percentile] = samples[rank - 1]
+        return summary
+
+
+class StageTimer(object):
+    """Collects how long each stage takes and, every ``interval`` seconds,
+    logs a summary of the durations and publishes it to the metrics.
+
+    Stages are timed with ``record`` or the context manager returned by
+    ``time``. Durations are recorded from any thread.
+    """
+
+    def __init__(self, name, interval):
+        self.name = name
+        self.interval = interval
+        self._stages = {}
+        self._lock = threading.Lock()
+        self._interval_started = now()
+
+    def record(self, stage, seconds):
+        """Record that ``stage`` took ``seconds``."""
+        finished = None
+        with self._lock:
+            timings = self._stages.get(stage)
+            if timings is None:
+                timings = self._stages[stage] = _Stage()
+            timings.add(seconds)
+            if now() - self._interval_started >= self.interval:
+                finished = self._start_interval()
+        if finished is not None:
+            self._report(*finished)
+
+    def time(self, stage):
+        """Return a context manager that records how long its block takes.
+        """
+        return _StageTimer(self, stage)
+
+    def timed_iter(self, iterable, stage):
+        """Iterate over ``iterable``, recording how long each item takes to
+        be produced."""
+        iterator = iter(iterable)
+        while True:
+            started = now()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record(stage, now() - started)
+            yield item
+
+    def _start_interval(self):
+        stages = self._stages
+        elapsed = now() - self._interval_started
+        self._stages = {}
+        self._interval_started = now()
+        return stages, elapsed
+
+    def flush(self):
+        """Report the durations recorded so far and start a new interval.
+
+        Returns a dict of the summary of each stage.
+        """
+        with self._lock:
+            stages, elapsed = self._start_interval()
+        return self._report(stages, elapsed)
+
+    def _report(self, stages, elapsed):
+        if not stages:
+            return {}
+        summaries = dict((stage, timings.summary())
+                         for stage, timings in stages.items())
+        lines = []
+        for stage, summary in sorted(summaries.items()):
+            lines.append(
+                '%s: %d calls, %.3fs total (%.1f%%), p50 %.3fms, '
+                'p90 %.3fms, p99 %.3fms, max %.3fms' % (
+                    stage, summary['count'], summary['total'],
+                    100 * summary['total'] / elapsed if elapsed else 0,
+                    summary['p50'] * 1000, summary['p90'] * 1000,
+                    summary['p99'] * 1000, summary['max'] * 1000))
+            for percentile in PERCENTILES:
+                _STAGE_SECONDS.labels(
+                    self.name, stage, repr(percentile / 100.0)).set(
+                        summary['p%d' % percentile])
+            _STAGE_SECONDS.labels(self.name, stage, '1').set(
+                summary['max'])
+            _STAGE_SECONDS_TOTAL.labels(self.name, stage).inc(
+                summary['total'])
+            _STAGE_CALLS.labels(self.name, stage).inc(summary['count'])
+        LOG.info("Stage timings for replica set '%s' over the last %.1f "
+                 "seconds:\n  %s", self.name, elapsed, '\n  '.join(lines))
+        return summaries
@@ -16,12 +16,19 @@
 """
 
 import logging
+import os
 import sys
 import time
 
+from bson import BSON
 from bson.timestamp import Timestamp
+try:
+    from bson.raw_bson import RawBSONDocument
+except ImportError:
+    # PyMongo < 3.2
+    RawBSONDocument = None
 
-from pymongo import errors
+from pymongo import errors, read_preferences
 
 from mongo_connector.compat import reraise
 
@@ -66,6 +73,98 @@ def long_to_bson_ts(val):
     return Timestamp(seconds, increment)
 
 
+def document_key(namespace, document_id):
+    """Return a hashable key identifying a document in a namespace.
+    """
+    try:
+        hash(document_id)
+    except TypeError:
+        # Embedded documents and arrays can be used as _id too.
+        document_id = BSON.encode({'_id': document_id})
+    return namespace, document_id
+
+
+def decode_raw_bson(document, codec_options):
+    """Decode a RawBSONDocument, or return any other document as is.
+    """
+    if RawBSONDocument is not None and isinstance(document, RawBSONDocument):
+        return BSON(document.raw).decode(codec_options)
+    return document
+
+
+def decode_oplog_entry(entry, codec_options):
+    """Return a copy of an oplog entry with its documents decoded.
+    """
+    decoded = dict(entry)
+    for field in ('o', 'o2'):
+        if field in decoded:
+            decoded[field] = decode_raw_bson(decoded[field], codec_options)
+    return decoded
+
+
+# The names of the read preference modes, and of the classes implementing
+# them in PyMongo >= 3.0.
+READ_PREFERENCE_MODES = {
+    'primary': 'Primary',
+    'primaryPreferred': 'PrimaryPreferred',
+    'secondary': 'Secondary',
+    'secondaryPreferred': 'SecondaryPreferred',
+    'nearest': 'Nearest',
+}
+
+
+def read_preference(mode, max_staleness=-1):
+    """Return the PyMongo read preference for a mode, eg
+    'secondaryPreferred', and a maximum staleness in seconds.
+
+    Returns None for the primary mode, which is the default of MongoClient.
+    Raises ValueError if the installed PyMongo does not support the read
+    preference.
+    """
+    if mode == 'primary':
+        return None
+    read_pref_class = getattr(read_preferences,
+                              READ_PREFERENCE_MODES[mode], None)
+    if read_pref_class is None:
+        raise ValueError(
+            "Read preference %r requires PyMongo 3.0 or later." % mode)
+    if max_staleness == -1:
+        return read_pref_class()
+    try:
+        return read_pref_class(max_staleness=max_staleness)
+    except TypeError:
+        raise ValueError(
+            "maxStalenessSeconds requires PyMongo 3.4 or later.")
+
+
+def write_file_atomically(path, data):
+    """Replace the contents of a file, so that a crash leaves either the old
+    or the new contents.
+
+    The data is written and flushed to disk in a temporary file, which is
+    then renamed over the file.
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as temp_file:
+        temp_file.write(data)
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    if hasattr(os, 'replace'):
+        os.replace(temp_path, path)
+    else:
+        # Python 2: os.rename does not replace files on Windows.
+        if sys.platform == 'win32' and os.path.exists(path):
+            os.remove(path)
+        os.rename(temp_path, path)
+    # Flush the rename to disk too. Directories can't be opened on Windows.
+    if sys.platform != 'win32':
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
 def retry_until_ok(func, *args, **kwargs):
     """Retry code block until it succeeds.
 
@@ -0,0 +1,121 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests that the benchmarks still run against the current code.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path[0:0] = [""]
+
+from benchmarks import microbenchmarks, oplog_workload, results
+from benchmarks import throughput
+from tests import unittest
+
+
+class TestThroughput(unittest.TestCase):
+
+    def run_case(self, kind, filter_name='none'):
+        result = throughput.run_case({
+            'kind': kind, 'fields': 5, 'namespaces': 3,
+            'filter': filter_name, 'entries': 200, 'timeout': 60})
+        self.assertGreater(result['per_sec'], 0)
+        self.assertGreater(result['peak_rss_mb'], 0)
+        return result
+
+    def test_oplog(self):
+        self.run_case('oplog')
+        self.run_case('oplog', 'include')
+
+    def test_dump(self):
+        self.run_case('dump')
+
+
+class TestOplogWorkload(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'workload.bson')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def options(self, *args):
+        options, _ = oplog_workload.option_parser().parse_args(
+            ['--entries', '500', '--namespaces', '5',
+             '--report-interval', '60'] + list(args))
+        return options
+
+    def test_generate(self):
+        oplog_workload.generate(self.path, self.options())
+        entries = oplog_workload.load(self.path)
+        self.assertEqual(len(entries), 501)
+        self.assertEqual(entries[0]['op'], 'n')
+        timestamps = [entry['ts'] for entry in entries]
+        self.assertEqual(timestamps, sorted(set(timestamps)))
+        # Updates and deletes only target documents that exist.
+        live = set()
+        for entry in entries[1:]:
+            if entry['op'] == 'i':
+                live.add((entry['ns'], entry['o']['_id']))
+            elif entry['op'] == 'u':
+                self.assertIn((entry['ns'], entry['o2']['_id']), live)
+            elif entry['op'] == 'd':
+                live.remove((entry['ns'], entry['o']['_id']))
+            else:
+                self.assertEqual(entry['op'], 'c')
+                self.assertTrue(entry['ns'].endswith('.$cmd'))
+
+    def test_replay(self):
+        oplog_workload.generate(self.path, self.options())
+        oplog_workload.replay(self.path, self.options(
+            '--rate', '2000', '--option', 'batch_size=100'))
+        oplog_workload.replay(self.path, self.options(
+            '--raw-bson', '--exclude-fields', 'f1'))
+
+
+class TestMicrobenchmarks(unittest.TestCase):
+
+    def test_run_cases(self):
+        options, _ = microbenchmarks.option_parser().parse_args(
+            ['--rules', '1,5', '--shapes', 'small,deep', '--count', '10',
+             '--repeat', '1'])
+        cases = microbenchmarks.run_cases(options)
+        names = [case['case'] for case in cases]
+        self.assertEqual(len(names), len(set(names)))
+        for group in microbenchmarks.GROUPS:
+            self.assertTrue(any(name.startswith(group) for name in names))
+        for case in cases:
+            self.assertGreater(case['ns_per_call'], 0)
+
+    def test_history(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'history.json')
+            self.assertEqual(results.load_history(path), [])
+            results.append_history(path, [{'case': 'a', 'ns': 1}], 'first')
+            results.append_history(path, [{'case': 'a', 'ns': 2}])
+            history = results.load_history(path)
+            self.assertEqual([run['label'] for run in history],
+                             ['first', None])
+            self.assertEqual(history[1]['results'], [{'case': 'a', 'ns': 2}])
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests saving oplog checkpoints.
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from bson.timestamp import Timestamp
+
+sys.path[0:0] = [""]
+
+from mongo_connector import errors
+from mongo_connector.checkpoint_store import (FileCheckpointStore,
+                                              TargetCheckpointStore)
+from mongo_connector.doc_managers.doc_manager_base import DocManagerBase
+from mongo_connector.doc_managers.doc_manager_simulator import DocManager
+from mongo_connector.util import long_to_bson_ts
+from tests import unittest
+
+
+class TestFileCheckpointStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.path = os.path.join(self.temp_dir, 'oplog.timestamp')
+        self.store = FileCheckpointStore(self.path)
+
+    def test_read_missing_or_empty(self):
+        self.assertIsNone(self.store.read())
+        open(self.path, 'w').close()
+        self.assertIsNone(self.store.read())
+
+    def test_replica_set(self):
+        self.store.flush({'rs': Timestamp(12, 34)})
+        # A single replica set is written as a 1-dimensional array.
+        with open(self.path) as progress_file:
+            name, timestamp = json.load(progress_file)
+        self.assertEqual(name, 'rs')
+        self.assertEqual(long_to_bson_ts(timestamp), Timestamp(12, 34))
+        self.assertEqual(self.store.read(), {'rs': Timestamp(12, 34)})
+
+    def test_sharded_cluster(self):
+        checkpoints = {'shard1': Timestamp(12, 34),
+                       'shard2': Timestamp(56, 78)}
+        self.store.flush(checkpoints)
+        self.assertEqual(self.store.read(), checkpoints)
+
+    def test_unchanged_checkpoints_are_not_rewritten(self):
+        self.store.flush({'rs': Timestamp(12, 34)})
+        os.remove(self.path)
+        self.store.flush({'rs': Timestamp(12, 34)})
+        self.assertFalse(os.path.exists(self.path))
+        self.store.flush({'rs': Timestamp(56, 78)})
+        self.assertEqual(self.store.read(), {'rs': Timestamp(56, 78)})
+
+
+class TestTargetCheckpointStore(unittest.TestCase):
+
+    def setUp(self):
+        self.doc_managers = (DocManager(), DocManager())
+        self.store = TargetCheckpointStore(self.doc_managers)
+
+    def test_update(self):
+        self.assertIsNone(self.store.read())
+        self.store.update('rs', Timestamp(12, 34))
+        for dm in self.doc_managers:
+            self.assertEqual(dm.read_checkpoints(),
+                             {'rs': Timestamp(12, 34)})
+        self.assertEqual(self.store.read(), {'rs': Timestamp(12, 34)})
+
+        # Flushing leaves the saved checkpoints alone.
+        self.store.flush({'rs': Timestamp(56, 78)})
+        self.assertEqual(self.store.read(), {'rs': Timestamp(12, 34)})
+
+    def test_read_oldest_checkpoints(self):
+        first, second = self.doc_managers
+        first.write_checkpoint('shard1', Timestamp(56, 78))
+        first.write_checkpoint('shard2', Timestamp(12, 34))
+        first.write_checkpoint('shard3', Timestamp(12, 34))
+        second.write_checkpoint('shard1', Timestamp(12, 34))
+        second.write_checkpoint('shard2', Timestamp(56, 78))
+        # Only shards with a checkpoint in every target are resumed.
+        self.assertEqual(self.store.read(), {'shard1': Timestamp(12, 34),
+                                             'shard2': Timestamp(12, 34)})
+
+    def test_unsupported_doc_manager(self):
+        store = TargetCheckpointStore((DocManagerBase(),))
+        self.assertRaises(errors.InvalidConfiguration, store.read)
+
+
+if __name__ == '__main__':
+    unittest.main()
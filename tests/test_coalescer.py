@@ -0,0 +1,116 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests coalescing of oplog entries.
+"""
+
+import sys
+
+from bson.timestamp import Timestamp
+
+sys.path[0:0] = [""]
+
+from mongo_connector.coalescer import coalesce_entries
+from tests import unittest
+
+
+def insert(_id, doc, ts, ns='test.test'):
+    return {'op': 'i', 'ns': ns, 'ts': Timestamp(ts, 0),
+            'o': dict(doc, _id=_id)}
+
+
+def update(_id, spec, ts, ns='test.test'):
+    return {'op': 'u', 'ns': ns, 'ts': Timestamp(ts, 0),
+            'o2': {'_id': _id}, 'o': spec}
+
+
+def delete(_id, ts, ns='test.test'):
+    return {'op': 'd', 'ns': ns, 'ts': Timestamp(ts, 0), 'o': {'_id': _id}}
+
+
+def command(spec, ts, ns='test.$cmd'):
+    return {'op': 'c', 'ns': ns, 'ts': Timestamp(ts, 0), 'o': spec}
+
+
+class TestCoalescer(unittest.TestCase):
+
+    def test_insert_update(self):
+        entries = [insert(1, {'a': 1}, 1),
+                   update(1, {'$set': {'a': 2, 'b.c': 3}}, 2),
+                   update(1, {'$unset': {'a': True}}, 3)]
+        self.assertEqual(coalesce_entries(entries),
+                         [insert(1, {'b': {'c': 3}}, 3)])
+        # The original entries are not modified.
+        self.assertEqual(entries[0], insert(1, {'a': 1}, 1))
+
+    def test_insert_replace(self):
+        entries = [insert(1, {'a': 1}, 1), update(1, {'b': 2}, 2)]
+        self.assertEqual(coalesce_entries(entries),
+                         [insert(1, {'b': 2}, 2)])
+
+    def test_replace_update(self):
+        entries = [update(1, {'_id': 1, 'a': 1}, 1),
+                   update(1, {'$set': {'b': 2}}, 2)]
+        self.assertEqual(coalesce_entries(entries),
+                         [update(1, {'_id': 1, 'a': 1, 'b': 2}, 2)])
+
+    def test_merge_updates(self):
+        entries = [update(1, {'$set': {'a': 1, 'b': 1}}, 1),
+                   update(1, {'$set': {'a': 2}, '$unset': {'b': True}}, 2),
+                   update(1, {'$set': {'c.d': 3}}, 3)]
+        self.assertEqual(coalesce_entries(entries), [
+            update(1, {'$set': {'a': 2, 'c.d': 3},
+                       '$unset': {'b': True}}, 3)])
+
+    def test_conflicting_updates(self):
+        entries = [update(1, {'$set': {'a.b': 1}}, 1),
+                   update(1, {'$set': {'a': {}}}, 2)]
+        self.assertEqual(coalesce_entries(entries), entries)
+
+        entries = [update(1, {'$inc': {'a': 1}}, 1),
+                   update(1, {'$set': {'b': 1}}, 2)]
+        self.assertEqual(coalesce_entries(entries), entries)
+
+    def test_delete(self):
+        entries = [insert(1, {}, 1), update(1, {'$set': {'a': 1}}, 2),
+                   delete(1, 3)]
+        self.assertEqual(coalesce_entries(entries), [delete(1, 3)])
+
+        # An update can not be merged into a delete.
+        entries = [delete(1, 1), update(1, {'$set': {'a': 1}}, 2)]
+        self.assertEqual(coalesce_entries(entries), entries)
+
+    def test_position_and_namespaces(self):
+        entries = [insert(1, {}, 1), insert(2, {}, 2),
+                   insert(1, {}, 3, ns='test.other'),
+                   update(1, {'$set': {'a': 1}}, 4),
+                   insert(3, {}, 5)]
+        self.assertEqual(coalesce_entries(entries), [
+            insert(2, {}, 2), insert(1, {}, 3, ns='test.other'),
+            insert(1, {'a': 1}, 4), insert(3, {}, 5)])
+
+    def test_embedded_document_id(self):
+        entries = [insert({'a': 1}, {}, 1),
+                   update({'a': 1}, {'$set': {'b': 1}}, 2)]
+        self.assertEqual(coalesce_entries(entries),
+                         [insert({'a': 1}, {'b': 1}, 2)])
+
+    def test_commands_are_barriers(self):
+        entries = [insert(1, {}, 1), command({'drop': 'test'}, 2),
+                   update(1, {'$set': {'a': 1}}, 3)]
+        self.assertEqual(coalesce_entries(entries), entries)
+
+
+if __name__ == '__main__':
+    unittest.main()
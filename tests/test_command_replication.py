@@ -24,7 +24,7 @@ import pymongo
 from mongo_connector.namespace_config import NamespaceConfig
 from mongo_connector.command_helper import CommandHelper
 from mongo_connector.doc_managers.doc_manager_base import DocManagerBase
-from mongo_connector.locking_dict import LockingDict
+from mongo_connector.progress_slots import ProgressSlots
 from mongo_connector.oplog_manager import OplogThread
 from mongo_connector.test_utils import (assert_soon,
                                         close_client,
@@ -78,7 +78,7 @@ class TestCommandReplication(unittest.TestCase):
     def setUp(self):
         self.repl_set = ReplicaSetSingle().start()
         self.primary_conn = self.repl_set.client()
-        self.oplog_progress = LockingDict()
+        self.oplog_progress = ProgressSlots()
         self.opman = None
 
     def tearDown(self):
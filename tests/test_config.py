@@ -151,9 +151,21 @@ class TestConfig(unittest.TestCase):
         test_option('-m', 'mainAddress', 'testMainAddress')
         test_option('-o', 'oplogFile', 'testOplogFileShort')
         test_option('--batch-size', 'batchSize', 69)
+        test_option('--oplog-progress-interval', 'oplogProgressInterval', 5)
+        test_option('--checkpoint-store', 'checkpointStore', 'target')
+        test_option('--metrics-port', 'metricsPort', 9108)
+        test_option('--stage-timing-interval', 'stageTimingInterval', 10)
+        test_option('--apply-batch-size', 'applyBatchSize', 42)
+        test_option('--apply-threads', 'applyThreads', 8)
+        test_option('--dump-threads', 'dumpThreads', 4)
+        test_option('--dump-queue-size', 'dumpQueueSize', 5000)
+        test_option('--coalesce-window', 'coalesceWindow', 100)
+        test_option('--coalesce-window-ms', 'coalesceWindowMs', 250)
+        test_option('--namespace-cache-size', 'namespaceCacheSize', 500)
         test_option('--continue-on-error', 'continueOnError', True,
                     append_cli=False)
         test_option('-v', 'verbosity', 3, append_cli=False)
+        test_option('--raw-bson', 'rawBson', True, append_cli=False)
 
         self.load_options({'-w': 'logFile'})
         self.assertEqual(self.conf['logging.type'], 'file')
@@ -379,6 +391,42 @@ class TestConfig(unittest.TestCase):
         self.assertRaises(errors.InvalidConfiguration,
                           self.load_json, test_config)
 
+        # apply batch size must be positive
+        self.assertRaises(errors.InvalidConfiguration,
+                          self.load_options, {'--apply-batch-size': 0})
+
+        # there must be at least one apply thread
+        self.assertRaises(errors.InvalidConfiguration,
+                          self.load_json, {'applyThreads': 0})
+
+        # there must be at least one dump thread
+        self.assertRaises(errors.InvalidConfiguration,
+                          self.load_options, {'--dump-threads': 0})
+
+        # coalescing windows can't be negative
+        self.assertRaises(errors.InvalidConfiguration,
+                          self.load_options, {'--coalesce-window': -1})
+        self.assertRaises(errors.InvalidConfiguration,
+                          self.load_json, {'coalesceWindowMs': -1})
+
+        # the namespace cache size can't be negative
+        self.assertRaises(errors.InvalidConfiguration,
+                          self.load_options, {'--namespace-cache-size': -1})
+
+        # the progress interval can't be negative
+        self.assertRaises(errors.InvalidConfiguration,
+                          self.load_json, {'oplogProgressInterval': -1})
+
+        # checkpoints can only be stored in a file or the target systems
+        self.assertRaises(errors.InvalidConfiguration,
+                          self.load_json, {'checkpointStore': 'disk'})
+
+        # the metrics port must be a valid port
+        self.assertRaises(errors.InvalidConfiguration,
+                          self.load_json, {'metricsPort': 70000})
+        self.assertRaises(errors.InvalidConfiguration,
+                          self.load_json, {'stageTimingInterval': -1})
+
     def test_ssl_validation(self):
         """Test setting sslCertificatePolicy."""
         # Setting sslCertificatePolicy to not 'ignored' without a CA file
@@ -397,6 +445,29 @@ class TestConfig(unittest.TestCase):
                 'sslCACerts': 'ca.pem', 'sslCertificatePolicy': 'invalid'}})
 
 
+    def test_read_preference(self):
+        """Test setting the read preference of the collection dump."""
+        self.load_options({'--read-preference': 'secondaryPreferred',
+                           '--max-staleness-seconds': 120})
+        self.assertEqual(self.conf['readPreference'], {
+            'mode': 'secondaryPreferred', 'maxStalenessSeconds': 120})
+        self.load_json({'readPreference': {'mode': 'nearest',
+                                           'maxStalenessSeconds': 90}})
+        self.assertEqual(self.conf['readPreference.mode'], 'nearest')
+
+        # invalid mode
+        self.assertRaises(errors.InvalidConfiguration, self.load_options,
+                          {'--read-preference': 'secondaries'})
+        # secondaries can only be read from with a maximum staleness
+        self.assertRaises(errors.InvalidConfiguration, self.load_options,
+                          {'--read-preference': 'secondary'})
+        self.assertRaises(errors.InvalidConfiguration, self.load_options,
+                          {'--read-preference': 'secondary',
+                           '--max-staleness-seconds': 89})
+        self.assertRaises(errors.InvalidConfiguration, self.load_json,
+                          {'readPreference': {'maxStalenessSeconds': 120}})
+
+
 class TestConnectorConfig(unittest.TestCase):
     """Test creating a Connector from a Config."""
 
@@ -16,6 +16,9 @@ import sys
 
 sys.path[0:0] = [""]
 
+from bson.timestamp import Timestamp
+
+from mongo_connector import errors
 from mongo_connector.connector import (get_mininum_mongodb_version,
                                        update_mininum_mongodb_version)
 from mongo_connector.doc_managers.doc_manager_base import (DocManagerBase,
@@ -206,6 +209,30 @@ UPDATE_FAILURE_TEST_CASES = [
 ]
 
 
+class RecordingDocManager(DocManagerBase):
+    """DocManager that records the operations it is asked to perform."""
+
+    def __init__(self):
+        self.calls = []
+
+    def update(self, document_id, update_spec, namespace, timestamp):
+        self.calls.append(('update', document_id, update_spec, namespace,
+                           timestamp))
+
+    def upsert(self, document, namespace, timestamp):
+        if document.get('fail') == 'connection':
+            raise errors.ConnectionFailed('upsert failed')
+        if document.get('fail'):
+            raise errors.OperationFailed('upsert failed')
+        self.calls.append(('upsert', document, namespace, timestamp))
+
+    def remove(self, document_id, namespace, timestamp):
+        self.calls.append(('remove', document_id, namespace, timestamp))
+
+    def handle_command(self, command_doc, namespace, timestamp):
+        self.calls.append(('command', command_doc, namespace, timestamp))
+
+
 class TestDocManagerBase(unittest.TestCase):
     """Unit tests for DocManagerBase"""
 
@@ -291,6 +318,44 @@ class TestDocManagerBase(unittest.TestCase):
         with self.assertRaises(NotImplementedError):
             self.base.stop()
 
+    def test_apply_batch(self):
+        with self.assertRaises(NotImplementedError):
+            self.base.apply_batch([{'op': 'i', 'ns': 'test.test',
+                                    'ts': Timestamp(1, 0), 'o': {'_id': 1}}])
+
+    def test_apply_batch_dispatch(self):
+        docman = RecordingDocManager()
+        ts = Timestamp(1, 0)
+        long_ts = 1 << 32
+        docman.apply_batch([
+            {'op': 'i', 'ns': 'test.a', 'ts': ts, 'o': {'_id': 1}},
+            {'op': 'i', 'ns': 'test.a', 'ts': ts, 'o': {'_id': 2, 'fail': 1}},
+            {'op': 'u', 'ns': 'test.a', 'ts': ts, 'o2': {'_id': 1},
+             'o': {'$set': {'a': 1}}},
+            {'op': 'c', 'ns': 'test.$cmd', 'ts': ts, 'o': {'drop': 'a'}},
+            {'op': 'd', 'ns': 'test.a', 'ts': ts, 'o': {'_id': 1}},
+            {'op': 'n', 'ns': '', 'ts': ts, 'o': {'msg': 'noop'}},
+        ])
+        # A failed operation does not prevent the rest of the batch from
+        # being applied.
+        self.assertEqual(docman.calls, [
+            ('upsert', {'_id': 1}, 'test.a', long_ts),
+            ('update', 1, {'$set': {'a': 1}}, 'test.a', long_ts),
+            ('command', {'drop': 'a'}, 'test.$cmd', long_ts),
+            ('remove', 1, 'test.a', long_ts),
+        ])
+
+    def test_apply_batch_connection_failed(self):
+        docman = RecordingDocManager()
+        ts = Timestamp(1, 0)
+        with self.assertRaises(errors.ConnectionFailed):
+            docman.apply_batch([
+                {'op': 'i', 'ns': 'test.a', 'ts': ts,
+                 'o': {'_id': 1, 'fail': 'connection'}},
+                {'op': 'i', 'ns': 'test.a', 'ts': ts, 'o': {'_id': 2}},
+            ])
+        self.assertEqual(docman.calls, [])
+
 
 if __name__ == "__main__":
     unittest.main()
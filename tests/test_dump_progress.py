@@ -0,0 +1,89 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests recording the progress of a collection dump.
+"""
+
+import sys
+
+from bson import json_util
+from bson.objectid import ObjectId
+from bson.timestamp import Timestamp
+
+sys.path[0:0] = [""]
+
+from mongo_connector.dump_progress import DumpProgress
+from tests import unittest
+
+
+class TestDumpProgress(unittest.TestCase):
+
+    def setUp(self):
+        self.oid = ObjectId()
+        self.progress = DumpProgress(
+            Timestamp(12, 34), ['db.b', 'db.a'], ['db.fs'],
+            [('db.a', (None, self.oid)), ('db.a', (self.oid, None)),
+             ('db.b', (None, None))], 2)
+
+    def test_update(self):
+        progress = self.progress
+        self.assertIsNone(progress.last_id(0, 0))
+        self.assertFalse(progress.is_finished(0, 0))
+        progress.update(0, 0, 'x')
+        progress.update(1, 'db.fs', 5)
+        self.assertEqual(progress.last_id(0, 0), 'x')
+        self.assertIsNone(progress.last_id(1, 0))
+        self.assertEqual(progress.last_id(1, 'db.fs'), 5)
+        progress.finish(0, 0)
+        self.assertTrue(progress.is_finished(0, 0))
+        self.assertFalse(progress.is_finished(1, 0))
+        self.assertIsNone(progress.last_id(0, 0))
+
+    def test_remaining_tasks(self):
+        progress = self.progress
+        self.assertEqual(progress.remaining_tasks(), 4)
+        progress.finish(0, 0)
+        self.assertEqual(progress.remaining_tasks(), 4)
+        progress.finish(1, 0)
+        progress.finish(0, 'db.fs')
+        progress.finish(1, 'db.fs')
+        self.assertEqual(progress.remaining_tasks(), 2)
+
+    def test_extended_json(self):
+        progress = self.progress
+        progress.update(0, 1, ObjectId())
+        progress.update(1, 'db.fs', self.oid)
+        progress.finish(0, 0)
+        progress.finish(1, 'db.fs')
+        progress.finish(1, 2)
+        doc = json_util.loads(json_util.dumps(progress.to_dict()))
+        copy = DumpProgress.from_dict(doc)
+        self.assertEqual(copy.to_dict(), progress.to_dict())
+        self.assertEqual(copy.timestamp, Timestamp(12, 34))
+        self.assertEqual(copy.tasks[0], ('db.a', (None, self.oid)))
+        self.assertEqual(copy.last_id(0, 1), progress.last_id(0, 1))
+        self.assertTrue(copy.is_finished(1, 'db.fs'))
+
+    def test_can_resume(self):
+        progress = self.progress
+        self.assertTrue(progress.can_resume(['db.a', 'db.b'], ['db.fs'], 2))
+        # Dropped collections are ignored.
+        self.assertTrue(progress.can_resume(['db.a'], [], 2))
+        self.assertFalse(progress.can_resume(['db.a', 'db.c'], ['db.fs'], 2))
+        self.assertFalse(progress.can_resume(['db.a'], ['db.gfs'], 2))
+        self.assertFalse(progress.can_resume(['db.a', 'db.b'], ['db.fs'], 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
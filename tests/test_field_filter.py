@@ -0,0 +1,94 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests filtering oplog entries with a FieldFilter.
+"""
+
+import sys
+
+sys.path[0:0] = [""]
+
+from mongo_connector.field_filter import FieldFilter
+from mongo_connector.namespace_config import Namespace
+from tests import unittest
+
+
+class TestFieldFilter(unittest.TestCase):
+
+    def test_empty(self):
+        field_filter = FieldFilter()
+        self.assertFalse(field_filter)
+        entry = {'op': 'i', 'o': {'_id': 1, 'a': 1}}
+        self.assertIs(field_filter.filter_oplog_entry(entry), entry)
+        self.assertEqual(entry['o'], {'_id': 1, 'a': 1})
+
+    def test_include_document(self):
+        field_filter = FieldFilter(include_fields=['_id', 'a.b', 'a.c.d',
+                                                   'a.c', 'x.y'])
+        self.assertTrue(field_filter)
+        doc = {'_id': 1, 'a': {'b': 1, 'c': {'d': 2, 'e': 3}, 'f': 4},
+               'g': 5, 'x': 6}
+        self.assertEqual(field_filter.filter_document(doc),
+                         {'_id': 1, 'a': {'b': 1, 'c': {'d': 2, 'e': 3}}})
+        # Included fields are copied.
+        self.assertEqual(doc['g'], 5)
+
+    def test_exclude_document(self):
+        field_filter = FieldFilter(exclude_fields=['a.b', 'a.c.d', 'x.y'])
+        doc = {'_id': 1, 'a': {'b': 1, 'c': {'d': 2, 'e': 3}}, 'x': [1]}
+        self.assertEqual(field_filter.filter_document(doc),
+                         {'_id': 1, 'a': {'c': {'e': 3}}, 'x': [1]})
+
+    def test_include_update(self):
+        field_filter = FieldFilter(include_fields=['a.b', 'c', 'g.h.i'])
+        update_fields = {'a': {'b': 1, 'x': 2}, 'a.b.c': 3, 'a.x': 4,
+                         'c.d': 5, 'g.h': {'i': 6, 'j': 7}, 'g.x': 8}
+        self.assertEqual(field_filter.filter_update(update_fields),
+                         {'a': {'b': 1}, 'a.b.c': 3, 'c.d': 5,
+                          'g.h': {'i': 6}})
+
+    def test_exclude_update(self):
+        field_filter = FieldFilter(exclude_fields=['a.b', 'c', 'g.h.i'])
+        update_fields = {'a': {'b': 1, 'x': 2}, 'a.b.c': 3, 'a.x': 4,
+                         'c.d': 5, 'g.h': {'i': 6, 'j': 7}, 'g.x': 8}
+        self.assertEqual(field_filter.filter_update(update_fields),
+                         {'a': {'x': 2}, 'a.x': 4, 'g.h': {'j': 7},
+                          'g.x': 8})
+
+    def test_filter_oplog_entry(self):
+        field_filter = FieldFilter(exclude_fields=['a', 'b'])
+        entry = {'op': 'u', 'o': {'$set': {'a.b': 1, 'c': 2},
+                                  '$unset': {'b': True}}}
+        self.assertEqual(field_filter.filter_oplog_entry(entry),
+                         {'op': 'u', 'o': {'$set': {'c': 2}}})
+        # Nothing is left to update.
+        entry = {'op': 'u', 'o': {'$set': {'a': 1}, '$unset': {'b': True}}}
+        self.assertIsNone(field_filter.filter_oplog_entry(entry))
+        # Replacement documents are filtered like inserts.
+        entry = {'op': 'u', 'o': {'_id': 1, 'a': 1, 'c': 2}}
+        self.assertEqual(field_filter.filter_oplog_entry(entry),
+                         {'op': 'u', 'o': {'_id': 1, 'c': 2}})
+
+    def test_namespace_field_filter(self):
+        namespace = Namespace(include_fields=['a', '_id'])
+        entry = {'op': 'i', 'o': {'_id': 1, 'a': 1, 'b': 2}}
+        self.assertEqual(namespace.field_filter.filter_oplog_entry(entry),
+                         {'op': 'i', 'o': {'_id': 1, 'a': 1}})
+        self.assertFalse(Namespace().field_filter)
+        self.assertTrue(namespace.with_options(
+            include_fields=None, exclude_fields=['b']).field_filter)
+
+
+if __name__ == '__main__':
+    unittest.main()
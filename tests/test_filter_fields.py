@@ -20,7 +20,7 @@ sys.path[0:0] = [""]
 
 from mongo_connector import errors
 from mongo_connector.doc_managers.doc_manager_simulator import DocManager
-from mongo_connector.locking_dict import LockingDict
+from mongo_connector.progress_slots import ProgressSlots
 from mongo_connector.oplog_manager import OplogThread
 from mongo_connector.namespace_config import NamespaceConfig
 from mongo_connector.test_utils import (assert_soon,
@@ -48,7 +48,7 @@ class TestFilterFields(unittest.TestCase):
         self.opman = OplogThread(
             primary_client=self.primary_conn,
             doc_managers=(DocManager(),),
-            oplog_progress_dict=LockingDict(),
+            oplog_progress_dict=ProgressSlots(),
             namespace_config=self.namespace_config
         )
 
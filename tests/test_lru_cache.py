@@ -0,0 +1,84 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests the LRUCache class.
+"""
+
+import sys
+
+sys.path[0:0] = [""]
+
+from mongo_connector.lru_cache import LRUCache
+from tests import unittest
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_get(self):
+        cache = LRUCache(2)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('a', 0), 0)
+        cache['a'] = 1
+        cache['b'] = None
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b', 0))
+        self.assertEqual(cache.info(), (2, 2, 2, 2))
+
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        # Using 'a' makes 'b' the least recently used item.
+        cache.get('a')
+        cache['c'] = 3
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        # Updating 'a' makes 'c' the least recently used item.
+        cache['a'] = 4
+        cache['d'] = 5
+        self.assertEqual(cache.get('a'), 4)
+        self.assertNotIn('c', cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_pop_and_clear(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertIsNone(cache.pop('a'))
+        cache['c'] = 3
+        cache['d'] = 4
+        self.assertNotIn('b', cache)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        cache['e'] = 5
+        self.assertEqual(cache.get('e'), 5)
+
+    def test_get_without_lock(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        with cache._lock:
+            self.assertEqual(cache.get('a'), 1)
+            self.assertIsNone(cache.get('b'))
+
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache['a'] = 1
+        self.assertNotIn('a', cache)
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
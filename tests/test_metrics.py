@@ -0,0 +1,130 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests the metrics registry and the HTTP endpoint that serves it.
+"""
+
+import sys
+import threading
+
+sys.path[0:0] = [""]
+
+from mongo_connector.compat import HTTPError, urlopen
+from mongo_connector.metrics import MetricsRegistry, MetricsServer
+from tests import unittest
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter(self):
+        counter = self.registry.counter(
+            'entries_total', 'Oplog entries.', ('replica_set', 'op'))
+        counter.labels('rs0', 'insert').inc()
+        counter.labels('rs0', 'insert').inc(2)
+        counter.labels('rs1', 'delete').inc()
+        self.assertEqual(self.registry.render(),
+                         '# HELP entries_total Oplog entries.\n'
+                         '# TYPE entries_total counter\n'
+                         'entries_total{replica_set="rs0",op="insert"} 3\n'
+                         'entries_total{replica_set="rs1",op="delete"} 1\n')
+        self.assertRaises(ValueError, counter.labels, 'rs0')
+
+    def test_register_twice(self):
+        counter = self.registry.counter('entries_total', 'Oplog entries.')
+        self.assertIs(self.registry.counter('entries_total', 'Oplog entries.'),
+                      counter)
+        self.assertRaises(ValueError, self.registry.gauge,
+                          'entries_total', 'Oplog entries.')
+
+    def test_gauge(self):
+        gauge = self.registry.gauge('queue_depth', 'Queued items.',
+                                    ('queue',))
+        gauge.labels('oplog').set(4)
+        gauge.labels('apply').set_function(lambda: 7)
+        self.assertIn('queue_depth{queue="oplog"} 4\n',
+                      self.registry.render())
+        self.assertIn('queue_depth{queue="apply"} 7\n',
+                      self.registry.render())
+        # Setting a value replaces the function.
+        gauge.labels('apply').set(0)
+        self.assertIn('queue_depth{queue="apply"} 0\n',
+                      self.registry.render())
+
+    def test_histogram(self):
+        histogram = self.registry.histogram(
+            'call_seconds', 'Call durations.', ('method',),
+            buckets=(0.5, 1))
+        child = histogram.labels('upsert')
+        for value in (0.25, 0.5, 2):
+            child.observe(value)
+        self.assertEqual(self.registry.render().splitlines()[2:], [
+            'call_seconds_bucket{method="upsert",le="0.5"} 2',
+            'call_seconds_bucket{method="upsert",le="1"} 2',
+            'call_seconds_bucket{method="upsert",le="+Inf"} 3',
+            'call_seconds_count{method="upsert"} 3',
+            'call_seconds_sum{method="upsert"} 2.75'])
+
+        # Timing a block observes how long it took.
+        with histogram.labels('remove').time():
+            pass
+        cumulative, count, total = histogram.labels('remove').value()
+        self.assertEqual(cumulative, [1, 1])
+        self.assertEqual(count, 1)
+
+    def test_label_escaping(self):
+        counter = self.registry.counter('entries_total', 'Entries.', ('ns',))
+        counter.labels('db."coll"\\').inc()
+        self.assertIn(r'entries_total{ns="db.\"coll\"\\"} 1',
+                      self.registry.render())
+
+    def test_concurrent_increments(self):
+        counter = self.registry.counter('entries_total', 'Entries.')
+
+        def increment():
+            for _ in range(10000):
+                counter.labels().inc()
+
+        threads = [threading.Thread(target=increment) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.labels().value(), 40000)
+
+
+class TestMetricsServer(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.registry.counter('entries_total', 'Entries.').labels().inc()
+        self.server = MetricsServer(0, registry=self.registry)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.url = 'http://127.0.0.1:%d' % self.server.port
+
+    def test_metrics(self):
+        response = urlopen(self.url + '/metrics')
+        self.assertTrue(
+            response.info()['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'entries_total 1\n', response.read())
+
+    def test_not_found(self):
+        self.assertRaises(HTTPError, urlopen, self.url + '/other')
+
+
+if __name__ == '__main__':
+    unittest.main()
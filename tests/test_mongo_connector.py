@@ -24,7 +24,9 @@ from bson.timestamp import Timestamp
 
 sys.path[0:0] = [""]
 
+from mongo_connector.checkpoint_store import FileCheckpointStore
 from mongo_connector.connector import Connector, get_mininum_mongodb_version
+from mongo_connector.dump_progress import DumpProgress
 from mongo_connector.test_utils import (ReplicaSetSingle, connector_opts,
                                         assert_soon, db_user, db_password)
 from mongo_connector.util import long_to_bson_ts
@@ -101,7 +103,7 @@ class TestMongoConnector(unittest.TestCase):
         # test that None is returned if there is no config file specified.
         self.assertEqual(conn.write_oplog_progress(), None)
 
-        conn.oplog_progress.get_dict()[1] = Timestamp(12, 34)
+        conn.oplog_progress.publish(1, Timestamp(12, 34))
         # pretend to insert a thread/timestamp pair
         conn.write_oplog_progress()
 
@@ -113,7 +115,7 @@ class TestMongoConnector(unittest.TestCase):
         self.assertFalse(os.path.exists("temp_oplog.timestamp" + '~'))
 
         # ensure that updates work properly
-        conn.oplog_progress.get_dict()[1] = Timestamp(44, 22)
+        conn.oplog_progress.publish(1, Timestamp(44, 22))
         conn.write_oplog_progress()
 
         config_file = open("temp_oplog.timestamp", 'r')
@@ -122,6 +124,42 @@ class TestMongoConnector(unittest.TestCase):
         self.assertEqual(long_to_bson_ts(int(data[1])), Timestamp(44, 22))
 
         config_file.close()
+
+        # the file isn't rewritten when no checkpoint has changed
+        os.unlink("temp_oplog.timestamp")
+        conn.write_oplog_progress()
+        self.assertFalse(os.path.exists("temp_oplog.timestamp"))
+
+        conn.oplog_progress.publish(1, Timestamp(55, 11))
+        conn.write_oplog_progress()
+        self.assertTrue(os.path.exists("temp_oplog.timestamp"))
+        os.unlink("temp_oplog.timestamp")
+
+    def test_write_progress_interval(self):
+        """Test write_progress waits oplog_progress_interval seconds between
+        writes.
+        """
+        conn = Connector(
+            mongo_address=self.repl_set.uri,
+            oplog_checkpoint="temp_oplog.timestamp",
+            oplog_progress_interval=60,
+            **connector_opts
+        )
+        conn.oplog_progress.publish(1, Timestamp(12, 34))
+        conn.write_progress()
+        data = json.load(open("temp_oplog.timestamp", 'r'))
+        self.assertEqual(long_to_bson_ts(int(data[1])), Timestamp(12, 34))
+
+        # too soon after the last write
+        conn.oplog_progress.publish(1, Timestamp(44, 22))
+        conn.write_progress()
+        data = json.load(open("temp_oplog.timestamp", 'r'))
+        self.assertEqual(long_to_bson_ts(int(data[1])), Timestamp(12, 34))
+
+        conn._last_progress_write -= 60
+        conn.write_progress()
+        data = json.load(open("temp_oplog.timestamp", 'r'))
+        self.assertEqual(long_to_bson_ts(int(data[1])), Timestamp(44, 22))
         os.unlink("temp_oplog.timestamp")
 
     def test_read_oplog_progress(self):
@@ -143,34 +181,60 @@ class TestMongoConnector(unittest.TestCase):
             pass
         open("temp_oplog.timestamp", "w").close()
 
-        conn.oplog_checkpoint = "temp_oplog.timestamp"
+        conn.checkpoint_store = FileCheckpointStore("temp_oplog.timestamp")
 
         # testing with empty file
         self.assertEqual(conn.read_oplog_progress(), None)
 
-        oplog_dict = conn.oplog_progress.get_dict()
-
-        # add a value to the file, delete the dict, and then read in the value
-        oplog_dict['oplog1'] = Timestamp(12, 34)
+        # add a value to the file, delete it, and then read in the value
+        conn.oplog_progress.publish('oplog1', Timestamp(12, 34))
         conn.write_oplog_progress()
-        del oplog_dict['oplog1']
+        conn.oplog_progress.publish('oplog1', None)
 
-        self.assertEqual(len(oplog_dict), 0)
+        self.assertEqual(len(conn.oplog_progress.snapshot()), 0)
 
         conn.read_oplog_progress()
-        oplog_dict = conn.oplog_progress.get_dict()
+        oplog_dict = conn.oplog_progress.snapshot()
 
         self.assertTrue('oplog1' in oplog_dict.keys())
-        self.assertTrue(oplog_dict['oplog1'], Timestamp(12, 34))
+        self.assertEqual(oplog_dict['oplog1'], Timestamp(12, 34))
 
-        oplog_dict['oplog1'] = Timestamp(55, 11)
+        conn.oplog_progress.publish('oplog1', Timestamp(55, 11))
 
-        # see if oplog progress dict is properly updated
+        # see if oplog progress is properly replaced
         conn.read_oplog_progress()
-        self.assertTrue(oplog_dict['oplog1'], Timestamp(55, 11))
+        self.assertEqual(conn.oplog_progress.get('oplog1'), Timestamp(12, 34))
 
         os.unlink("temp_oplog.timestamp")
 
+    def test_write_dump_progress(self):
+        """Test writing and reading the progress of a collection dump."""
+        conn = Connector(
+            mongo_address=self.repl_set.uri,
+            oplog_checkpoint="temp_oplog.timestamp",
+            **connector_opts
+        )
+        dump_file = "temp_oplog.timestamp.dump"
+        self.assertEqual(conn.dump_progress_file, dump_file)
+
+        progress = DumpProgress(Timestamp(12, 34), ['test.test'], [],
+                                [('test.test', (None, None))], 1)
+        progress.update(0, 0, 'last')
+        conn.dump_progress.publish('rs', progress)
+        conn.write_dump_progress()
+        self.assertTrue(os.path.exists(dump_file))
+
+        conn.dump_progress.load({})
+        conn.read_dump_progress()
+        progress = conn.dump_progress.get('rs')
+        self.assertEqual(progress.timestamp, Timestamp(12, 34))
+        self.assertEqual(progress.last_id(0, 0), 'last')
+
+        # The file is removed once the dump is finished.
+        conn.dump_progress.load({})
+        conn.write_dump_progress()
+        self.assertFalse(os.path.exists(dump_file))
+
     def test_connector_minimum_privileges(self):
         """Test the Connector works with a user with minimum privileges."""
         if not (db_user and db_password):
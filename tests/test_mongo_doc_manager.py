@@ -17,6 +17,8 @@
 
 import sys
 
+from bson.timestamp import Timestamp
+
 sys.path[0:0] = [""]
 
 from mongo_connector.namespace_config import NamespaceConfig
@@ -126,6 +128,33 @@ class TestMongoDocManager(MongoTestCase):
         for i, r in enumerate(res):
             self.assertEqual(r['weight'], 2 * i)
 
+    def test_apply_batch(self):
+        """Test applying oplog entries with bulk writes."""
+        ts = Timestamp(1, 0)
+        entries = [{'op': 'i', 'ns': 'test.test', 'ts': ts, 'o': {'_id': i}}
+                   for i in range(100)]
+        entries.extend([
+            {'op': 'u', 'ns': 'test.test', 'ts': ts, 'o2': {'_id': 1},
+             'o': {'$set': {'a': 1}}},
+            {'op': 'u', 'ns': 'test.test', 'ts': ts, 'o2': {'_id': 1},
+             'o': {'$set': {'a': 2}}},
+            {'op': 'u', 'ns': 'test.test', 'ts': ts, 'o2': {'_id': 2},
+             'o': {'_id': 2, 'b': 1}},
+            {'op': 'd', 'ns': 'test.test', 'ts': ts, 'o': {'_id': 3}},
+            {'op': 'i', 'ns': 'test.test', 'ts': ts, 'o': {'_id': 3, 'c': 1}},
+            {'op': 'd', 'ns': 'test.test', 'ts': ts, 'o': {'_id': 4}},
+        ])
+        self.choosy_docman.apply_batch(entries)
+
+        res = dict((doc['_id'], doc) for doc in self._search())
+        self.assertEqual(len(res), 99)
+        self.assertEqual(res[1], {'_id': 1, 'a': 2})
+        self.assertEqual(res[2], {'_id': 2, 'b': 1})
+        self.assertEqual(res[3], {'_id': 3, 'c': 1})
+        self.assertNotIn(4, res)
+        self.assertEqual(len(list(self.choosy_docman.search(0, 1 << 32))),
+                         99)
+
     def test_remove(self):
         """Ensure we can properly delete from Mongo via DocManager.
         """
@@ -226,6 +255,23 @@ class TestMongoDocManager(MongoTestCase):
         doc = self.choosy_docman.get_last_doc()
         self.assertEqual(doc[self.id_field], '6')
 
+    def test_checkpoints(self):
+        """Test write_checkpoint and read_checkpoints, and that the
+        checkpoints are not mistaken for meta collections.
+        """
+        self.assertEqual(self.choosy_docman.read_checkpoints(), {})
+        self.choosy_docman.write_checkpoint('rs0', Timestamp(12, 34))
+        self.choosy_docman.write_checkpoint('rs1', Timestamp(56, 78))
+        self.choosy_docman.write_checkpoint('rs0', Timestamp(90, 12))
+        self.assertEqual(self.choosy_docman.read_checkpoints(),
+                         {'rs0': Timestamp(90, 12), 'rs1': Timestamp(56, 78)})
+
+        meta_collection_names = set()
+        if self.use_single_meta_collection:
+            meta_collection_names.add(self.choosy_docman.meta_collection_name)
+        self.assertEqual(set(self.choosy_docman._meta_collections()),
+                         meta_collection_names)
+
     def test_commands(self):
         # Also test with namespace mapping.
         # Note that mongo-connector does not currently support commands after
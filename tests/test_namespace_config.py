@@ -16,10 +16,12 @@ import json
 import os
 import re
 
+from bson.regex import Regex
+
 from tests import unittest
 from mongo_connector.namespace_config import (
     NamespaceConfig, Namespace, match_replace_regex, namespace_to_regex,
-    RegexSet, wildcards_overlap)
+    RegexMatcher, RegexSet, wildcards_overlap)
 from mongo_connector import errors
 
 
@@ -83,6 +85,61 @@ class TestNamespaceConfig(unittest.TestCase):
                              "db1.col1")
             self.assertIsNone(namespace_config.map_namespace("db2.col4"))
 
+    def test_include_many_wildcards(self):
+        """Test including more wildcard namespaces than fit in one regex"""
+        namespace_config = NamespaceConfig(namespace_options=dict(
+            ("db%d.*" % i, "new_db%d.*" % i) for i in range(200)))
+        self.assertEqual(namespace_config.lookup("db150.col"),
+                         Namespace(dest_name="new_db150.col",
+                                   source_name="db150.col"))
+        self.assertEqual(namespace_config.map_namespace("db0.col.1"),
+                         "new_db0.col.1")
+        self.assertIsNone(namespace_config.map_namespace("db200.col"))
+
+    def test_lookup_cache(self):
+        """Test looked up namespaces are cached up to the cache size."""
+        namespace_config = NamespaceConfig(
+            namespace_set=["db.*", "plain.col"], cache_size=2)
+        for name in ["db.col1", "db.col2", "db.col1", "other.col"]:
+            namespace_config.lookup(name)
+        self.assertEqual(namespace_config.cache_info(), (1, 3, 2, 2))
+        # "db.col2" was evicted.
+        self.assertEqual(namespace_config.map_namespace("db.col2"),
+                         "db.col2")
+        self.assertEqual(namespace_config.cache_info(), (1, 4, 2, 2))
+        # Configured namespaces are never evicted.
+        for i in range(10):
+            namespace_config.lookup("db.col%d" % i)
+        self.assertEqual(namespace_config.unmap_namespace("plain.col"),
+                         "plain.col")
+        self.assertEqual(namespace_config.map_namespace("plain.col"),
+                         "plain.col")
+        self.assertEqual(namespace_config.map_db("db"), ["db"])
+
+    def test_lookup_cache_rename_validation(self):
+        """Test merged namespaces are detected without remembering every
+        namespace that was looked up."""
+        namespace_config = NamespaceConfig(namespace_options={
+            "*.coll": "*.new_coll",
+            "db.*": "new_db.*"}, cache_size=1)
+        plain = dict(namespace_config._plain)
+        for i in range(10):
+            namespace_config.map_namespace("db%d.coll" % i)
+            namespace_config.map_namespace("db.col%d" % i)
+        with self.assertRaises(errors.InvalidConfiguration):
+            namespace_config.map_namespace("db.new_coll")
+        self.assertEqual(namespace_config._plain, plain)
+        self.assertEqual(namespace_config.cache_info().size, 1)
+
+        # Excluded namespaces are not merged into the target.
+        namespace_config = NamespaceConfig(namespace_options={
+            "*.coll": "*.new_coll",
+            "db.*": "new_db.*"}, ex_namespace_set=["db.new_coll"])
+        self.assertEqual(namespace_config.map_namespace("new_db.coll"),
+                         "new_db.new_coll")
+        self.assertEqual(namespace_config.unmap_namespace("new_db.new_coll"),
+                         "new_db.coll")
+
     def test_map_db_wildcard(self):
         """Test a crazy namespace renaming scheme with wildcards."""
         namespace_config = NamespaceConfig(namespace_options={
@@ -282,11 +339,17 @@ class TestNamespaceConfig(unittest.TestCase):
         namespace_config = NamespaceConfig(namespace_options={
             "*.coll": "*.new_coll",
             "db.*": "new_db.*"})
-        namespace_config.map_namespace("new_db.coll")
         with self.assertRaises(errors.InvalidConfiguration):
-            # "db.new_coll" should map to "new_db.new_coll" but there is
-            # already a mapping from "new_db.coll" to "new_db.new_coll".
+            # "new_db.coll" should map to "new_db.new_coll" but so does
+            # "db.new_coll".
+            namespace_config.map_namespace("new_db.coll")
+        with self.assertRaises(errors.InvalidConfiguration):
             namespace_config.map_namespace("db.new_coll")
+        # Namespaces that no other namespace is mapped onto are fine.
+        self.assertEqual(namespace_config.map_namespace("other.coll"),
+                         "other.new_coll")
+        self.assertEqual(namespace_config.unmap_namespace("other.new_coll"),
+                         "other.coll")
 
         # For the sake of map_db, wildcards cannot be moved from database name
         # to collection name.
@@ -371,6 +434,26 @@ class TestNamespaceConfig(unittest.TestCase):
         namespace_config = NamespaceConfig(namespace_options={"db.*": True})
         self.assertEqual(namespace_config.get_included_databases(), ["db"])
 
+    def test_source_namespace_query(self):
+        """Test source_namespace_query."""
+        self.assertIsNone(NamespaceConfig().source_namespace_query())
+
+        namespace_config = NamespaceConfig(
+            namespace_set=["db.c", "db*.d"], ex_namespace_set=["db2.*"],
+            gridfs_set=["db.fs"])
+        query = namespace_config.source_namespace_query()
+        self.assertEqual(sorted(query), ["$in", "$nin"])
+        plain = [ns for ns in query["$in"] if not isinstance(ns, Regex)]
+        self.assertEqual(plain, ["db.c", "db.fs", "db.fs.files"])
+        regexes = [ns.pattern for ns in query["$in"] if isinstance(ns, Regex)]
+        self.assertEqual(regexes, [namespace_to_regex("db*.d").pattern])
+        self.assertEqual([regex.pattern for regex in query["$nin"]],
+                         [namespace_to_regex("db2.*").pattern])
+        # Looking up namespaces does not change the query.
+        namespace_config.lookup("db1.d")
+        namespace_config.lookup("not.included")
+        self.assertEqual(namespace_config.source_namespace_query(), query)
+
     def test_match_replace_regex(self):
         """Test regex matching and replacing."""
         regex = re.compile(r"\Adb_([^.]*).foo\Z")
@@ -408,6 +491,42 @@ class TestNamespaceConfig(unittest.TestCase):
         self.assertFalse(wildcards_overlap("a*b*c", "*c*d"))
 
 
+class TestRegexMatcher(unittest.TestCase):
+    """Test the RegexMatcher class."""
+
+    def test_match(self):
+        """Test the first matching regex is found."""
+        matcher = RegexMatcher([namespace_to_regex("db.col*"),
+                                namespace_to_regex("db*.col"),
+                                namespace_to_regex("db.*")])
+        index, match = matcher.match("db.col1")
+        self.assertEqual((index, match.group(1)), (0, "1"))
+        index, match = matcher.match("db.col")
+        self.assertEqual((index, match.group(1)), (0, ""))
+        index, match = matcher.match("db1.col")
+        self.assertEqual((index, match.group(1)), (1, "1"))
+        index, match = matcher.match("db.foo")
+        self.assertEqual((index, match.group(1)), (2, "foo"))
+        self.assertEqual(matcher.match("db1.foo"), (None, None))
+        matcher.append(namespace_to_regex("*.foo"))
+        index, match = matcher.match("db1.foo")
+        self.assertEqual((index, match.group(1)), (3, "db1"))
+
+    def test_match_other_regexes(self):
+        """Test regexes without a simple literal prefix."""
+        matcher = RegexMatcher([re.compile(r"a+b"), re.compile(r"a\.?c"),
+                                re.compile(r"x|a"), re.compile(r"\d"),
+                                re.compile(r"A", re.IGNORECASE)])
+        self.assertEqual(matcher.match("aab")[0], 0)
+        self.assertEqual(matcher.match("ac")[0], 1)
+        self.assertEqual(matcher.match("a.c")[0], 1)
+        self.assertEqual(matcher.match("x")[0], 2)
+        self.assertEqual(matcher.match("1")[0], 3)
+        self.assertEqual(matcher.match("b"), (None, None))
+        matcher = RegexMatcher([re.compile(r"A", re.IGNORECASE)])
+        self.assertEqual(matcher.match("a")[0], 0)
+
+
 class TestRegexSet(unittest.TestCase):
     """Test the RegexSet class."""
 
@@ -445,5 +564,17 @@ class TestRegexSet(unittest.TestCase):
         regex_set.discard("db.bar")
         self.assertFalse("db.bar" in regex_set)
 
+    def test_cache(self):
+        """Test membership results are cached up to the cache size."""
+        regex_set = RegexSet.from_namespaces(["db.bar", "db_*.foo"],
+                                             cache_size=1)
+        self.assertTrue("db_1.foo" in regex_set)
+        self.assertTrue("db_1.foo" in regex_set)
+        self.assertFalse("not.found" in regex_set)
+        self.assertTrue("db_1.foo" in regex_set)
+        self.assertEqual(regex_set.cache_info(), (1, 3, 1, 1))
+        # Matched strings are not added to the set.
+        self.assertEqual(len(regex_set), 2)
+
 if __name__ == "__main__":
     unittest.main()
@@ -26,10 +26,16 @@ import pymongo
 
 sys.path[0:0] = [""]
 
+from benchmarks.fake_mongo import FakeClient
+from mongo_connector import errors, metrics, util
 from mongo_connector.doc_managers.doc_manager_simulator import DocManager
-from mongo_connector.locking_dict import LockingDict
+from mongo_connector.progress_slots import ProgressSlots
+from mongo_connector.stage_timer import StageTimer
 from mongo_connector.namespace_config import NamespaceConfig
-from mongo_connector.oplog_manager import OplogThread
+from mongo_connector.oplog_manager import (ApplyLanes,
+                                           DumpReader,
+                                           OplogReader,
+                                           OplogThread)
 from mongo_connector.test_utils import (assert_soon,
                                         close_client,
                                         ReplicaSetSingle)
@@ -49,7 +55,7 @@ class TestOplogManager(unittest.TestCase):
         self.opman = OplogThread(
             primary_client=self.primary_conn,
             doc_managers=(DocManager(),),
-            oplog_progress_dict=LockingDict(),
+            oplog_progress_dict=ProgressSlots(),
             namespace_config=NamespaceConfig(
                 namespace_options={
                     'test.*': True,
@@ -70,11 +76,16 @@ class TestOplogManager(unittest.TestCase):
     def test_get_oplog_cursor(self):
         """Test the get_oplog_cursor method"""
 
-        # timestamp is None - all oplog entries excluding no-ops are returned.
+        # timestamp is None - all oplog entries that may be replicated are
+        # returned, excluding no-ops.
         cursor = self.opman.get_oplog_cursor(None)
         self.assertEqual(cursor.count(),
                          self.primary_conn["local"]["oplog.rs"].find(
-                             {'op': {'$ne': 'n'}}).count())
+                             {'op': {'$ne': 'n'},
+                              '$or': [
+                                  {'ns': re.compile(r'\A[^.]*\.\$cmd\Z')},
+                                  {'ns': re.compile(r'\Atest\.(?!system\.)')}
+                              ]}).count())
 
         # earliest entry is the only one at/after timestamp
         doc = {"ts": bson.Timestamp(1000, 0), "i": 1}
@@ -103,6 +114,25 @@ class TestOplogManager(unittest.TestCase):
         goc_cursor = self.opman.get_oplog_cursor(pivot["ts"])
         self.assertEqual(goc_cursor.count(), 1 + 1000 - 400)
 
+    def test_get_oplog_cursor_filters_namespaces(self):
+        """Test that get_oplog_cursor filters namespaces on the server"""
+        self.primary_conn["test"]["test"].insert_one({"i": 0})
+        checkpoint = self.opman.get_last_oplog_timestamp()
+        self.primary_conn["excluded"]["test"].insert_one({"i": 1})
+        self.primary_conn["test"]["test"].insert_one({"i": 2})
+        fs = gridfs.GridFS(self.primary_conn["gridfs"], "fs")
+        fs.put(b"hello world", filename="file")
+        self.primary_conn["excluded"]["test"].insert_one({"i": 3})
+
+        cursor = self.opman.get_oplog_cursor(checkpoint)
+        # The entry at the checkpoint is returned first.
+        self.assertEqual(next(cursor)["o"]["i"], 0)
+        namespaces = [entry["ns"] for entry in cursor]
+        self.assertIn("test.test", namespaces)
+        self.assertIn("gridfs.fs.files", namespaces)
+        self.assertNotIn("excluded.test", namespaces)
+        self.assertNotIn("gridfs.fs.chunks", namespaces)
+
     def test_get_last_oplog_timestamp(self):
         """Test the get_last_oplog_timestamp method"""
 
@@ -160,7 +190,7 @@ class TestOplogManager(unittest.TestCase):
         opman = OplogThread(
             primary_client=conn,
             doc_managers=(DocManager(),),
-            oplog_progress_dict=LockingDict(),
+            oplog_progress_dict=ProgressSlots(),
             namespace_config=NamespaceConfig(namespace_set=["test.test"]),
         )
         # Insert a document into an included collection
@@ -181,7 +211,7 @@ class TestOplogManager(unittest.TestCase):
         opman = OplogThread(
             primary_client=conn,
             doc_managers=(DocManager(),),
-            oplog_progress_dict=LockingDict(),
+            oplog_progress_dict=ProgressSlots(),
             namespace_config=NamespaceConfig(namespace_set=["test.test"]),
         )
         opman.start()
@@ -194,8 +224,8 @@ class TestOplogManager(unittest.TestCase):
                     "entry.")
         self.assertEqual(len(opman.doc_managers[0]._search()), 1)
 
-        # Make sure that the oplog thread updates its checkpoint on every
-        # oplog entry.
+        # Make sure that the oplog thread updates its checkpoint past oplog
+        # entries that are filtered out by its oplog query.
         conn["test"]["ignored"].insert_one({"test": 1})
         last_ts = opman.get_last_oplog_timestamp()
         assert_soon(lambda: last_ts == opman.checkpoint,
@@ -239,6 +269,120 @@ class TestOplogManager(unittest.TestCase):
         self.opman.running = False
         self.assertIsNone(self.opman.dump_collection())
 
+    def test_dump_collection_ranges(self):
+        """Test dumping collections in ranges of _ids on several threads."""
+        self.opman.dump_threads = 4
+        self.opman.dump_range_size = 100
+        self.opman.oplog = self.primary_conn["local"]["oplog.rs"]
+        # _ids of different types are in different ranges of the _id index.
+        docs = [{'_id': i} for i in range(1000)]
+        docs.extend({'_id': 'str%d' % i} for i in range(100))
+        self.primary_conn['test']['test'].insert_many(docs)
+        for i in range(10):
+            self.primary_conn['test']['small'].insert_one({'i': i})
+
+        ranges = self.opman._dump_ranges(self.primary_conn['test']['test'])
+        self.assertGreater(len(ranges), 1)
+        self.assertIsNone(ranges[0][0])
+        self.assertIsNone(ranges[-1][1])
+        for (_, max_id), (min_id, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(max_id, min_id)
+        self.assertEqual(
+            self.opman._dump_ranges(self.primary_conn['test']['small']),
+            [(None, None)])
+
+        last_ts = self.opman.get_last_oplog_timestamp()
+        self.assertEqual(last_ts, self.opman.dump_collection())
+        self.assertEqual(len(self.opman.doc_managers[0]._search()), 1110)
+
+    def test_dump_collection_resume(self):
+        """Test resuming an interrupted collection dump."""
+        self.opman.dump_progress = ProgressSlots()
+        self.opman.oplog = self.primary_conn["local"]["oplog.rs"]
+        self.primary_conn['test']['test'].insert_many(
+            [{'_id': i} for i in range(2500)])
+        dump_ts = self.opman.get_last_oplog_timestamp()
+        doc_manager = self.opman.doc_managers[0]
+        bulk_upsert = doc_manager.bulk_upsert
+        written = []
+
+        def failing_bulk_upsert(docs, namespace, timestamp):
+            if len(written) == 2000:
+                raise errors.OperationFailed("interrupted")
+            docs = list(docs)
+            written.extend(docs)
+            bulk_upsert(iter(docs), namespace, timestamp)
+
+        doc_manager.bulk_upsert = failing_bulk_upsert
+        self.assertIsNone(self.opman.dump_collection())
+        progress = self.opman.read_dump_progress()
+        self.assertEqual(progress.timestamp, dump_ts)
+        last_id = progress.last_id(0, 0)
+        self.assertEqual(last_id, written[-1]['_id'])
+
+        # The resumed dump skips the documents that were written and replays
+        # the oplog from where the interrupted dump started.
+        del written[:]
+        doc_manager.bulk_upsert = failing_bulk_upsert
+        self.primary_conn['test']['test'].insert_one({'_id': 2500})
+        self.opman.running = True
+        self.assertEqual(dump_ts, self.opman.dump_collection())
+        self.assertEqual(written[0]['_id'], last_id)
+        self.assertEqual(len(doc_manager._search()), 2501)
+        self.assertTrue(progress.is_finished(0, 0))
+
+    def test_dump_collection_fan_out(self):
+        """Test that each collection is read once for several DocManagers.
+        """
+        self.opman.doc_managers = (DocManager(), DocManager())
+        self.opman.oplog = self.primary_conn["local"]["oplog.rs"]
+        self.primary_conn['test']['test'].insert_many(
+            [{'_id': i} for i in range(2500)])
+        self.primary_conn['test']['other'].insert_one({'_id': 'other'})
+        finds = []
+        get_collection = self.opman.get_collection
+
+        def counting_get_collection(namespace):
+            collection = get_collection(namespace)
+            find = collection.find
+
+            def counting_find(*args, **kwargs):
+                finds.append(namespace)
+                return find(*args, **kwargs)
+
+            collection.find = counting_find
+            return collection
+
+        self.opman.get_collection = counting_get_collection
+        last_ts = self.opman.get_last_oplog_timestamp()
+        self.assertEqual(last_ts, self.opman.dump_collection())
+        self.assertEqual(sorted(finds), ['test.other', 'test.test'])
+        for doc_manager in self.opman.doc_managers:
+            self.assertEqual(len(doc_manager._search()), 2501)
+
+    @unittest.skipIf(pymongo.version_tuple < (3, 4),
+                     'maxStalenessSeconds requires PyMongo 3.4 or later.')
+    def test_dump_collection_read_preference(self):
+        """Test dumping collections with a secondary read preference."""
+        self.opman.read_preference = util.read_preference(
+            'secondaryPreferred', 90)
+        self.opman.max_staleness_seconds = 90
+        self.opman.oplog = self.primary_conn["local"]["oplog.rs"]
+        self.primary_conn['test']['test'].insert_many(
+            [{'_id': i} for i in range(100)])
+        last_ts = self.opman.get_last_oplog_timestamp()
+        # The new oplog does not go back maxStalenessSeconds, so the
+        # collections are dumped from the primary.
+        self.assertIsNone(self.opman._secondary_read_timestamp(last_ts))
+        self.assertEqual(last_ts, self.opman.dump_collection())
+        self.assertEqual(len(self.opman.doc_managers[0]._search()), 100)
+
+        # Otherwise the oplog is replayed from before the oldest data that
+        # may be read from a secondary.
+        later_ts = bson.Timestamp(last_ts.time + 200, 0)
+        read_ts = self.opman._secondary_read_timestamp(later_ts)
+        self.assertLessEqual(read_ts, last_ts)
+
     def test_init_cursor(self):
         """Test the init_cursor method
 
@@ -286,7 +430,7 @@ class TestOplogManager(unittest.TestCase):
         # No last checkpoint, no collection dump, something in oplog
         # If collection dump is false the checkpoint should not be set
         self.opman.checkpoint = None
-        self.opman.oplog_progress = LockingDict()
+        self.opman.oplog_progress = ProgressSlots()
         self.opman.collection_dump = False
         collection.insert_one({"i": 2})
         cursor, cursor_empty = self.opman.init_cursor()
@@ -421,13 +565,41 @@ class TestOplogManager(unittest.TestCase):
         for d in doc_managers:
             self.assertEqual(d._search()[0]["name"], "kermit")
 
+    def test_oplog_queue(self):
+        """Test that an OplogThread reading the oplog in a separate thread
+        replicates documents and updates its checkpoint.
+        """
+        self.opman.oplog_queue_size = 10
+        self.opman.start()
+        docman = self.opman.doc_managers[0]
+        self.primary_conn["test"]["test"].insert_many(
+            [{"i": i} for i in range(100)])
+        assert_soon(lambda: len(docman._search()) == 100)
+        last_ts = self.opman.get_last_oplog_timestamp()
+        assert_soon(lambda: last_ts == self.opman.checkpoint)
+
+    def test_stage_timing(self):
+        """Test that an OplogThread times the stages of the entries it
+        replicates when asked to.
+        """
+        self.assertIsNone(self.opman.stage_timer)
+        self.opman.stage_timer = StageTimer(self.opman.replset_name, 3600)
+        self.opman.start()
+        docman = self.opman.doc_managers[0]
+        self.primary_conn["test"]["test"].insert_many(
+            [{"i": i} for i in range(10)])
+        assert_soon(lambda: len(docman._search()) == 10)
+        summaries = self.opman.stage_timer.flush()
+        for stage in ('fetch', 'skip_check', 'apply_batch'):
+            self.assertIn(stage, summaries)
+        self.assertGreaterEqual(summaries['skip_check']['count'], 10)
+
     def test_upgrade_oplog_progress(self):
         first_oplog_ts = self.opman.oplog.find_one()['ts']
         # Old format oplog progress file:
         progress = {str(self.opman.oplog): bson_ts_to_long(first_oplog_ts)}
         # Set up oplog managers to use the old format.
-        oplog_progress = LockingDict()
-        oplog_progress.dict = progress
+        oplog_progress = ProgressSlots(progress)
         self.opman.oplog_progress = oplog_progress
         # Cause the oplog managers to update their checkpoints.
         self.opman.update_checkpoint(first_oplog_ts)
@@ -435,9 +607,381 @@ class TestOplogManager(unittest.TestCase):
         new_format = {self.opman.replset_name: first_oplog_ts}
         self.assertEqual(
             new_format,
-            self.opman.oplog_progress.get_dict()
+            self.opman.oplog_progress.snapshot()
         )
 
 
+class MockCursor(object):
+    """A tailable cursor over batches of oplog entries."""
+    def __init__(self, batches):
+        self.batches = list(batches)
+
+    @property
+    def alive(self):
+        return bool(self.batches)
+
+    def __iter__(self):
+        batch = self.batches.pop(0)
+        if isinstance(batch, Exception):
+            raise batch
+        return iter(batch)
+
+
+class TestOplogReader(unittest.TestCase):
+    """Test the OplogReader without a MongoDB server."""
+
+    def start_reader(self, batches, max_size=2):
+        reader = OplogReader(MockCursor(batches), max_size)
+        reader.start()
+        self.addCleanup(reader.stop)
+        return reader
+
+    def test_iterate_like_cursor(self):
+        batches = [[{"i": 1}, {"i": 2}, {"i": 3}], [], [{"i": 4}]]
+        reader = self.start_reader(batches)
+        received = []
+        while reader.alive:
+            received.append([entry["i"] for entry in reader])
+        # Each batch from the cursor ends one iteration of the reader.
+        self.assertEqual(received, [[1, 2, 3], [], [4], []])
+
+    def test_reraise_cursor_exception(self):
+        reader = self.start_reader(
+            [[{"i": 1}], pymongo.errors.AutoReconnect("reconnect")])
+        self.assertEqual([entry["i"] for entry in reader], [1])
+        with self.assertRaises(pymongo.errors.AutoReconnect):
+            list(reader)
+        self.assertFalse(reader.alive)
+
+
+class TestDumpReader(unittest.TestCase):
+    """Test the DumpReader without a MongoDB server."""
+
+    def start_reader(self, docs, max_size, batch_size):
+        reader = DumpReader(docs, max_size, batch_size)
+        reader.start()
+        self.addCleanup(reader.stop)
+        return reader
+
+    def test_batches(self):
+        docs = [{"_id": i} for i in range(10)]
+        reader = self.start_reader(iter(docs), 6, 4)
+        self.assertEqual(reader.queue.maxsize, 1)
+        self.assertEqual([[doc["_id"] for doc in batch] for batch in reader],
+                         [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+        # Batches are no larger than the queue.
+        reader = self.start_reader(iter(docs), 3, 4)
+        self.assertEqual([len(batch) for batch in reader], [3, 3, 3, 1])
+
+    def test_reraise_exception(self):
+        def docs():
+            yield {"_id": 1}
+            raise pymongo.errors.AutoReconnect("reconnect")
+
+        reader = self.start_reader(docs(), 10, 10)
+        with self.assertRaises(pymongo.errors.AutoReconnect):
+            list(reader)
+
+    def test_stop(self):
+        reader = self.start_reader(itertools.count(), 2, 1)
+        self.assertEqual(next(iter(reader)), [0])
+        reader.stop()
+        reader.join(5)
+        self.assertFalse(reader.is_alive())
+
+
+class TestApplyLanes(unittest.TestCase):
+    """Test the ApplyLanes without a MongoDB server."""
+
+    def start_lanes(self, apply_func, count=4):
+        lanes = ApplyLanes(apply_func, count)
+        lanes.start()
+        self.addCleanup(lanes.stop)
+        return lanes
+
+    def test_document_order(self):
+        applied = []
+
+        def apply_func(entries):
+            applied.extend((entry['o']['_id'], entry['o']['i'])
+                           for entry in entries)
+
+        lanes = self.start_lanes(apply_func)
+        entries = [{'op': 'i', 'ns': 'test.test', 'ts': bson.Timestamp(i, 0),
+                    'o': {'_id': i % 10, 'i': i}} for i in range(1, 101)]
+        for i in range(0, 100, 10):
+            lanes.dispatch(entries[i:i + 10])
+            lanes.applied_ts(entries[i + 9]['ts'])
+        lanes.wait()
+        self.assertEqual(len(applied), 100)
+        for _id in range(10):
+            self.assertEqual([i for doc_id, i in applied if doc_id == _id],
+                             list(range(_id or 10, 101, 10)))
+        self.assertEqual(lanes.applied_ts(), bson.Timestamp(100, 0))
+
+    def test_applied_ts(self):
+        lanes = ApplyLanes(lambda entries: None, 2)
+        entries = [{'op': 'i', 'ns': 'test.test', 'ts': bson.Timestamp(i, 0),
+                    'o': {'_id': i}} for i in range(1, 5)]
+        lanes.dispatch(entries[:2])
+        lanes.dispatch(entries[2:])
+        # Nothing has been applied yet.
+        self.assertIsNone(lanes.applied_ts(bson.Timestamp(5, 0)))
+        lanes.lanes[0].applied_ts = bson.Timestamp(4, 0)
+        lanes.lanes[1].applied_ts = bson.Timestamp(2, 0)
+        self.assertEqual(lanes.applied_ts(), bson.Timestamp(2, 0))
+        # Skipped entries after the last batch count once all are applied.
+        lanes.lanes[1].applied_ts = bson.Timestamp(4, 0)
+        self.assertEqual(lanes.applied_ts(), bson.Timestamp(5, 0))
+
+    def test_reraise_apply_exception(self):
+        def apply_func(entries):
+            raise ValueError("apply failed")
+
+        lanes = self.start_lanes(apply_func, count=2)
+        lanes.dispatch([{'op': 'd', 'ns': 'test.test',
+                         'ts': bson.Timestamp(1, 0), 'o': {'_id': 1}}])
+        with self.assertRaises(ValueError):
+            lanes.wait()
+
+
+def fake_oplog(count, namespace='test.test'):
+    """Return a checkpoint entry followed by ``count`` inserts."""
+    entries = [{'ts': bson.Timestamp(1, 0), 'op': 'n', 'ns': '', 'o': {}}]
+    entries.extend({'ts': bson.Timestamp(2, i), 'op': 'i', 'ns': namespace,
+                    'o': {'_id': i}} for i in range(1, count + 1))
+    return entries
+
+
+class FailingDocManager(DocManager):
+    """DocManager simulator whose first calls to apply_batch fail."""
+
+    def __init__(self, failures):
+        super(FailingDocManager, self).__init__()
+        self.failures = failures
+
+    def apply_batch(self, entries):
+        if self.failures:
+            self.failures -= 1
+            raise errors.ConnectionFailed("target is down")
+        super(FailingDocManager, self).apply_batch(entries)
+
+
+class StreamingSearchDocManager(DocManager):
+    """DocManager simulator whose search streams its results like a cursor,
+    and that counts the writes made while a search is in progress."""
+
+    def __init__(self):
+        super(StreamingSearchDocManager, self).__init__()
+        self.searching = False
+        self.writes_while_searching = 0
+
+    def search(self, start_ts, end_ts):
+        self.searching = True
+        try:
+            for doc in super(StreamingSearchDocManager, self).search(
+                    start_ts, end_ts):
+                yield doc
+        finally:
+            self.searching = False
+
+    def apply_batch(self, entries):
+        if self.searching:
+            self.writes_while_searching += 1
+        super(StreamingSearchDocManager, self).apply_batch(entries)
+
+    def bulk_upsert(self, docs, namespace, timestamp):
+        if self.searching:
+            self.writes_while_searching += 1
+        super(StreamingSearchDocManager, self).bulk_upsert(
+            docs, namespace, timestamp)
+
+
+class BadDocumentDocManager(DocManager):
+    """DocManager simulator that cannot upsert documents with a "bad"
+    field, and whose bulk_upsert fails when any of the documents is bad."""
+
+    def upsert(self, doc, namespace, timestamp):
+        if doc.get('bad'):
+            raise errors.OperationFailed('bad document')
+        super(BadDocumentDocManager, self).upsert(doc, namespace, timestamp)
+
+    def bulk_upsert(self, docs, namespace, timestamp):
+        docs = list(docs)
+        if any(doc.get('bad') for doc in docs):
+            raise errors.OperationFailed('bad document')
+        super(BadDocumentDocManager, self).bulk_upsert(
+            docs, namespace, timestamp)
+
+
+class TestOplogThreadFakeOplog(unittest.TestCase):
+    """Test an OplogThread that tails an in-process oplog."""
+
+    def start_opman(self, docman, entries, **kwargs):
+        client = FakeClient(entries, await_secs=0.1)
+        opman = OplogThread(
+            client, (docman,),
+            ProgressSlots({client.set_name: entries[0]['ts']}),
+            NamespaceConfig(), **kwargs)
+        opman.start()
+        self.addCleanup(opman.join)
+        return client, opman
+
+    def check_connection_failed(self, **kwargs):
+        entries = fake_oplog(50)
+        docman = FailingDocManager(1)
+        _, opman = self.start_opman(docman, entries, **kwargs)
+        # The batch that failed is applied again.
+        assert_soon(lambda: opman.checkpoint == entries[-1]['ts'])
+        self.assertEqual(len(docman._search()), 50)
+
+    def test_connection_failed(self):
+        self.check_connection_failed()
+
+    def test_connection_failed_apply_threads(self):
+        self.check_connection_failed(apply_threads=2)
+
+    def test_count_entries(self):
+        database_entries = metrics.REGISTRY.get(
+            'mongo_connector_database_entries_total')
+        for count_entries, database in ((False, 'uncounted'),
+                                        (True, 'counted')):
+            entries = fake_oplog(10, database + '.tmp')
+            _, opman = self.start_opman(DocManager(), entries,
+                                        count_entries=count_entries)
+            assert_soon(lambda: opman.checkpoint == entries[-1]['ts'])
+            self.assertEqual(database_entries.labels(database).value(),
+                             10 if count_entries else 0)
+
+    def test_stage_timing(self):
+        entries = fake_oplog(10)
+        _, opman = self.start_opman(DocManager(), entries,
+                                    stage_timing_interval=3600)
+        assert_soon(lambda: opman.checkpoint == entries[-1]['ts'])
+        summaries = opman.stage_timer.flush()
+        for stage in ('fetch', 'skip_check', 'filter', 'apply_batch'):
+            self.assertIn(stage, summaries)
+        self.assertEqual(summaries['filter']['count'], 10)
+        # Entries are decoded as they are fetched.
+        self.assertNotIn('decode', summaries)
+
+    def test_idle_checkpoint_with_reader(self):
+        entries = fake_oplog(100)
+        client = FakeClient(entries[:1], await_secs=0.05)
+        opman = OplogThread(client, (DocManager(),), ProgressSlots(),
+                            NamespaceConfig())
+        cursor = client.local.oplog.rs.find(
+            cursor_type=pymongo.CursorType.TAILABLE_AWAIT)
+        reader = OplogReader(cursor, 1000, opman.get_last_oplog_timestamp)
+        reader.start()
+        self.addCleanup(reader.stop)
+        # The reader catches up several times before anything is consumed.
+        for start in range(1, 101, 20):
+            client.oplog.append(entries[start:start + 20])
+            assert_soon(lambda: reader.queue.qsize() >= start + 21)
+        client.oplog.close()
+        last_read = entries[0]['ts']
+        idle_timestamps = []
+        while reader.alive:
+            for entry in reader:
+                last_read = entry['ts']
+            idle_ts = opman._idle_checkpoint(reader)
+            if idle_ts is not None:
+                idle_timestamps.append(idle_ts)
+                # Never past an entry that has not been read yet.
+                self.assertLessEqual(idle_ts, last_read)
+        self.assertTrue(idle_timestamps)
+
+    def test_rollback_streaming_search(self):
+        docs = [{'_id': bson.ObjectId()} for _ in range(2500)]
+        # Only every other document still exists in MongoDB.
+        client = FakeClient(fake_oplog(0), {'test.test': docs[::2]})
+        docman = StreamingSearchDocManager()
+        for i, doc in enumerate(docs):
+            docman.upsert(doc, 'test.test',
+                          util.bson_ts_to_long(bson.Timestamp(2, i)))
+        opman = OplogThread(client, (docman,), ProgressSlots(),
+                            NamespaceConfig())
+        self.assertEqual(opman.rollback(), bson.Timestamp(1, 0))
+        self.assertEqual(docman.writes_while_searching, 0)
+        self.assertEqual(
+            sorted(doc['_id'] for doc in docman._search()),
+            sorted(doc['_id'] for doc in docs[::2]))
+
+    def test_rollback_bad_document(self):
+        docs = [{'_id': bson.ObjectId()} for _ in range(10)]
+        mongo_docs = [dict(doc, a=1) for doc in docs]
+        mongo_docs[3]['bad'] = True
+        client = FakeClient(fake_oplog(0), {'test.test': mongo_docs})
+        docman = BadDocumentDocManager()
+        for i, doc in enumerate(docs):
+            docman.upsert(doc, 'test.test',
+                          util.bson_ts_to_long(bson.Timestamp(2, i)))
+        opman = OplogThread(client, (docman,), ProgressSlots(),
+                            NamespaceConfig())
+        self.assertEqual(opman.rollback(), bson.Timestamp(1, 0))
+        # Only the bad document was not upserted again.
+        self.assertEqual(
+            sorted((doc['_id'], doc.get('a')) for doc in docman._search()),
+            sorted((doc['_id'], None if i == 3 else 1)
+                   for i, doc in enumerate(docs)))
+
+    def test_filter_oplog_entry(self):
+        client = FakeClient(fake_oplog(0))
+        opman = OplogThread(client, (DocManager(),), ProgressSlots(),
+                            NamespaceConfig())
+
+        def filter_insert(**fields):
+            entry = {'op': 'i', 'o': {'_id': 1, 'a': 1, 'b': 2}}
+            return opman.filter_oplog_entry(entry, **fields)['o']
+
+        self.assertEqual(filter_insert(include_fields=['_id', 'a']),
+                         {'_id': 1, 'a': 1})
+        field_filter = opman._field_filter
+        self.assertEqual(filter_insert(include_fields=['_id', 'a']),
+                         {'_id': 1, 'a': 1})
+        # The fields are only compiled again when they change.
+        self.assertIs(opman._field_filter, field_filter)
+        self.assertEqual(filter_insert(exclude_fields=['a']),
+                         {'_id': 1, 'b': 2})
+        self.assertEqual(filter_insert(), {'_id': 1, 'a': 1, 'b': 2})
+
+    def test_quiet_oplog(self):
+        """Test an entry is applied without waiting for the next one."""
+        entries = fake_oplog(1)
+        docman = DocManager()
+        client = FakeClient(entries, await_secs=10)
+        opman = OplogThread(
+            client, (docman,),
+            ProgressSlots({client.set_name: entries[0]['ts']}),
+            NamespaceConfig())
+        opman.start()
+        self.addCleanup(opman.join)
+        self.addCleanup(client.oplog.close)
+        assert_soon(lambda: len(docman._search()) == 1)
+        client.oplog.append(fake_oplog(2)[2:])
+        # The cursor waits up to 10 seconds for the entry after this one.
+        assert_soon(lambda: len(docman._search()) == 2, max_tries=3)
+
+    def test_batch_is_ready(self):
+        client = FakeClient(fake_oplog(0))
+        opman = OplogThread(client, (DocManager(),), ProgressSlots(),
+                            NamespaceConfig())
+        batch = fake_oplog(2)[1:]
+        cursor = client.local.oplog.rs.find(
+            cursor_type=pymongo.CursorType.TAILABLE_AWAIT)
+        now = time.time()
+        # Entries read directly from the cursor are applied at once.
+        self.assertTrue(opman._batch_is_ready(batch, now, cursor))
+
+        # A batch read from an OplogReader is applied once the reader has
+        # nothing more to offer.
+        reader = OplogReader(cursor, 10)
+        reader.queue.put(batch[0])
+        self.assertFalse(opman._batch_is_ready(batch, now - 1, reader))
+        reader.queue.get()
+        self.assertTrue(opman._batch_is_ready(batch, now, reader))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import os
+import re
 import sys
 import threading
 import time
@@ -25,7 +26,7 @@ from pymongo.write_concern import WriteConcern
 sys.path[0:0] = [""]
 
 from mongo_connector.doc_managers.doc_manager_simulator import DocManager
-from mongo_connector.locking_dict import LockingDict
+from mongo_connector.progress_slots import ProgressSlots
 from mongo_connector.namespace_config import NamespaceConfig
 from mongo_connector.oplog_manager import OplogThread
 from mongo_connector.test_utils import (assert_soon,
@@ -125,7 +126,7 @@ class ShardedClusterTestCase(unittest.TestCase):
 
         # Oplog threads (oplog manager) for each shard
         doc_manager = DocManager()
-        oplog_progress = LockingDict()
+        oplog_progress = ProgressSlots()
         namespace_config = NamespaceConfig(
             namespace_set=["test.mcsharded", "test.mcunsharded"])
         self.opman1 = OplogThread(
@@ -169,15 +170,21 @@ class TestOplogManagerShardedSingle(ShardedClusterTestCase):
     def test_get_oplog_cursor(self):
         """Test the get_oplog_cursor method"""
 
+        # Oplog entries that may be replicated
+        replicated = {
+            'op': {'$ne': 'n'},
+            'fromMigrate': {'$ne': True},
+            'ns': {'$in': ['test.mcsharded', 'test.mcunsharded',
+                           re.compile(r'\A[^.]*\.\$cmd\Z')]}
+        }
+
         # timestamp = None
         cursor1 = self.opman1.get_oplog_cursor(None)
-        oplog1 = self.shard1_conn["local"]["oplog.rs"].find(
-            {'op': {'$ne': 'n'}})
+        oplog1 = self.shard1_conn["local"]["oplog.rs"].find(replicated)
         self.assertEqual(list(cursor1), list(oplog1))
 
         cursor2 = self.opman2.get_oplog_cursor(None)
-        oplog2 = self.shard2_conn["local"]["oplog.rs"].find(
-            {'op': {'$ne': 'n'}})
+        oplog2 = self.shard2_conn["local"]["oplog.rs"].find(replicated)
         self.assertEqual(list(cursor2), list(oplog2))
 
         # earliest entry is the only one at/after timestamp
@@ -198,10 +205,10 @@ class TestOplogManagerShardedSingle(ShardedClusterTestCase):
                 "i": i
             })
         oplog1 = self.shard1_conn["local"]["oplog.rs"].find(
-            sort=[("ts", pymongo.ASCENDING)]
+            replicated, sort=[("ts", pymongo.ASCENDING)]
         )
         oplog2 = self.shard2_conn["local"]["oplog.rs"].find(
-            sort=[("ts", pymongo.ASCENDING)]
+            replicated, sort=[("ts", pymongo.ASCENDING)]
         )
 
         # oplogs should have records for inserts performed, plus
@@ -337,7 +344,7 @@ class TestOplogManagerShardedSingle(ShardedClusterTestCase):
 
         # No last checkpoint, no collection dump, stuff in oplog
         # If collection dump is false the checkpoint should not be set
-        progress = LockingDict()
+        progress = ProgressSlots()
         self.opman1.oplog_progress = self.opman2.oplog_progress = progress
         self.opman1.collection_dump = self.opman2.collection_dump = False
         self.opman1.checkpoint = self.opman2.checkpoint = None
@@ -446,8 +453,7 @@ class TestOplogManagerShardedSingle(ShardedClusterTestCase):
             str(self.opman2.oplog): bson_ts_to_long(first_oplog_ts2)
         }
         # Set up oplog managers to use the old format.
-        oplog_progress = LockingDict()
-        oplog_progress.dict = progress
+        oplog_progress = ProgressSlots(progress)
         self.opman1.oplog_progress = oplog_progress
         self.opman2.oplog_progress = oplog_progress
         # Cause the oplog managers to update their checkpoints.
@@ -460,11 +466,11 @@ class TestOplogManagerShardedSingle(ShardedClusterTestCase):
         }
         self.assertEqual(
             new_format,
-            self.opman1.oplog_progress.get_dict()
+            self.opman1.oplog_progress.snapshot()
         )
         self.assertEqual(
             new_format,
-            self.opman2.oplog_progress.get_dict()
+            self.opman2.oplog_progress.snapshot()
         )
 
 
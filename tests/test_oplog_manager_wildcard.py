@@ -26,7 +26,7 @@ import pymongo
 sys.path[0:0] = [""]
 
 from mongo_connector.doc_managers.doc_manager_simulator import DocManager
-from mongo_connector.locking_dict import LockingDict
+from mongo_connector.progress_slots import ProgressSlots
 from mongo_connector.namespace_config import NamespaceConfig
 from mongo_connector.oplog_manager import OplogThread
 from mongo_connector.test_utils import (assert_soon,
@@ -52,7 +52,7 @@ class TestOplogManager(unittest.TestCase):
         self.opman = OplogThread(
             primary_client=self.primary_conn,
             doc_managers=(DocManager(),),
-            oplog_progress_dict=LockingDict(),
+            oplog_progress_dict=ProgressSlots(),
             namespace_config=self.namespace_config
         )
 
@@ -92,22 +92,29 @@ class TestOplogManager(unittest.TestCase):
         # Put something in the dbs
         self.init_dbs()
 
-        # timestamp is None - all oplog entries excluding no-ops are returned.
-        # wildcard include case no impact the result
+        # timestamp is None - all oplog entries excluding no-ops and
+        # entries in namespaces that are not replicated are returned.
+        commands = re.compile(r'\A[^.]*\.\$cmd\Z')
+        system = re.compile(r'\A[^.]*\.system\.')
         self.reset_opman(["includedb1.*", "includedb2.includecol1"], [], {})
 
         got_cursor = self.opman.get_oplog_cursor(None)
         oplog_cursor = self.oplog_coll.find(
-            {'op': {'$ne': 'n'}})
+            {'op': {'$ne': 'n'},
+             'ns': {'$in': [commands, re.compile(r'\Aincludedb1\.'),
+                            'includedb2.includecol1'],
+                    '$not': system}})
         self.assertNotEqual(got_cursor, None)
         self.assertEqual(got_cursor.count(), oplog_cursor.count())
 
-        # wildcard exclude case no impact the result
         self.reset_opman([], ["includedb2.excludecol2", "excludedb3.*"], {})
 
         got_cursor = self.opman.get_oplog_cursor(None)
         oplog_cursor = self.oplog_coll.find(
-            {'op': {'$ne': 'n'}})
+            {'op': {'$ne': 'n'},
+             '$or': [{'ns': commands},
+                     {'ns': {'$nin': [system, 'includedb2.excludecol2',
+                                      re.compile(r'\Aexcludedb3\.')]}}]})
         self.assertNotEqual(got_cursor, None)
         self.assertEqual(got_cursor.count(), oplog_cursor.count())
 
@@ -276,7 +283,7 @@ class TestOplogManager(unittest.TestCase):
         # No last checkpoint, no collection dump, something in oplog
         # If collection dump is false the checkpoint should not be set
         self.opman.checkpoint = None
-        self.opman.oplog_progress = LockingDict()
+        self.opman.oplog_progress = ProgressSlots()
         self.opman.collection_dump = False
         collection.insert_one({"idb1col1": 2})
         cursor, cursor_empty = self.opman.init_cursor()
@@ -0,0 +1,123 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests the ProgressSlots class.
+"""
+
+import sys
+import threading
+import warnings
+
+sys.path[0:0] = [""]
+
+from bson.timestamp import Timestamp
+
+from benchmarks.fake_mongo import FakeClient
+from mongo_connector.doc_managers.doc_manager_simulator import DocManager
+from mongo_connector.locking_dict import LockingDict
+from mongo_connector.namespace_config import NamespaceConfig
+from mongo_connector.oplog_manager import OplogThread
+from mongo_connector.progress_slots import ProgressSlots
+from tests import unittest
+
+
+class TestProgressSlots(unittest.TestCase):
+
+    def test_publish(self):
+        slots = ProgressSlots()
+        self.assertIsNone(slots.get('rs0'))
+        self.assertEqual(slots.snapshot(), {})
+        slots.publish('rs0', 1)
+        slots.publish('rs1', 2)
+        slots.publish('rs0', 3)
+        self.assertEqual(slots.get('rs0'), 3)
+        self.assertEqual(slots.snapshot(), {'rs0': 3, 'rs1': 2})
+
+        # Publishing None removes a value.
+        slots.publish('rs1', None)
+        slots.publish('rs2', None)
+        self.assertIsNone(slots.get('rs1'))
+        self.assertEqual(slots.snapshot(), {'rs0': 3})
+
+    def test_load(self):
+        slots = ProgressSlots({'rs0': 1})
+        self.assertEqual(slots.snapshot(), {'rs0': 1})
+        slots.load({'rs1': 2})
+        self.assertIsNone(slots.get('rs0'))
+        self.assertEqual(slots.snapshot(), {'rs1': 2})
+
+    def test_concurrent_publish(self):
+        slots = ProgressSlots()
+        snapshots = []
+
+        def publish(name):
+            for value in range(1, 1001):
+                slots.publish(name, value)
+
+        threads = [threading.Thread(target=publish, args=(name,))
+                   for name in range(16)]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            snapshots.append(slots.snapshot())
+        for thread in threads:
+            thread.join()
+
+        # Values only ever move forward between snapshots.
+        for older, newer in zip(snapshots, snapshots[1:]):
+            for name in older:
+                self.assertGreaterEqual(newer[name], older[name])
+        self.assertEqual(slots.snapshot(),
+                         dict((name, 1000) for name in range(16)))
+
+
+class TestLockingDict(unittest.TestCase):
+
+    def locking_dict(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            progress = LockingDict()
+        self.assertEqual(len(caught), 1)
+        self.assertIs(caught[0].category, DeprecationWarning)
+        return progress
+
+    def test_progress_slots_interface(self):
+        progress = self.locking_dict()
+        with progress:
+            progress.get_dict()['rs0'] = 1
+        progress.publish('rs1', 2)
+        self.assertEqual(progress.get('rs0'), 1)
+        self.assertEqual(progress.snapshot(), {'rs0': 1, 'rs1': 2})
+        progress.publish('rs0', None)
+        self.assertEqual(progress.get_dict(), {'rs1': 2})
+        progress.load({'rs2': 3})
+        self.assertEqual(progress.snapshot(), {'rs2': 3})
+
+    def test_oplog_thread(self):
+        client = FakeClient([{'ts': Timestamp(1, 0), 'op': 'n', 'ns': '',
+                              'o': {}}])
+        progress = self.locking_dict()
+        with progress:
+            progress.get_dict()[client.set_name] = Timestamp(1, 0)
+        opman = OplogThread(client, (DocManager(),), progress,
+                            NamespaceConfig())
+        self.assertEqual(opman.read_last_checkpoint(), Timestamp(1, 0))
+        opman.update_checkpoint(Timestamp(2, 0))
+        with progress:
+            self.assertEqual(progress.get_dict(),
+                             {client.set_name: Timestamp(2, 0)})
+
+
+if __name__ == '__main__':
+    unittest.main()
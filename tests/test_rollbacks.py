@@ -27,8 +27,9 @@ from pymongo.write_concern import WriteConcern
 sys.path[0:0] = [""]
 
 from mongo_connector.doc_managers.doc_manager_simulator import DocManager
-from mongo_connector.locking_dict import LockingDict
+from mongo_connector.progress_slots import ProgressSlots
 from mongo_connector.namespace_config import NamespaceConfig
+from mongo_connector import oplog_manager
 from mongo_connector.oplog_manager import OplogThread
 from mongo_connector.test_utils import (assert_soon,
                                         close_client,
@@ -73,7 +74,7 @@ class TestRollbacks(unittest.TestCase):
 
         # Oplog thread
         doc_manager = DocManager()
-        oplog_progress = LockingDict()
+        oplog_progress = ProgressSlots()
         self.opman = OplogThread(
             primary_client=self.main_conn,
             doc_managers=(doc_manager,),
@@ -312,6 +313,15 @@ class TestRollbacks(unittest.TestCase):
 
         self.opman.join()
 
+    def test_stressed_rollback_in_chunks(self):
+        """Test a rollback with many more documents than are reconciled at
+        once."""
+        batch_size = oplog_manager._ROLLBACK_BATCH_SIZE
+        self.addCleanup(setattr, oplog_manager, '_ROLLBACK_BATCH_SIZE',
+                        batch_size)
+        oplog_manager._ROLLBACK_BATCH_SIZE = 7
+        self.test_stressed_rollback()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,76 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests timing the stages of an OplogThread.
+"""
+
+import sys
+
+sys.path[0:0] = [""]
+
+from mongo_connector import metrics
+from mongo_connector.stage_timer import StageTimer
+from tests import unittest
+
+
+class TestStageTimer(unittest.TestCase):
+
+    def test_summary(self):
+        timer = StageTimer('rs0', 3600)
+        for i in range(1, 101):
+            timer.record('fetch', i / 1000.0)
+        timer.record('filter', 0.5)
+        summaries = timer.flush()
+        self.assertEqual(sorted(summaries), ['fetch', 'filter'])
+        fetch = summaries['fetch']
+        self.assertEqual(fetch['count'], 100)
+        self.assertAlmostEqual(fetch['total'], 5.05)
+        self.assertEqual(fetch['p50'], 0.05)
+        self.assertEqual(fetch['p90'], 0.09)
+        self.assertEqual(fetch['p99'], 0.099)
+        self.assertEqual(fetch['max'], 0.1)
+        self.assertEqual(summaries['filter']['p50'], 0.5)
+
+        # Each flush starts a new interval.
+        self.assertEqual(timer.flush(), {})
+
+    def test_sample_is_bounded(self):
+        timer = StageTimer('rs0', 3600)
+        for _ in range(10000):
+            timer.record('decode', 0.001)
+        timer.record('decode', 1)
+        summary = timer.flush()['decode']
+        self.assertEqual(summary['count'], 10001)
+        self.assertEqual(summary['max'], 1)
+        self.assertEqual(summary['p50'], 0.001)
+
+    def test_interval(self):
+        timer = StageTimer('rs-interval', 0)
+        # Every interval is over at once, so each duration is reported.
+        with timer.time('apply_batch'):
+            pass
+        self.assertEqual(timer.flush(), {})
+        calls = metrics.REGISTRY.get('mongo_connector_stage_calls_total')
+        self.assertEqual(calls.labels('rs-interval', 'apply_batch').value(),
+                         1)
+
+    def test_timed_iter(self):
+        timer = StageTimer('rs0', 3600)
+        self.assertEqual(list(timer.timed_iter(range(3), 'fetch')),
+                         [0, 1, 2])
+        self.assertEqual(timer.flush()['fetch']['count'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+# Copyright 2017 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests the TimestampIndex class and TimestampIndexMixin.
+"""
+
+import sys
+
+sys.path[0:0] = [""]
+
+from mongo_connector.doc_managers.doc_manager_simulator import DocManager
+from mongo_connector.doc_managers.timestamp_index import TimestampIndex
+from tests import unittest
+
+
+class TestTimestampIndex(unittest.TestCase):
+
+    def test_range(self):
+        index = TimestampIndex()
+        self.assertEqual(index.range(0, 10), [])
+        for ts, key in [(1, 'a'), (5, 'b'), (3, 'c'), (5, 'd'), (9, 'e')]:
+            index.add(key, ts, key)
+        self.assertEqual(index.range(3, 5), ['c', 'b', 'd'])
+        self.assertEqual(index.range(0, 100), ['a', 'c', 'b', 'd', 'e'])
+        self.assertEqual(index.range(6, 8), [])
+
+        # Writing a key again moves it.
+        index.add('a', 7, 'a2')
+        self.assertEqual(index.range(0, 3), ['c'])
+        self.assertEqual(index.range(6, 8), ['a2'])
+        index.remove('b')
+        self.assertEqual(index.range(5, 5), ['d'])
+        self.assertEqual(len(index), 4)
+
+    def test_last(self):
+        index = TimestampIndex()
+        self.assertIsNone(index.last())
+        index.add('a', 1, 'a')
+        index.add('b', 2, 'b')
+        self.assertEqual(index.last(), 'b')
+        index.remove('b')
+        self.assertEqual(index.last(), 'a')
+        index.add('a', 3, 'a2')
+        self.assertEqual(index.last(), 'a2')
+        index.clear()
+        self.assertIsNone(index.last())
+
+    def test_compact(self):
+        index = TimestampIndex()
+        for ts in range(10000):
+            index.add('a', ts, ts)
+        self.assertEqual(len(index), 1)
+        self.assertLess(len(index._order), 2000)
+        self.assertEqual(index.range(0, 10000), [9999])
+
+
+class TestTimestampIndexMixin(unittest.TestCase):
+
+    def test_simulator_search(self):
+        docman = DocManager()
+        self.assertIsNone(docman.get_last_doc())
+        docman.upsert({'_id': 1}, 'test.test', 10)
+        docman.upsert({'_id': 2}, 'test.test', 20)
+        docman.upsert({'_id': 3}, 'test.other', 30)
+        docman.remove(2, 'test.test', 40)
+
+        self.assertEqual(list(docman.search(15, 35)),
+                         [{'_id': 3, 'ns': 'test.other', '_ts': 30}])
+        # Removed documents are found too.
+        self.assertEqual(list(docman.search(35, 45)),
+                         [{'_id': 2, 'ns': 'test.test', '_ts': 40}])
+        self.assertEqual(docman.get_last_doc(),
+                         {'_id': 2, 'ns': 'test.test', '_ts': 40})
+
+        docman._delete()
+        self.assertEqual(list(docman.search(0, 100)), [])
+        self.assertIsNone(docman.get_last_doc())
+
+
+if __name__ == '__main__':
+    unittest.main()
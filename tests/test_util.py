@@ -14,16 +14,24 @@
 
 """Tests methods in util.py
 """
+import os
+import shutil
 import sys
+import tempfile
 
-from bson import timestamp
-from pymongo import errors
+from bson import BSON, timestamp
+from bson.codec_options import CodecOptions
+from pymongo import errors, version_tuple
 
 sys.path[0:0] = [""]
 
 from mongo_connector.util import (bson_ts_to_long,
+                                  decode_oplog_entry,
                                   long_to_bson_ts,
-                                  retry_until_ok)
+                                  read_preference,
+                                  retry_until_ok,
+                                  write_file_atomically,
+                                  RawBSONDocument)
 from tests import unittest
 
 
@@ -94,6 +102,54 @@ class TestUtil(unittest.TestCase):
             retry_until_ok(err_func, RuntimeError)
         self.assertEqual(err_func.counter, 1)
 
+    @unittest.skipIf(RawBSONDocument is None,
+                     'Raw BSON requires PyMongo 3.2 or later.')
+    def test_decode_oplog_entry(self):
+        """Test decode_oplog_entry decodes raw documents.
+        """
+        codec_options = CodecOptions()
+        raw = RawBSONDocument(BSON.encode({
+            'op': 'u', 'ns': 'test.test',
+            'o2': {'_id': 1}, 'o': {'$set': {'a': {'b': 1}}}}))
+        entry = dict(raw)
+        decoded = decode_oplog_entry(entry, codec_options)
+        self.assertEqual(decoded, {'op': 'u', 'ns': 'test.test',
+                                   'o2': {'_id': 1},
+                                   'o': {'$set': {'a': {'b': 1}}}})
+        self.assertIs(type(decoded['o']), dict)
+        # The original entry is not modified.
+        self.assertIsInstance(entry['o'], RawBSONDocument)
+        # Entries that are already decoded are returned as they are.
+        self.assertEqual(decode_oplog_entry(decoded, codec_options), decoded)
+
+    @unittest.skipIf(version_tuple < (3, 4),
+                     'maxStalenessSeconds requires PyMongo 3.4 or later.')
+    def test_read_preference(self):
+        """Test creating read preferences from their mode names.
+        """
+        self.assertIsNone(read_preference('primary'))
+        read_pref = read_preference('secondaryPreferred', 120)
+        self.assertEqual(read_pref.mongos_mode, 'secondaryPreferred')
+        self.assertEqual(read_pref.max_staleness, 120)
+        self.assertEqual(read_preference('nearest').max_staleness, -1)
+
+    def test_write_file_atomically(self):
+        """Test write_file_atomically replaces the file without leaving a
+        temporary file behind.
+        """
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        path = os.path.join(temp_dir, 'oplog.timestamp')
+
+        write_file_atomically(path, 'first')
+        with open(path) as written:
+            self.assertEqual(written.read(), 'first')
+
+        write_file_atomically(path, 'second')
+        with open(path) as written:
+            self.assertEqual(written.read(), 'second')
+        self.assertEqual(os.listdir(temp_dir), ['oplog.timestamp'])
+
 
 if __name__ == '__main__':
 